@@ -34,6 +34,40 @@ class Settings(BaseSettings):
     germlines_path: str = "app/database/germlines"
     igdata_path: str = "app/database/igblast"
     blastdb_path: str = "app/database/blast"
+    # Compiled germline references (python -m app.services.germline_bundle build)
+    germline_bundle_path: str = "instance/germlines.bundle"
+
+    # Alignment Settings
+    # Rows ordered exactly by average linkage; larger alignments use representatives
+    alignment_order_exact_limit: int = 3000
+    # Chains with more sequences than this are aligned through greedy-cluster
+    # representatives at the given identity, capped at alignment_max_representatives
+    alignment_cluster_above: int = 1000
+    alignment_cluster_identity: float = 0.95
+    alignment_max_representatives: int = 1000
+    # Size budgets of the alignment cache stores (per project and across projects)
+    alignment_cache_project_bytes: int = 268435456  # 256MB
+    alignment_cache_total_bytes: int = 2147483648  # 2GB
+    # Seconds between rescans of every store for the total budget (writes of
+    # this process are counted as they happen)
+    alignment_cache_rescan_interval: float = 60.0
+    # Memoized alignment keys (per project version and gene pair)
+    alignment_key_cache_entries: int = 4096
+    # Background warm-up of the most populated gene pairs after ingestion (0 disables)
+    alignment_warmup_pairs: int = 10
+    alignment_warmup_workers: int = 1
+    alignment_warmup_pause: float = 1.0  # seconds between pairs
+    alignment_warmup_nice: int = 10
+    # Distance matrices up to this size are clustered with optimal leaf ordering
+    # (cubic cost); larger ones get the plain average-linkage leaf order
+    distance_optimal_order_limit: int = 1000
+    # Germline-rooted lineage trees of clones with at least this many cells
+    lineage_min_clone_size: int = 3
+    lineage_workers: int = 2
+    # Cross-project sequence search: k-mer candidates aligned per query
+    sequence_search_candidates: int = 200
+    # Group-by aggregation results (and column codes) kept in memory, per process
+    aggregation_cache_entries: int = 256
 
     # Logging
     log_level: str = "INFO"
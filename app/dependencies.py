@@ -24,6 +24,7 @@ async def get_project_data(project: Project = Depends(get_project)) -> tuple:
             "vdj_path": project.vdj_path,
             "adata_path": project.adata_path,
             "project_name": project.project_name,
+            "species": project.species,
         }
         return await load_project(project_dict)
     except Exception as e:
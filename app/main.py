@@ -10,6 +10,7 @@ from app.routers import project_selection, analyze, auth
 from app.database import init_db, get_db
 from app.core.config import get_settings
 from app.core.sessions import SessionMiddleware
+from app.services.germline_bundle import load_bundle
 from sqlalchemy.orm import Session
 
 settings = get_settings()
@@ -29,6 +30,9 @@ async def lifespan(app: FastAPI):
         watch=True,  # Enable watch mode for development
     )
 
+    # Memory-map the compiled germline references, if they have been built
+    load_bundle()
+
     yield  # The code after this is called on shutdown
 
     process.terminate()  # Terminate the compiler on shutdown
@@ -1,24 +1,21 @@
-from fastapi import APIRouter, Depends, Request, Form, HTTPException
+from fastapi import APIRouter, Depends, Request, Form, HTTPException, Query
 from fastapi import status as http_status
 from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi import Response as FastAPIResponse
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 import re
 import pandas as pd
 import os
 import json
-from Bio import Phylo
-from Bio.Phylo.TreeConstruction import DistanceCalculator, DistanceTreeConstructor
 
-from Bio.Seq import Seq
-from Bio.SeqRecord import SeqRecord
-from Bio.Align import MultipleSeqAlignment
 from Bio.Phylo.Newick import Tree as NewickTree
+from bokeh.embed import components
+from bokeh.resources import CDN
 
-from Bio import AlignIO
 import numpy as np
 from scipy.spatial.distance import pdist, squareform
 
@@ -27,7 +24,6 @@ from ..database import get_db, Project
 from ..services.ddl import (
     load_project,
     lazy_classifier,
-    compute_alignment_and_consensus,
     best_translation,
 )
 from ..dependencies import (
@@ -37,10 +33,64 @@ from ..dependencies import (
     get_project_or_404,
 )
 from ..schemas.forms import GeneSelect
-from app.services.germline_annotation import get_germline_and_annotation
-
-import subprocess
-from io import StringIO
+from app.services.aggregation import AGGREGATIONS, cached_aggregate
+from app.services.alignment_codec import (
+    PACKED_MEDIA_TYPE,
+    chain_alignment,
+    compact_response,
+    expand_to_legacy,
+    pack_binary,
+)
+from app.services.alignment_cache import (
+    alignment_summary,
+    artifact_key,
+    project_cache,
+    read_metadata,
+    read_window,
+)
+from app.services.alignments import alignment_key, cached_alignment
+from app.services.cdr3 import cached_cdr3_analysis
+from app.services.distance_tiles import (
+    MATRIX_FORMATS,
+    MATRIX_MEDIA_TYPE,
+    MAX_TILE_SIZE,
+    encode_values,
+    matrix_tile,
+    pack_matrix,
+    tile_in_matrix,
+    tile_levels,
+)
+from app.services.bokeh_logo import AMINO_ACIDS, logo_figure
+from app.services.distances import (
+    cached_matrix_clustering,
+    cached_mismatch_matrix,
+    matrix_sequences,
+)
+from app.services.lineages import (
+    lineage_key,
+    lineage_status,
+    read_lineage,
+    read_lineage_index,
+    start_lineages,
+)
+from app.services.kmer_index import INDEX_ALPHABET, KMER_SIZE, SEARCH_REGIONS, search
+from app.services.logos import cached_gene_pfm, logo_genes
+from app.services.mutation_profile import cached_mutation_profile
+from app.services.pairing import cached_pairing_matrix, dense_counts, filter_values
+from app.services.tree_layout import LAYOUT_STYLES, cached_layout, layout_view
+from app.services.trees import (
+    COLLAPSE_MODES,
+    TREE_METHODS,
+    cached_collapsed_tree,
+    cached_tree,
+)
+from app.services.warmup import (
+    cancel_warmup,
+    interactive_request,
+    start_warmup,
+    warmup_status,
+)
+from app.services.versioning import project_version
 
 router = APIRouter(prefix="/analyze", tags=["analyze"])
 
@@ -49,6 +99,12 @@ templates = Jinja2Templates(directory="app/templates")
 # Track alignment computation status
 alignment_status: Dict[str, Dict] = {}
 
+# Largest slice served by the alignment window endpoint
+MAX_WINDOW_ROWS = 2000
+MAX_WINDOW_COLS = 1000
+# Most matches returned by the sequence search endpoint
+MAX_SEARCH_RESULTS = 200
+
 
 def get_alignment_key(project_name: str, hc_gene: str, lc_gene: str) -> str:
     """Generate a unique key for alignment status tracking."""
@@ -60,6 +116,11 @@ def safe_gene(g: str) -> str:
     return g.replace("/", "_").replace("*", "_").replace("|", "_").replace(" ", "_")
 
 
+def merged_version(project: Project) -> Optional[str]:
+    """Return the version of a project's merged dataset (see `project_version`)."""
+    return project_version(os.path.dirname(project.vdj_path or ""))
+
+
 @router.get(
     "/alignment_status/{project_id}/{hc_gene}/{lc_gene}",
     response_class=JSONResponse,
@@ -77,6 +138,110 @@ async def get_alignment_status(
     return JSONResponse(content=status)
 
 
+@router.get(
+    "/cache_stats/{project_id}",
+    response_class=JSONResponse,
+    name="analyze.cache_stats",
+)
+async def cache_stats(
+    project_id: int,
+    project: Project = Depends(get_project),
+):
+    """Get size and hit/miss/eviction statistics of the project's alignment cache."""
+    return JSONResponse(content=project_cache(project.project_name).stats())
+
+
+@router.get(
+    "/warmup_status/{project_id}",
+    response_class=JSONResponse,
+    name="analyze.warmup_status",
+)
+async def get_warmup_status(
+    project_id: int,
+    project: Project = Depends(get_project),
+):
+    """Get the progress of the project's background alignment warm-up."""
+    return JSONResponse(content=warmup_status(project.project_name))
+
+
+@router.post(
+    "/warmup/{project_id}",
+    response_class=JSONResponse,
+    name="analyze.warmup",
+)
+async def warmup(
+    project_id: int,
+    cancel: bool = False,  # Query parameter: cancel=true stops a running warm-up
+    project: Project = Depends(get_project),
+):
+    """Start (or cancel) the background alignment warm-up of a project."""
+    if cancel:
+        cancel_warmup(project.project_name)
+    else:
+        start_warmup(project.project_name, project.species, project.vdj_path)
+    return JSONResponse(content=warmup_status(project.project_name))
+
+
+@router.post(
+    "/lineages/{project_id}",
+    response_class=JSONResponse,
+    name="analyze.lineages",
+)
+async def lineages(
+    project_id: int,
+    project: Project = Depends(get_project),
+):
+    """Start building germline-rooted lineage trees for every expanded clone."""
+    start_lineages(project.project_name, project.species, project.vdj_path)
+    return JSONResponse(content=lineage_status(project.project_name))
+
+
+@router.get(
+    "/lineage_status/{project_id}",
+    response_class=JSONResponse,
+    name="analyze.lineage_status",
+)
+async def get_lineage_status(
+    project_id: int,
+    project: Project = Depends(get_project),
+):
+    """Get the progress of the project's lineage-tree job."""
+    return JSONResponse(content=lineage_status(project.project_name))
+
+
+@router.get(
+    "/lineage_tree/{project_id}/{clone_id}",
+    response_class=JSONResponse,
+    name="analyze.lineage_tree",
+)
+async def lineage_tree(
+    project_id: int,
+    clone_id: str,
+    project: Project = Depends(get_project),
+    project_data: tuple = Depends(get_project_data),
+):
+    """Return the germline-rooted lineage tree of one clone."""
+    _, _, merged_df = project_data
+    key = lineage_key(project.project_name, project.species, merged_df, merged_version(project))
+    cache = project_cache(project.project_name)
+    index = read_lineage_index(cache, key)
+    if index is None:
+        return JSONResponse(
+            status_code=404,
+            content={
+                "error": "Lineage trees have not been built for this project",
+                "status": lineage_status(project.project_name),
+            },
+        )
+    record = read_lineage(cache, key, index, clone_id)
+    if record is None:
+        return JSONResponse(
+            status_code=404,
+            content={"error": f"No lineage tree for clone {clone_id}"},
+        )
+    return JSONResponse(content=record)
+
+
 @router.get("/graphs/{project_id}", response_class=HTMLResponse, name="analyze.graphs")
 async def graphs(
     request: Request,
@@ -87,11 +252,24 @@ async def graphs(
     """Generate graphs for a project."""
     vdj, adata, merged_df = project_data
     df = merged_df  # Use the pre-merged dataset instead of vdj.metadata
+    version = merged_version(project)
 
     # Prepare data for Chart.js
     def prepare_chart_data(column):
-        counts = df[column].value_counts()
-        return {"labels": counts.index.tolist(), "values": counts.values.tolist()}
+        rows = cached_aggregate(df, version, [column])["rows"]
+        return {
+            "labels": [row[column] for row in rows],
+            "values": [row["count"] for row in rows],
+        }
+
+    # Histogram of V-region nucleotide mutation, in whole percents
+    def prepare_shm_data(column, max_percent=20):
+        if column not in df:
+            return {"labels": [], "values": []}
+        percent = (df[column].dropna() * 100).astype(int).clip(upper=max_percent)
+        counts = percent.value_counts().reindex(range(max_percent + 1), fill_value=0)
+        labels = [f"{i}%" for i in counts.index[:-1]] + [f">={max_percent}%"]
+        return {"labels": labels, "values": counts.values.tolist()}
 
     chart_data = {
         # Heavy chain data
@@ -99,10 +277,12 @@ async def graphs(
         "c_call": prepare_chart_data("c_call_VDJ"),
         "j_call": prepare_chart_data("j_call_VDJ"),
         "isotype": prepare_chart_data("isotype"),
+        "shm": prepare_shm_data("mu_freq_VDJ"),
         # Light chain data
         "lc_v_call": prepare_chart_data("v_call_VJ"),
         "lc_c_call": prepare_chart_data("c_call_VJ"),
         "lc_j_call": prepare_chart_data("j_call_VJ"),
+        "lc_shm": prepare_shm_data("mu_freq_VJ"),
     }
     print(f"Debug chart_data: {chart_data}")
     return templates.TemplateResponse(
@@ -130,208 +310,404 @@ async def lc_aggregation(
 ):
     """Return LC gene aggregation for a selected HC gene."""
     vdj, adata, merged_df = project_data
-    df = merged_df  # Use the pre-merged dataset
-    # Filter for the selected HC gene (v_call_VDJ)
-    filtered = df[df["v_call_VDJ"] == hc_gene]
-    # Count LC genes (v_call_VJ)
-    lc_counts = filtered["v_call_VJ"].value_counts().reset_index()
-    lc_counts.columns = ["gene", "count"]
-    result = lc_counts.to_dict(orient="records")
+    # Count LC genes (v_call_VJ) of the selected HC gene (v_call_VDJ)
+    rows = cached_aggregate(
+        merged_df,
+        merged_version(project),
+        ["v_call_VJ"],
+        filters={"v_call_VDJ": hc_gene},
+    )["rows"]
+    result = [{"gene": row["v_call_VJ"], "count": row["count"]} for row in rows]
     return JSONResponse(content={"lc_genes": result})
 
 
+@router.get(
+    "/aggregate/{project_id}",
+    response_class=JSONResponse,
+    name="analyze.aggregate",
+)
+async def aggregate(
+    project_id: int,
+    by: List[str] = Query(...),  # Query parameter, repeated: by=isotype&by=locus_VJ
+    agg: str = "count",  # Query parameter: agg=count, unique or mean
+    column: Optional[str] = None,
+    filter: List[str] = Query([]),  # Query parameter, repeated: filter=column:value
+    limit: Optional[int] = None,
+    project: Project = Depends(get_project),
+    project_data: tuple = Depends(get_project_data),
+):
+    """
+    Group the project's cells by any set of merged dataset columns and
+    return per-group cell counts, distinct values or means of `column`.
+    """
+    if agg not in AGGREGATIONS:
+        return JSONResponse(status_code=400, content={"error": f"Unknown aggregation {agg}"})
+    filters = {}
+    for item in filter:
+        name, sep, value = item.partition(":")
+        if not sep:
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"Filter {item} is not column:value"},
+            )
+        filters[name] = value
+    if limit is not None and limit < 1:
+        return JSONResponse(status_code=400, content={"error": "limit must be positive"})
+
+    _, _, merged_df = project_data
+    try:
+        result = await run_in_threadpool(
+            cached_aggregate,
+            merged_df,
+            merged_version(project),
+            by,
+            agg,
+            column,
+            filters,
+            limit,
+        )
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Error aggregating: {str(e)}"},
+        )
+    return JSONResponse(content=result)
+
+
+@router.get(
+    "/pairing_matrix/{project_id}",
+    response_class=JSONResponse,
+    name="analyze.pairing_matrix",
+)
+async def pairing_matrix(
+    project_id: int,
+    isotype: Optional[str] = None,
+    sample: Optional[str] = None,
+    format: str = "json",  # Query parameter: format=json or format=uint32
+    project: Project = Depends(get_project),
+    project_data: tuple = Depends(get_project_data),
+):
+    """
+    Return the cell count of every HC V x LC V gene pair, optionally for one
+    isotype and/or sample.
+
+    ``format=json`` returns the gene labels, per-gene totals and the non-zero
+    entries as parallel ``rows``/``cols``/``counts`` lists. ``format=uint32``
+    returns the packed binary matrix: a ``<4sBI`` prefix, a JSON header with
+    the labels, then the dense row-major (HC x LC) counts.
+    """
+    if format not in ("json", "uint32"):
+        return JSONResponse(
+            status_code=400, content={"error": f"Unknown matrix format {format}"}
+        )
+    _, _, merged_df = project_data
+    try:
+        matrix = await run_in_threadpool(
+            cached_pairing_matrix,
+            project_cache(project.project_name),
+            merged_df,
+            merged_version(project),
+            isotype,
+            sample,
+        )
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Error computing pairing matrix: {str(e)}"},
+        )
+
+    if format == "uint32":
+        header = {
+            "hc_genes": matrix["hc_genes"],
+            "lc_genes": matrix["lc_genes"],
+            "shape": [len(matrix["hc_genes"]), len(matrix["lc_genes"])],
+            "dtype": "uint32",
+            "quantity": "cells",
+            "cells": matrix["cells"],
+            "filters": matrix["filters"],
+        }
+        body = dense_counts(matrix).astype("<u4").tobytes()
+        return Response(content=pack_matrix(header, body), media_type=MATRIX_MEDIA_TYPE)
+    return JSONResponse(content=matrix)
+
+
 def alignment_to_fasta(seqs, label_map):
     # seqs: list of (orig_id, sequence) tuples; label_map: dict orig_id -> user label
     return "\n".join([f">{label_map[orig_id]}\n{seq}" for orig_id, seq in seqs])
 
 
+async def load_alignment(
+    project: Project, project_data: tuple, hc_gene: str, lc_gene: str
+) -> dict:
+    """
+    Return the compact alignment result for a gene pair, computing and caching it
+    on first use. The content key it is cached under is returned as ``cache_key``.
+    """
+    key = get_alignment_key(project.project_name, hc_gene, lc_gene)
+    alignment_status[key] = {"status": "computing"}
+
+    try:
+        _, _, merged_df = project_data
+        with interactive_request():
+            # MUSCLE runs for seconds on large pairs; keep it off the event loop
+            cache_key, result = await run_in_threadpool(
+                cached_alignment,
+                project_cache(project.project_name),
+                merged_df,
+                hc_gene,
+                lc_gene,
+                project.species,
+                merged_version(project),
+            )
+
+        result["cache_key"] = cache_key
+        alignment_status[key] = {"status": "ready"}
+        return result
+
+    except Exception as e:
+        alignment_status[key] = {"status": "error", "message": str(e)}
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def load_alignment_metadata(
+    project: Project, project_data: tuple, hc_gene: str, lc_gene: str
+) -> tuple:
+    """Return the cache store, content key and residue-free metadata of an alignment."""
+    cache = project_cache(project.project_name)
+    _, _, merged_df = project_data
+    cache_key, _ = alignment_key(
+        merged_df, hc_gene, lc_gene, project.species, merged_version(project)
+    )
+    metadata = read_metadata(cache, cache_key)
+    if metadata is None:
+        await load_alignment(project, project_data, hc_gene, lc_gene)
+        metadata = read_metadata(cache, cache_key)
+    return cache, cache_key, metadata
+
+
 @router.get(
     "/hc_lc_alignment_data/{project_id}/{hc_gene}/{lc_gene}",
     response_class=JSONResponse,
     name="analyze.hc_lc_alignment_data",
 )
 async def hc_lc_alignment_data(
+    request: Request,
     project_id: int,
     hc_gene: str,
     lc_gene: str,
+    compact: bool = False,  # Query parameter: compact=true for the compact JSON layout
     project: Project = Depends(get_project),
     project_data: tuple = Depends(get_project_data),
 ):
-    """Generate and cache alignment data."""
-    key = get_alignment_key(project.project_name, hc_gene, lc_gene)
-    alignment_status[key] = {"status": "computing"}
+    """
+    Generate and cache alignment data.
+
+    Clients sending ``Accept: application/octet-stream`` receive the packed-bytes
+    payload, ``compact=true`` returns one copy of each alignment plus a bit-packed
+    match mask, and the default is the legacy JSON layout.
+    """
+    result = await load_alignment(project, project_data, hc_gene, lc_gene)
+
+    if PACKED_MEDIA_TYPE in request.headers.get("accept", ""):
+        return Response(content=pack_binary(result), media_type=PACKED_MEDIA_TYPE)
+    if compact:
+        return JSONResponse(content=compact_response(result))
+    return JSONResponse(content=expand_to_legacy(result))
+
+
+@router.get(
+    "/alignment_summary/{project_id}/{hc_gene}/{lc_gene}",
+    response_class=JSONResponse,
+    name="analyze.alignment_summary",
+)
+async def hc_lc_alignment_summary(
+    project_id: int,
+    hc_gene: str,
+    lc_gene: str,
+    chain: str = "hc",  # Query parameter: chain=hc or chain=lc
+    project: Project = Depends(get_project),
+    project_data: tuple = Depends(get_project_data),
+):
+    """Return dimensions, row ordering, consensus and region blocks of a cached alignment."""
+    if chain not in ("hc", "lc"):
+        return JSONResponse(status_code=400, content={"error": f"Unknown chain {chain}"})
+
+    _, _, metadata = await load_alignment_metadata(
+        project, project_data, hc_gene, lc_gene
+    )
+    return JSONResponse(content=alignment_summary(metadata, chain))
+
 
+@router.get(
+    "/alignment_window/{project_id}/{hc_gene}/{lc_gene}",
+    response_class=JSONResponse,
+    name="analyze.alignment_window",
+)
+async def hc_lc_alignment_window(
+    project_id: int,
+    hc_gene: str,
+    lc_gene: str,
+    chain: str = "hc",  # Query parameter: chain=hc or chain=lc
+    row_start: int = 0,
+    row_end: int = 200,
+    col_start: int = 0,
+    col_end: int = 200,
+    project: Project = Depends(get_project),
+    project_data: tuple = Depends(get_project_data),
+):
+    """Return a row range x column range slice of a cached alignment."""
+    if chain not in ("hc", "lc"):
+        return JSONResponse(status_code=400, content={"error": f"Unknown chain {chain}"})
+    if row_end - row_start > MAX_WINDOW_ROWS or col_end - col_start > MAX_WINDOW_COLS:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "error": f"Window too large (max {MAX_WINDOW_ROWS} rows x {MAX_WINDOW_COLS} columns)"
+            },
+        )
+
+    cache, cache_key, _ = await load_alignment_metadata(
+        project, project_data, hc_gene, lc_gene
+    )
+    window = read_window(
+        cache, cache_key, chain, row_start, row_end, col_start, col_end
+    )
+    if window is None:
+        return JSONResponse(status_code=404, content={"error": "Alignment cache not found"})
+    return JSONResponse(content=window)
+
+
+@router.get(
+    "/mutation_profile/{project_id}/{hc_gene}/{lc_gene}",
+    response_class=JSONResponse,
+    name="analyze.mutation_profile",
+)
+async def hc_lc_mutation_profile(
+    project_id: int,
+    hc_gene: str,
+    lc_gene: str,
+    chain: str = "hc",  # Query parameter: chain=hc or chain=lc
+    project: Project = Depends(get_project),
+    project_data: tuple = Depends(get_project_data),
+):
+    """
+    Return per-IMGT-position substitution frequencies, replacement/silent
+    counts and region summaries of one chain of a gene pair against its
+    germline, plus the IMGT position of every column of the cached alignment.
+    """
+    _, _, merged_df = project_data
+    chain = "lc" if chain == "lc" else "hc"
     try:
-        # --- File-based cache setup ---
-        project_name = project.project_name
-        align_dir = os.path.join(
-            "instance", "uploads", project_name, project_name, "alignments"
-        )
-        os.makedirs(align_dir, exist_ok=True)
-        cache_file = os.path.join(
-            align_dir, f"alignment_{safe_gene(hc_gene)}_{safe_gene(lc_gene)}.json"
-        )
-
-        # Try to load from cache
-        if os.path.exists(cache_file):
-            with open(cache_file, "r") as f:
-                result = json.load(f)
-                alignment_status[key] = {"status": "ready"}
-                return JSONResponse(content=result)
-
-        # Otherwise, compute and cache
-        vdj, _, merged_df = project_data
-        # Use the pre-merged dataset instead of calling merge_data
-        filtered = merged_df[
-            (merged_df["v_call_VDJ"] == hc_gene) & (merged_df["v_call_VJ"] == lc_gene)
-        ].copy()
-
-        for col in ("IGH", "IGK", "IGL"):
-            filtered[col] = filtered[col].apply(best_translation)
-
-        hc_table = (
-            filtered[filtered["locus_VDJ"] == "IGH"][
-                ["IGH", "sequence_id", "isotype", "clone_id", "display_name"]
-            ]
-            .drop_duplicates()
-            .to_dict(orient="records")
-        )
-
-        if lc_gene.startswith("IGK"):
-            lc_col = "IGK"
-        elif lc_gene.startswith("IGL"):
-            lc_col = "IGL"
-        else:
-            lc_col = None
-
-        lc_table = (
-            filtered[[lc_col, "sequence_id", "isotype", "clone_id", "display_name"]]
-            .drop_duplicates()
-            .to_dict(orient="records")
-            if lc_col
-            else []
-        )
-
-        hc_ids = [
-            row["sequence_id"]
-            for row in hc_table
-            if row["IGH"] and isinstance(row["IGH"], str) and row["IGH"].strip()
-        ]
-        hc_seqs = [
-            row["IGH"]
-            for row in hc_table
-            if row["IGH"] and isinstance(row["IGH"], str) and row["IGH"].strip()
-        ]
-        lc_ids = [
-            row["sequence_id"]
-            for row in lc_table
-            if lc_col
-            and row.get(lc_col)
-            and isinstance(row[lc_col], str)
-            and row[lc_col].strip()
-        ]
-        lc_seqs = [
-            row[lc_col]
-            for row in lc_table
-            if lc_col
-            and row.get(lc_col)
-            and isinstance(row[lc_col], str)
-            and row[lc_col].strip()
-        ]
-
-        # Create meaningful label maps using display names with chain suffixes
-        def create_label_map(table_rows, ids, chain_suffix):
-            label_map = {}
-            for i, orig_id in enumerate(ids):
-                # Find the corresponding row to get the display name
-                matching_row = next(
-                    (row for row in table_rows if row["sequence_id"] == orig_id), None
-                )
-                if matching_row and "display_name" in matching_row:
-                    label = f"{matching_row['display_name']}-{chain_suffix}"
-                else:
-                    # Fallback to sequence_id if display_name not found
-                    label = f"{orig_id}-{chain_suffix}"
-                label_map[orig_id] = label
-            return label_map
-
-        hc_label_map = create_label_map(hc_table, hc_ids, "HC")
-        lc_label_map = create_label_map(lc_table, lc_ids, "LC")
-
-        hc_alignment, hc_consensus, hc_match_matrix = compute_alignment_and_consensus(
-            hc_seqs, hc_ids
-        )
-        lc_alignment, lc_consensus, lc_match_matrix = compute_alignment_and_consensus(
-            lc_seqs, lc_ids
-        )
-
-        species = project.species
-        germ_anno = get_germline_and_annotation(hc_gene, species, "hc")
-        hc_json = []
-        hc_region_blocks = None
-        if germ_anno:
-            germ_seq, region_arr, region_blocks = germ_anno
-            hc_region_blocks = region_blocks
-            if region_arr:
-                region_str = "".join(region_arr)
-                hc_json.append({"name": "Region", "seq": region_str})
-            hc_json.append({"name": "Germline", "seq": germ_seq})
-
-        hc_json.extend(
-            [
-                {"name": hc_label_map[orig_id], "seq": seq}
-                for orig_id, seq in hc_alignment
-            ]
-        )
-        if hc_consensus:
-            hc_json.append({"name": "Consensus", "seq": hc_consensus})
-
-        lc_region_blocks = None
-        germ_anno_lc = get_germline_and_annotation(lc_gene, species, "lc")
-        lc_json = []
-        if germ_anno_lc:
-            lc_seq, lc_region_arr, lc_blocks = germ_anno_lc
-            lc_region_blocks = lc_blocks
-            if lc_region_arr:
-                region_str = "".join(lc_region_arr)
-                lc_json.append({"name": "Region", "seq": region_str})
-            lc_json.append({"name": "Germline", "seq": lc_seq})
-
-        lc_json.extend(
-            [
-                {"name": lc_label_map[orig_id], "seq": seq}
-                for orig_id, seq in lc_alignment
-            ]
-        )
-        if lc_consensus:
-            lc_json.append({"name": "Consensus", "seq": lc_consensus})
-
-        result = {
-            "hc_table": hc_table,
-            "lc_table": lc_table,
-            "hc_alignment": hc_alignment,
-            "hc_consensus": hc_consensus,
-            "hc_match_matrix": hc_match_matrix,
-            "lc_alignment": lc_alignment,
-            "lc_consensus": lc_consensus,
-            "lc_match_matrix": lc_match_matrix,
-            "hc_json": hc_json,
-            "lc_json": lc_json,
-            "hc_label_map": hc_label_map,
-            "lc_label_map": lc_label_map,
-            "hc_region_blocks": hc_region_blocks,
-            "lc_region_blocks": lc_region_blocks,
-        }
+        cache_data = await load_alignment(project, project_data, hc_gene, lc_gene)
+        profile = await run_in_threadpool(
+            cached_mutation_profile,
+            project_cache(project.project_name),
+            cache_data["cache_key"],
+            cache_data,
+            merged_df,
+            hc_gene,
+            lc_gene,
+            chain,
+            project.species,
+        )
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Error computing mutation profile: {str(e)}"},
+        )
+    if profile is None:
+        gene = hc_gene if chain == "hc" else lc_gene
+        return JSONResponse(
+            status_code=404, content={"error": f"No gapped germline for {gene}"}
+        )
+    return JSONResponse(content=profile)
 
-        with open(cache_file, "w") as f:
-            json.dump(result, f)
 
-        alignment_status[key] = {"status": "ready"}
-        return JSONResponse(content=result)
+@router.get(
+    "/cdr3_clusters/{project_id}",
+    response_class=JSONResponse,
+    name="analyze.cdr3_clusters",
+)
+async def cdr3_clusters(
+    project_id: int,
+    threshold: float = 0.2,  # Query parameter: normalized Hamming distance
+    project: Project = Depends(get_project),
+    project_data: tuple = Depends(get_project_data),
+):
+    """
+    Return the CDR3 length spectratype of both chains and the clusters of
+    equal-length CDR3s within `threshold` normalized Hamming distance.
+    """
+    if not 0 <= threshold < 1:
+        return JSONResponse(
+            status_code=400, content={"error": "threshold must be in [0, 1)"}
+        )
+    _, _, merged_df = project_data
+    try:
+        analysis = await run_in_threadpool(
+            cached_cdr3_analysis,
+            project_cache(project.project_name),
+            merged_df,
+            merged_version(project),
+            threshold,
+        )
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Error clustering CDR3s: {str(e)}"},
+        )
+    return JSONResponse(content=analysis)
+
+
+@router.get(
+    "/sequence_search",
+    response_class=JSONResponse,
+    name="analyze.sequence_search",
+)
+async def sequence_search(
+    query: str,
+    region: str = "sequence",  # Query parameter: region=sequence or region=cdr3
+    chain: Optional[str] = None,  # Query parameter: chain=hc or chain=lc
+    top: int = 20,
+    db: Session = Depends(get_db),
+):
+    """
+    Return the sequences of every project most similar to an amino-acid
+    query: k-mer index candidates verified by global alignment.
+    """
+    query = re.sub(r"\s+", "", query).upper()
+    if region not in SEARCH_REGIONS:
+        return JSONResponse(status_code=400, content={"error": f"Unknown region {region}"})
+    if chain not in (None, "hc", "lc"):
+        return JSONResponse(status_code=400, content={"error": f"Unknown chain {chain}"})
+    if len(query) < KMER_SIZE or set(query) - set(INDEX_ALPHABET):
+        return JSONResponse(
+            status_code=400,
+            content={
+                "error": f"Query must be at least {KMER_SIZE} standard amino acids"
+            },
+        )
+    if not 1 <= top <= MAX_SEARCH_RESULTS:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"top must be between 1 and {MAX_SEARCH_RESULTS}"},
+        )
 
+    try:
+        result = await run_in_threadpool(search, query, region, chain, top)
     except Exception as e:
-        alignment_status[key] = {"status": "error", "message": str(e)}
-        raise HTTPException(status_code=500, detail=str(e))
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Error searching sequences: {str(e)}"},
+        )
+    project_ids = {p.project_name: p.project_id for p in db.query(Project).all()}
+    for match in result["matches"]:
+        match["project_id"] = project_ids.get(match["project"])
+    return JSONResponse(content=result)
 
 
 @router.get(
@@ -373,10 +749,8 @@ async def gene_explorer(
 ):
     """Gene Explorer: List V genes and their counts."""
     vdj, adata, merged_df = project_data
-    df = merged_df  # Use the pre-merged dataset
-    v_counts = df["v_call_VDJ"].value_counts().reset_index()
-    v_counts.columns = ["gene", "count"]
-    v_genes = v_counts.to_dict(orient="records")
+    rows = cached_aggregate(merged_df, merged_version(project), ["v_call_VDJ"])["rows"]
+    v_genes = [{"gene": row["v_call_VDJ"], "count": row["count"]} for row in rows]
     return templates.TemplateResponse(
         "analyze/gene_explorer.html",
         get_template_context(
@@ -384,11 +758,102 @@ async def gene_explorer(
             project=project,
             project_id=project_id,
             v_genes=v_genes,
+            pairing_filters=filter_values(merged_df),
             active_tab="gene_explorer",
         ),
     )
 
 
+# Plot types offered by the logo page
+LOGO_PLOT_TYPES = ("seqlogo", "frequency")
+
+
+def render_logo_page(
+    request: Request,
+    project: Project,
+    project_id: int,
+    genes: list,
+    gene: Optional[str] = None,
+    plot_type: str = "seqlogo",
+    plot=None,
+):
+    """Render the logo page, with the Bokeh components of `plot` when given."""
+    context = {}
+    if plot is not None:
+        script, div = components((plot,))
+        context = {"script": script, "div": div, "resources": CDN.render()}
+    return templates.TemplateResponse(
+        "analyze/logo.html",
+        get_template_context(
+            request=request,
+            project=project,
+            project_id=project_id,
+            form=GeneSelect(genes),
+            selected_gene=gene,
+            plot_type=plot_type,
+            plot_types=LOGO_PLOT_TYPES,
+            active_tab="logo",
+            **context,
+        ),
+    )
+
+
+@router.get("/logo/{project_id}", response_class=HTMLResponse, name="analyze.logo_page")
+async def logo_page(
+    request: Request,
+    project_id: int,
+    project: Project = Depends(get_project),
+    project_data: tuple = Depends(get_project_data),
+):
+    """Sequence logo form: pick a heavy or light V gene."""
+    _, _, merged_df = project_data
+    return render_logo_page(request, project, project_id, logo_genes(merged_df))
+
+
+@router.post("/logo/{project_id}", response_class=HTMLResponse, name="analyze.logo")
+async def logo(
+    request: Request,
+    project_id: int,
+    gene: str = Form(...),
+    plot_type: str = Form("seqlogo"),
+    project: Project = Depends(get_project),
+    project_data: tuple = Depends(get_project_data),
+):
+    """
+    Draw the V-region logo of a gene in IMGT numbering.
+
+    The position frequency matrix is cached per (gene, chain) and sequence
+    content; the plot is one Bokeh renderer over a single data source.
+    """
+    _, _, merged_df = project_data
+    genes = logo_genes(merged_df)
+    if gene not in genes:
+        return JSONResponse(status_code=400, content={"error": f"Unknown gene {gene}"})
+    if plot_type not in LOGO_PLOT_TYPES:
+        return JSONResponse(
+            status_code=400, content={"error": f"Unknown plot type {plot_type}"}
+        )
+
+    pfm = await run_in_threadpool(
+        cached_gene_pfm,
+        project_cache(project.project_name),
+        merged_df,
+        merged_version(project),
+        gene,
+    )
+    chain_name = "Heavy" if pfm["chain"] == "hc" else "Light"
+    plot = logo_figure(
+        np.asarray(pfm["counts"], dtype=np.int64).reshape(-1, len(AMINO_ACIDS)),
+        AMINO_ACIDS,
+        plot_type,
+        width=24,
+        title=f"{gene} ({chain_name} chain, {pfm['sequences']} sequences, IMGT V region)",
+        positions=pfm["positions"],
+        n_sequences=pfm["sequences"],
+    )
+    return render_logo_page(request, project, project_id, genes, gene, plot_type, plot)
+
+
 async def get_hc_sequences(project_data: tuple, hc_gene: str, lc_gene: str):
     """Get heavy chain sequences for a project and gene pair."""
     vdj, _, merged_df = project_data
@@ -476,131 +941,142 @@ async def phylo_tree_newick(
     hc_gene: str,
     lc_gene: str,
     chain: str = "hc",  # Query parameter: chain=hc or chain=lc
+    method: str = "nj",  # Query parameter: method=nj or method=upgma
+    collapse: str = "none",  # Query parameter: collapse=none, identical or clone
     project: Project = Depends(get_project),
     project_data: tuple = Depends(get_project_data),
 ):
-    """Generate and return a Newick tree for the selected HC/LC gene pair using aligned sequences."""
+    """
+    Generate and return a Newick tree for the selected HC/LC gene pair using aligned sequences.
+
+    With ``collapse=identical`` or ``collapse=clone`` the response is JSON: the
+    Newick tree over weighted leaves plus each leaf's count, isotype mix and
+    member display names.
+    """
+    if method not in TREE_METHODS:
+        return JSONResponse(
+            status_code=400, content={"error": f"Unknown tree method {method}"}
+        )
+    if collapse not in COLLAPSE_MODES:
+        return JSONResponse(
+            status_code=400, content={"error": f"Unknown collapse mode {collapse}"}
+        )
+
     key = get_alignment_key(project.project_name, hc_gene, lc_gene)
     status = alignment_status.get(key, {"status": "not_started"})
 
-    if status["status"] == "not_started":
-        try:
-            await hc_lc_alignment_data(
-                project_id, hc_gene, lc_gene, project, project_data
-            )
-            status = alignment_status.get(key, {"status": "not_started"})
-        except Exception:
-            return FastAPIResponse(content="(A,B);", media_type="text/plain")
-
-    if status["status"] != "ready":
+    if status["status"] == "computing":
         return FastAPIResponse(content="(A,B);", media_type="text/plain")
 
-    project_name = project.project_name
-    cache_dir = os.path.join(
-        "instance", "uploads", project_name, project_name, "alignments"
-    )
-    cache_file_path = os.path.join(
-        cache_dir, f"alignment_{safe_gene(hc_gene)}_{safe_gene(lc_gene)}.json"
-    )
-
     try:
-        with open(cache_file_path, "r") as f:
-            cache_data = json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
+        cache_data = await load_alignment(project, project_data, hc_gene, lc_gene)
+    except Exception:
         return FastAPIResponse(content="(A,B);", media_type="text/plain")
 
-    # Check if we already have a cached Newick tree for this chain
-    cache_key = f"{chain}_newick"
-    if cache_key in cache_data:
-        return FastAPIResponse(content=cache_data[cache_key], media_type="text/plain")
+    # The tree is built from the cached alignment once per content key;
+    # concurrent requests for the same tree wait for that one computation
+    chain = "lc" if chain == "lc" else "hc"
+    if collapse != "none":
+        try:
+            tree = await run_in_threadpool(
+                cached_collapsed_tree,
+                project_cache(project.project_name),
+                cache_data["cache_key"],
+                cache_data,
+                chain,
+                method,
+                collapse,
+            )
+        except Exception as e:
+            return JSONResponse(
+                status_code=500, content={"error": f"Error building tree: {str(e)}"}
+            )
+        return JSONResponse(
+            content={"newick": tree["newick"] or "(A,B);", "leaves": tree["leaves"]}
+        )
 
-    source_alignment_list_of_dicts = []
-    label_map = {}
-    if chain == "lc":
-        source_alignment_list_of_dicts = cache_data.get("lc_alignment", [])
-        label_map = cache_data.get("lc_label_map", {})
-    else:
-        source_alignment_list_of_dicts = cache_data.get("hc_alignment", [])
-        label_map = cache_data.get("hc_label_map", {})
+    try:
+        newick_tree_string = await run_in_threadpool(
+            cached_tree,
+            project_cache(project.project_name),
+            cache_data["cache_key"],
+            cache_data,
+            chain,
+            method,
+        )
+    except Exception:
+        newick_tree_string = None
 
-    if not isinstance(source_alignment_list_of_dicts, list):
+    if not newick_tree_string:
         return FastAPIResponse(content="(A,B);", media_type="text/plain")
+    return FastAPIResponse(content=newick_tree_string, media_type="text/plain")
 
-    valid_initial_sequences = []
-    for item_list in source_alignment_list_of_dicts:
-        if not (isinstance(item_list, list) and len(item_list) == 2):
-            continue
-
-        name, sequence = item_list[0], item_list[1]
 
-        if (
-            isinstance(name, str)
-            and name not in ("Germline", "Consensus", "Region")
-            and isinstance(sequence, str)
-            and sequence
-        ):
-            valid_initial_sequences.append((name, sequence))
-
-    labelled_sequences_for_tree = []
-    for original_name, seq_str in valid_initial_sequences:
-        if original_name in label_map:
-            labelled_sequences_for_tree.append((label_map[original_name], seq_str))
-
-    if len(labelled_sequences_for_tree) < 2:
-        return FastAPIResponse(content="(A,B);", media_type="text/plain")
-
-    sequence_lengths = set(
-        len(seq_str) for label, seq_str in labelled_sequences_for_tree
-    )
-    if len(sequence_lengths) != 1 or list(sequence_lengths)[0] == 0:
-        return FastAPIResponse(content="(A,B);", media_type="text/plain")
+@router.get(
+    "/phylo_tree_layout/{project_id}/{hc_gene}/{lc_gene}",
+    response_class=JSONResponse,
+    name="analyze.phylo_tree_layout",
+)
+async def phylo_tree_layout(
+    project_id: int,
+    hc_gene: str,
+    lc_gene: str,
+    chain: str = "hc",  # Query parameter: chain=hc or chain=lc
+    method: str = "nj",  # Query parameter: method=nj or method=upgma
+    style: str = "rectangular",  # Query parameter: style=rectangular or style=radial
+    width: float = 800,
+    height: float = 600,
+    min_px: float = 3,  # Subtrees spanning fewer pixels are collapsed
+    expand: str = "",  # Comma-separated ids of collapsed nodes to open
+    project: Project = Depends(get_project),
+    project_data: tuple = Depends(get_project_data),
+):
+    """
+    Return precomputed node coordinates for the tree of `phylo_tree_newick`.
 
+    Subtrees narrower than `min_px` pixels come back as collapsed nodes with
+    their leaf count; pass their ids in `expand` to open them.
+    """
+    if method not in TREE_METHODS:
+        return JSONResponse(
+            status_code=400, content={"error": f"Unknown tree method {method}"}
+        )
+    if style not in LAYOUT_STYLES:
+        return JSONResponse(
+            status_code=400, content={"error": f"Unknown layout style {style}"}
+        )
+    if width <= 0 or height <= 0:
+        return JSONResponse(
+            status_code=400, content={"error": "width and height must be positive"}
+        )
     try:
-        alignment = MultipleSeqAlignment(
-            [
-                SeqRecord(Seq(seq), id=label)
-                for label, seq in labelled_sequences_for_tree
-            ]
+        expanded = {int(node_id) for node_id in expand.split(",") if node_id.strip()}
+    except ValueError:
+        return JSONResponse(
+            status_code=400, content={"error": f"Invalid expand list {expand}"}
         )
-        if len(alignment) < 2:
-            return FastAPIResponse(content="(A,B);", media_type="text/plain")
 
-        temp_input = os.path.join("instance", "temp", f"temp_input_{chain}.fasta")
-        temp_output = os.path.join("instance", "temp", f"temp_output_{chain}.fasta")
-        os.makedirs(os.path.dirname(temp_input), exist_ok=True)
-
-        with open(temp_input, "w") as f:
-            for record in alignment:
-                f.write(f">{record.id}\n{record.seq}\n")
-
-        subprocess.run(
-            ["muscle", "-align", temp_input, "-output", temp_output], check=True
+    try:
+        cache_data = await load_alignment(project, project_data, hc_gene, lc_gene)
+        layout = await run_in_threadpool(
+            cached_layout,
+            project_cache(project.project_name),
+            cache_data["cache_key"],
+            cache_data,
+            "lc" if chain == "lc" else "hc",
+            method,
         )
-        aligned = AlignIO.read(temp_output, "fasta")
-
-        os.remove(temp_input)
-        os.remove(temp_output)
-
-        calculator = DistanceCalculator("blosum62")
-        distance_matrix = calculator.get_distance(aligned)
-        constructor = DistanceTreeConstructor(calculator, method="nj")
-        tree = constructor.nj(distance_matrix)
-
-        handle = StringIO()
-        Phylo.write(tree, handle, "newick")
-        newick_tree_string = handle.getvalue().strip()
-
-        if not newick_tree_string or newick_tree_string == "();":
-            return FastAPIResponse(content="(A,B);", media_type="text/plain")
-
-        # Cache the Newick tree string
-        cache_data[cache_key] = newick_tree_string
-        with open(cache_file_path, "w") as f:
-            json.dump(cache_data, f)
-
-        return FastAPIResponse(content=newick_tree_string, media_type="text/plain")
-    except Exception:
-        return FastAPIResponse(content="(A,B);", media_type="text/plain")
+    except Exception as e:
+        return JSONResponse(
+            status_code=500, content={"error": f"Error building tree layout: {str(e)}"}
+        )
+    if layout is None:
+        return JSONResponse(
+            status_code=404, content={"error": "Not enough sequences for a tree"}
+        )
+    return JSONResponse(
+        content=layout_view(layout, style, width, height, min_px, expanded)
+    )
 
 
 @router.get(
@@ -722,6 +1198,55 @@ async def download_csv(
     )
 
 
+async def load_distance_sequences(
+    project: Project, project_data: tuple, hc_gene: str, lc_gene: str, chain: str
+):
+    """
+    Load the aligned sequences a distance matrix is computed from.
+
+    Returns:
+        Tuple of (cache data, labels, aligned sequences), or a JSONResponse
+        describing why there is no matrix
+    """
+    # Get the alignment key and check status
+    key = get_alignment_key(project.project_name, hc_gene, lc_gene)
+    status = alignment_status.get(key, {"status": "not_started"})
+
+    if status["status"] == "computing":
+        return JSONResponse(
+            status_code=202,
+            content={
+                "status": "computing",
+                "message": "Alignment computation in progress",
+            },
+        )
+
+    # Load (or compute) the cached alignment data
+    try:
+        cache_data = await load_alignment(project, project_data, hc_gene, lc_gene)
+    except HTTPException as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Error computing alignment: {e.detail}"},
+        )
+
+    # Get the appropriate alignment data based on chain type
+    if not chain_alignment(cache_data, chain):
+        return JSONResponse(
+            status_code=404,
+            content={"error": f"No alignment data found for {chain.upper()} chain"},
+        )
+
+    sequences = matrix_sequences(cache_data, chain)
+    if len(sequences) < 2:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Not enough sequences for {chain.upper()} chain"},
+        )
+    # Use the mapped labels
+    return cache_data, [label for label, _ in sequences], [seq for _, seq in sequences]
+
+
 @router.get(
     "/distance_matrix/{project_id}/{hc_gene}/{lc_gene}",
     response_class=JSONResponse,
@@ -732,113 +1257,167 @@ async def distance_matrix(
     hc_gene: str,
     lc_gene: str,
     chain: str = "hc",  # Query parameter: chain=hc or chain=lc
+    format: str = "json",  # Query parameter: format=json, uint8 or float16
+    order: str = "alignment",  # Query parameter: order=alignment or order=cluster
     project: Project = Depends(get_project),
     project_data: tuple = Depends(get_project_data),
 ):
-    """Generate a distance matrix for sequences using cached alignment data."""
+    """
+    Generate a distance matrix for sequences using cached alignment data.
+
+    ``order=cluster`` returns rows and columns in average-linkage order (with
+    optimal leaf ordering) together with that order and the dendrogram.
+
+    ``format=uint8`` (percent identity quantized to 0..255) and
+    ``format=float16`` (percent mismatch) return the packed binary matrix:
+    a ``<4sBI`` prefix, a JSON header with the labels and encoding, then the
+    row-major values.
+    """
+    if format != "json" and format not in MATRIX_FORMATS:
+        return JSONResponse(
+            status_code=400, content={"error": f"Unknown matrix format {format}"}
+        )
+    if order not in ("alignment", "cluster"):
+        return JSONResponse(
+            status_code=400, content={"error": f"Unknown matrix order {order}"}
+        )
     try:
-        # Get the alignment key and check status
-        key = get_alignment_key(project.project_name, hc_gene, lc_gene)
-        status = alignment_status.get(key, {"status": "not_started"})
-
-        if status["status"] == "not_started":
-            # Start alignment computation and wait for it to complete
-            try:
-                await hc_lc_alignment_data(
-                    project_id, hc_gene, lc_gene, project, project_data
-                )
-                status = alignment_status.get(key, {"status": "not_started"})
-            except Exception as e:
-                return JSONResponse(
-                    status_code=500,
-                    content={"error": f"Error computing alignment: {str(e)}"},
-                )
-
-        if status["status"] == "computing":
-            return JSONResponse(
-                status_code=202,
-                content={
-                    "status": "computing",
-                    "message": "Alignment computation in progress",
-                },
+        chain = "hc" if chain == "hc" else "lc"
+        loaded = await load_distance_sequences(
+            project, project_data, hc_gene, lc_gene, chain
+        )
+        if isinstance(loaded, JSONResponse):
+            return loaded
+        cache_data, labels, seqs = loaded
+
+        # Percent mismatch of every pair, computed once per alignment content key
+        cache = project_cache(project.project_name)
+        distances = await run_in_threadpool(
+            cached_mismatch_matrix, cache, cache_data["cache_key"], chain, seqs
+        )
+
+        extra = {}
+        if order == "cluster":
+            clustering = await run_in_threadpool(
+                cached_matrix_clustering, cache, cache_data["cache_key"], chain, distances
             )
-        elif status["status"] == "error":
-            return JSONResponse(
-                status_code=500,
-                content={
-                    "error": f"Error in alignment computation: {status.get('message', 'Unknown error')}"
+            row_order = np.asarray(clustering["order"], dtype=int)
+            distances = distances[np.ix_(row_order, row_order)]
+            labels = [labels[i] for i in row_order]
+            extra = {
+                "order": clustering["order"],
+                "dendrogram": {
+                    "linkage": clustering["linkage"],
+                    "positions": clustering["positions"],
+                    "optimal": clustering["optimal"],
                 },
+            }
+
+        if format != "json":
+            body, encoding = encode_values(distances, format)
+            header = {
+                "labels": labels,
+                "shape": list(distances.shape),
+                **encoding,
+                **extra,
+            }
+            return Response(
+                content=pack_matrix(header, body), media_type=MATRIX_MEDIA_TYPE
             )
 
-        # Load cached alignment data
-        project_name = project.project_name
-        cache_dir = os.path.join(
-            "instance", "uploads", project_name, project_name, "alignments"
-        )
-        cache_file = os.path.join(
-            cache_dir, f"alignment_{safe_gene(hc_gene)}_{safe_gene(lc_gene)}.json"
-        )
+        # Prepare response data
+        matrix_data = distances.tolist()
 
-        try:
-            with open(cache_file, "r") as f:
-                cache_data = json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return JSONResponse(
-                status_code=404,
-                content={"error": "Alignment cache not found"},
-            )
+        return JSONResponse(content={"labels": labels, "matrix": matrix_data, **extra})
 
-        # Get the appropriate alignment data based on chain type
-        if chain == "hc":
-            alignment_data = cache_data.get("hc_alignment", [])
-            label_map = cache_data.get("hc_label_map", {})
-        else:
-            alignment_data = cache_data.get("lc_alignment", [])
-            label_map = cache_data.get("lc_label_map", {})
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": f"Error generating distance matrix: {str(e)}"},
+        )
 
-        if not alignment_data:
-            return JSONResponse(
-                status_code=404,
-                content={"error": f"No alignment data found for {chain.upper()} chain"},
-            )
 
-        # Convert alignment data to sequences
-        sequences = []
-        for orig_id, seq in alignment_data:
-            if orig_id in label_map:
-                sequences.append((label_map[orig_id], seq))
+@router.get(
+    "/distance_matrix_tile/{project_id}/{hc_gene}/{lc_gene}",
+    response_class=Response,
+    name="analyze.distance_matrix_tile",
+)
+async def distance_matrix_tile(
+    project_id: int,
+    hc_gene: str,
+    lc_gene: str,
+    chain: str = "hc",  # Query parameter: chain=hc or chain=lc
+    level: int = 0,  # Zoom level; level 0 is the whole matrix in one tile
+    row: int = 0,
+    col: int = 0,
+    tile_size: int = 256,
+    format: str = "uint8",  # Query parameter: format=uint8 or float16
+    project: Project = Depends(get_project),
+    project_data: tuple = Depends(get_project_data),
+):
+    """
+    Return one tile of the distance matrix as a packed binary block.
+
+    At zoom level L the matrix is a 2^L x 2^L grid of tiles, each mean-pooled
+    to at most `tile_size` cells per side. The header carries the matrix
+    ranges the tile covers, its pooling factor and the deepest level; tiles at
+    full resolution also carry their row and column labels.
+    """
+    if format not in MATRIX_FORMATS:
+        return JSONResponse(
+            status_code=400, content={"error": f"Unknown matrix format {format}"}
+        )
+    if not 1 <= tile_size <= MAX_TILE_SIZE:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"tile_size must be between 1 and {MAX_TILE_SIZE}"},
+        )
+    try:
+        chain = "hc" if chain == "hc" else "lc"
+        loaded = await load_distance_sequences(
+            project, project_data, hc_gene, lc_gene, chain
+        )
+        if isinstance(loaded, JSONResponse):
+            return loaded
+        cache_data, labels, seqs = loaded
 
-        if len(sequences) < 2:
+        n = len(seqs)
+        levels = tile_levels(n, tile_size)
+        if not tile_in_matrix(n, tile_size, level, row, col):
             return JSONResponse(
                 status_code=400,
-                content={"error": f"Not enough sequences for {chain.upper()} chain"},
+                content={"error": f"No tile ({row}, {col}) at level {level}"},
             )
+        tile, (r0, r1, c0, c1, factor) = await run_in_threadpool(
+            matrix_tile,
+            project_cache(project.project_name),
+            cache_data["cache_key"],
+            chain,
+            seqs,
+            tile_size,
+            level,
+            row,
+            col,
+        )
 
-        # Calculate distance matrix
-        n_seqs = len(sequences)
-        distances = np.zeros((n_seqs, n_seqs))
-
-        for i in range(n_seqs):
-            for j in range(i + 1, n_seqs):
-                # Calculate percentage of mismatches
-                seq1 = sequences[i][1]
-                seq2 = sequences[j][1]
-                mismatches = sum(
-                    1 for a, b in zip(seq1, seq2) if a != b and a != "-" and b != "-"
-                )
-                total = sum(1 for a, b in zip(seq1, seq2) if a != "-" and b != "-")
-                distance = (mismatches / total) * 100 if total > 0 else 0
-                distances[i, j] = distance
-                distances[j, i] = distance
-
-        # Prepare response data
-        labels = [seq[0] for seq in sequences]  # Use the mapped labels
-        matrix_data = distances.tolist()
-
-        return JSONResponse(content={"labels": labels, "matrix": matrix_data})
+        body, encoding = encode_values(tile, format)
+        header = {
+            "n": n,
+            "level": level,
+            "levels": levels,
+            "rows": [r0, r1],
+            "cols": [c0, c1],
+            "factor": factor,
+            "shape": list(tile.shape),
+            **encoding,
+        }
+        if factor == 1:
+            header["row_labels"] = labels[r0:r1]
+            header["col_labels"] = labels[c0:c1]
+        return Response(content=pack_matrix(header, body), media_type=MATRIX_MEDIA_TYPE)
 
     except Exception as e:
         return JSONResponse(
             status_code=500,
-            content={"error": f"Error generating distance matrix: {str(e)}"},
+            content={"error": f"Error generating distance matrix tile: {str(e)}"},
         )
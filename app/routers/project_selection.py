@@ -10,6 +10,8 @@ from sqlalchemy.orm import Session
 from app.database import get_db, Project
 from app.services.ddl import preprocess
 from app.services.file_handle import file_extraction
+from app.services.lineages import forget_lineages
+from app.services.warmup import cancel_warmup, start_warmup
 
 router = APIRouter(prefix="/select", tags=["project_selection"])
 templates = Jinja2Templates(directory="app/templates")
@@ -79,6 +81,9 @@ async def upload_project(
             db.add(db_project)
             db.commit()
 
+        # Precompute the most visited gene pairs in the background
+        start_warmup(project_name, species, vdj_path)
+
         return RedirectResponse(url="/select/project_list", status_code=303)
 
     except Exception as e:
@@ -104,6 +109,8 @@ async def delete_project(project_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Project not found")
 
     directory_path = project.directory_path
+    cancel_warmup(project.project_name)
+    forget_lineages(project.project_name)
 
     if os.path.exists(directory_path):
         shutil.rmtree(directory_path)
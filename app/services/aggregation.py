@@ -0,0 +1,205 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import get_settings
+from app.services.versioning import BoundedLRU
+
+settings = get_settings()
+
+AGGREGATIONS = ("count", "unique", "mean")
+
+# Mixed-radix group keys are recompressed before they could overflow int64
+_MAX_KEY = 2**62
+# Key spaces up to this size (or the row count) are grouped with a bincount
+_DENSE_KEYS = 1 << 20
+
+
+# Aggregation results, and categorical codes of the columns they group on,
+# keyed by project version
+_results = BoundedLRU(settings.aggregation_cache_entries)
+_codes = BoundedLRU(settings.aggregation_cache_entries)
+
+
+def column_codes(merged_df: pd.DataFrame, column: str, version: Optional[str] = None) -> tuple:
+    """
+    Return the categorical codes of a column, cached per project version.
+
+    Returns:
+        Tuple of (int64 codes, -1 for missing values; unique values)
+    """
+    key = (version, column)
+    cached = _codes.get(key) if version else None
+    if cached is not None:
+        return cached
+    codes, uniques = pd.factorize(merged_df[column])
+    value = (codes.astype(np.int64), np.asarray(uniques))
+    if version:
+        _codes.put(key, value)
+    return value
+
+
+def _group_keys(code_arrays: list, sizes: list) -> tuple:
+    """
+    Combine per-column codes into one key per row (mixed radix, recompressed as needed).
+
+    Returns:
+        Tuple of (int64 keys, upper bound of the keys)
+    """
+    keys = np.zeros(len(code_arrays[0]), dtype=np.int64)
+    radix = 1
+    for codes, size in zip(code_arrays, sizes):
+        size = max(size, 1)
+        if radix * size >= _MAX_KEY:
+            uniques, keys = np.unique(keys, return_inverse=True)
+            keys = keys.reshape(-1)
+            radix = len(uniques)
+        keys = keys * size + codes
+        radix *= size
+    return keys, radix
+
+
+def _groups(keys: np.ndarray, radix: int) -> tuple:
+    """
+    Number the distinct keys.
+
+    Small key spaces are counted densely (no sort); larger ones go through
+    ``np.unique``.
+
+    Returns:
+        Tuple of (first row of each group, group of each row), groups in key order
+    """
+    if radix <= max(len(keys), _DENSE_KEYS):
+        present = np.bincount(keys, minlength=radix) > 0
+        number = np.cumsum(present) - 1
+        # Reversed assignment leaves each key's first row
+        first = np.empty(radix, dtype=np.int64)
+        first[keys[::-1]] = np.arange(len(keys) - 1, -1, -1)
+        return first[present], number[keys]
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    return first, inverse.reshape(-1)
+
+
+def aggregate(
+    merged_df: pd.DataFrame,
+    by: list,
+    agg: str = "count",
+    column: Optional[str] = None,
+    filters: Optional[dict] = None,
+    limit: Optional[int] = None,
+    version: Optional[str] = None,
+) -> dict:
+    """
+    Group the cells of a project by one or more columns.
+
+    Every column is turned into categorical codes (cached per project
+    version), filters compare codes, and groups are numbered from the
+    combined codes; counts and sums are bincounts.
+    Rows missing any group-by value are left out, as in ``value_counts``.
+
+    Args:
+        merged_df: Merged dataset of a project
+        by: Columns to group by
+        agg: "count" (cells), "unique" (distinct values of `column`) or
+            "mean" (of numeric `column`)
+        column: Column aggregated by "unique" and "mean"
+        filters: Column -> value (compared as strings) the cells must match
+        limit: Keep only the first groups
+        version: `project_version`, to reuse categorical codes
+
+    Returns:
+        Dictionary with by, agg, column, filters, groups (total) and rows:
+        one record per group with the group-by values and the aggregate
+        under the `agg` name, largest first
+    """
+    filters = filters or {}
+    if not by:
+        raise ValueError("Group by at least one column")
+    if agg not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation {agg}")
+    if agg != "count" and column is None:
+        raise ValueError(f"Aggregation {agg} needs a column")
+    needed = list(by) + list(filters) + ([column] if agg != "count" else [])
+    missing = [c for c in needed if c not in merged_df.columns]
+    if missing:
+        raise ValueError(f"Unknown column {missing[0]}")
+
+    keep = np.ones(len(merged_df), dtype=bool)
+    for name, wanted in filters.items():
+        codes, uniques = column_codes(merged_df, name, version)
+        matching = np.flatnonzero(pd.Index(uniques).astype(str) == str(wanted))
+        keep &= np.isin(codes, matching)
+
+    groups = [column_codes(merged_df, name, version) for name in by]
+    for codes, _ in groups:
+        keep &= codes >= 0
+
+    keys, radix = _group_keys([codes[keep] for codes, _ in groups], [len(u) for _, u in groups])
+    first, inverse = _groups(keys, radix)
+    n_groups = len(first)
+
+    if agg == "count":
+        values = np.bincount(inverse, minlength=n_groups)
+    elif agg == "unique":
+        codes, _ = column_codes(merged_df, column, version)
+        target = codes[keep]
+        present = target >= 0
+        width = int(target.max(initial=0)) + 1
+        pairs = np.unique(inverse[present] * width + target[present])
+        values = np.bincount(pairs // width, minlength=n_groups)
+    else:
+        numbers = pd.to_numeric(merged_df[column], errors="coerce").to_numpy(dtype=float)[keep]
+        present = ~np.isnan(numbers)
+        sums = np.bincount(inverse[present], weights=numbers[present], minlength=n_groups)
+        counts = np.bincount(inverse[present], minlength=n_groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = sums / counts
+
+    # Largest first; ties keep first-occurrence order
+    order = np.lexsort((first, -np.nan_to_num(values, nan=-np.inf)))
+    if limit is not None:
+        order = order[:limit]
+
+    row_index = np.flatnonzero(keep)[first[order]]
+    labels = {name: uniques[codes[row_index]].tolist() for name, (codes, uniques) in zip(by, groups)}
+    aggregated = [None if pd.isna(v) else v for v in values[order].tolist()]
+    rows = [
+        {**{name: labels[name][i] for name in by}, agg: aggregated[i]} for i in range(len(order))
+    ]
+    return {
+        "by": list(by),
+        "agg": agg,
+        "column": column,
+        "filters": filters,
+        "groups": int(n_groups),
+        "rows": rows,
+    }
+
+
+def cached_aggregate(
+    merged_df: pd.DataFrame,
+    version: Optional[str],
+    by: list,
+    agg: str = "count",
+    column: Optional[str] = None,
+    filters: Optional[dict] = None,
+    limit: Optional[int] = None,
+) -> dict:
+    """Return `aggregate`, kept in a bounded in-process LRU per (project version, query)."""
+    filters = filters or {}
+    key = (
+        version,
+        tuple(by),
+        agg,
+        column,
+        tuple(sorted((name, str(value)) for name, value in filters.items())),
+        limit,
+    )
+    cached = _results.get(key) if version else None
+    if cached is not None:
+        return cached
+    value = aggregate(merged_df, by, agg, column, filters, limit, version)
+    if version:
+        _results.put(key, value)
+    return value
@@ -0,0 +1,496 @@
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+import numpy as np
+
+from app.core.config import get_settings
+from app.services.alignment_codec import CHAINS, sequence_matrix
+
+settings = get_settings()
+
+CACHE_FILENAME = "alignment_cache.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_root ON entries (root);
+CREATE TABLE IF NOT EXISTS stats (
+    kind TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0,
+    evictions INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def artifact_key(key: str, name: str) -> str:
+    """Return the key of an artifact derived from the alignment stored under `key`."""
+    return f"{key}:{name}"
+
+
+class AlignmentCache:
+    """
+    Content-addressed store for alignments and the artifacts derived from them.
+
+    Everything lives in one SQLite file per project. Entries are grouped by the
+    alignment they derive from (their `root`): eviction removes whole groups in
+    least-recently-used order, so a tree or distance matrix never outlives its
+    alignment. Each write is a single transaction.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: Optional[int] = None,
+        total_bytes: Optional[int] = None,
+    ):
+        self.path = path
+        self.max_bytes = (
+            settings.alignment_cache_project_bytes if max_bytes is None else max_bytes
+        )
+        self.total_bytes = (
+            settings.alignment_cache_total_bytes if total_bytes is None else total_bytes
+        )
+        # The project folder is never created here: a store opened while or
+        # after its project is deleted stays empty and drops writes
+        self.available = os.path.isdir(self.directory)
+        if self.available:
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+
+    @property
+    def directory(self) -> str:
+        return os.path.dirname(self.path) or "."
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _count(self, conn, kind: str, column: str, n: int = 1) -> None:
+        conn.execute(
+            f"INSERT INTO stats (kind, {column}) VALUES (?, ?) "
+            f"ON CONFLICT(kind) DO UPDATE SET {column} = {column} + excluded.{column}",
+            (kind, n),
+        )
+
+    def get(self, key: str, kind: str = "artifact", count: bool = True) -> Optional[bytes]:
+        """Return the payload stored under `key` (recording a hit or miss), or None."""
+        if not self.available:
+            return None
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute(
+                    "SELECT payload FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    if count:
+                        self._count(conn, kind, "misses")
+                    return None
+                conn.execute(
+                    "UPDATE entries SET last_access = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+                if count:
+                    self._count(conn, kind, "hits")
+                return row[0]
+        finally:
+            conn.close()
+
+    def put(self, key: str, payload: bytes, kind: str = "artifact", root=None) -> None:
+        """Store `payload` under `key`, then evict down to the size budgets."""
+        self.put_many([(key, payload, kind)], root=root or key)
+
+    def put_many(self, entries: list, root: str) -> None:
+        """Store several `(key, payload, kind)` entries of one group atomically."""
+        if not self.available or not os.path.isdir(self.directory):
+            return
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                replaced = sum(
+                    row[0]
+                    for key, _, _ in entries
+                    for row in conn.execute("SELECT size FROM entries WHERE key = ?", (key,))
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO entries "
+                    "(key, root, kind, payload, size, created, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (key, root, kind, payload, len(payload), now, now)
+                        for key, payload, kind in entries
+                    ],
+                )
+        finally:
+            conn.close()
+        written = sum(len(payload) for _, payload, _ in entries) - replaced
+        freed = self.evict(self.max_bytes)
+        track_total(os.path.dirname(self.directory), written - freed, self.total_bytes)
+
+    def get_json(self, key: str, kind: str = "artifact", count: bool = True):
+        payload = self.get(key, kind, count)
+        if payload is None:
+            return None
+        return decode_json(payload)
+
+    def put_json(self, key: str, value, kind: str = "artifact", root=None) -> None:
+        self.put(key, encode_json(value), kind, root)
+
+    def read_range(self, key: str, offset: int, length: int) -> bytes:
+        """Read `length` bytes of an uncompressed payload without loading the rest."""
+        if not self.available:
+            return b""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT rowid FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return b""
+            with conn.blobopen("entries", "payload", row[0], readonly=True) as blob:
+                blob.seek(offset)
+                return blob.read(length)
+        finally:
+            conn.close()
+
+    def groups(self) -> list:
+        """Return `(last_access, root, size)` for every group, oldest first."""
+        if not self.available:
+            return []
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT MAX(last_access), root, SUM(size) FROM entries "
+                "GROUP BY root ORDER BY MAX(last_access)"
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def size(self) -> int:
+        if not self.available:
+            return 0
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        finally:
+            conn.close()
+
+    def remove_group(self, root: str) -> int:
+        """Delete an alignment and every artifact derived from it; return the bytes freed."""
+        if not self.available:
+            return 0
+        conn = self._connect()
+        try:
+            with conn:
+                kinds = conn.execute(
+                    "SELECT kind, COUNT(*), SUM(size) FROM entries WHERE root = ? GROUP BY kind",
+                    (root,),
+                ).fetchall()
+                conn.execute("DELETE FROM entries WHERE root = ?", (root,))
+                for kind, n, _ in kinds:
+                    self._count(conn, kind, "evictions", n)
+        finally:
+            conn.close()
+        return sum(size for _, _, size in kinds)
+
+    def evict(self, max_bytes: int) -> int:
+        """
+        Evict least-recently-used groups until the store fits in `max_bytes`.
+
+        Returns:
+            Number of bytes freed
+        """
+        total = self.size()
+        if total <= max_bytes:
+            return 0
+        freed = 0
+        for _, root, _ in self.groups():
+            if total - freed <= max_bytes:
+                break
+            freed += self.remove_group(root)
+        return freed
+
+    def stats(self) -> dict:
+        """Return entry counts, sizes and hit/miss/eviction counters per kind."""
+        kinds = {}
+        if not self.available:
+            return {"path": self.path, "bytes": 0, "max_bytes": self.max_bytes, "kinds": kinds}
+        conn = self._connect()
+        try:
+            kinds = {
+                kind: {"entries": n, "bytes": size, "hits": 0, "misses": 0, "evictions": 0}
+                for kind, n, size in conn.execute(
+                    "SELECT kind, COUNT(*), SUM(size) FROM entries GROUP BY kind"
+                )
+            }
+            for kind, hits, misses, evictions in conn.execute(
+                "SELECT kind, hits, misses, evictions FROM stats"
+            ):
+                counters = kinds.setdefault(
+                    kind, {"entries": 0, "bytes": 0, "hits": 0, "misses": 0, "evictions": 0}
+                )
+                counters.update(hits=hits, misses=misses, evictions=evictions)
+        finally:
+            conn.close()
+        return {
+            "path": self.path,
+            "bytes": sum(k["bytes"] for k in kinds.values()),
+            "max_bytes": self.max_bytes,
+            "kinds": kinds,
+        }
+
+
+# Computations in flight, by (store path, key): (lock, number of waiters)
+_flights: dict = {}
+_flights_lock = threading.Lock()
+
+
+@contextmanager
+def single_flight(cache: AlignmentCache, key: str):
+    """Serialize computations of the same cache entry across threads."""
+    name = (cache.path, key)
+    with _flights_lock:
+        lock, users = _flights.get(name, (threading.Lock(), 0))
+        _flights[name] = (lock, users + 1)
+    try:
+        with lock:
+            yield
+    finally:
+        with _flights_lock:
+            lock, users = _flights[name]
+            if users == 1:
+                del _flights[name]
+            else:
+                _flights[name] = (lock, users - 1)
+
+
+def cached_artifact(
+    cache: AlignmentCache,
+    key: str,
+    name: str,
+    kind: str,
+    build: Callable,
+    encode: Callable = None,
+    decode: Callable = None,
+):
+    """
+    Return the artifact `name` derived from the alignment under `key`.
+
+    On a miss `build()` is called once, even when several threads ask for the
+    same artifact at the same time, and its result is stored in the alignment's
+    group. Artifacts are stored as compressed JSON unless `encode`/`decode` are
+    given; a None result is returned but not cached.
+    """
+    encode = encode or encode_json
+    decode = decode or decode_json
+    entry_key = artifact_key(key, name)
+    payload = cache.get(entry_key, kind)
+    if payload is not None:
+        return decode(payload)
+    with single_flight(cache, entry_key):
+        # Another thread may have built it while we waited
+        payload = cache.get(entry_key, kind, count=False)
+        if payload is not None:
+            return decode(payload)
+        value = build()
+        if value is not None:
+            cache.put(entry_key, encode(value), kind, root=key)
+        return value
+
+
+def project_cache(project_name: str) -> AlignmentCache:
+    """Return the cache store of a project."""
+    return AlignmentCache(os.path.join(settings.upload_dir, project_name, CACHE_FILENAME))
+
+
+# Bytes held by the stores under each upload folder: (bytes, time measured).
+# Measured by `enforce_total_budget`, then kept up to date with the writes and
+# evictions of this process.
+_totals: dict = {}
+_totals_lock = threading.Lock()
+
+
+def track_total(upload_dir: str, delta: int, total_bytes: int) -> None:
+    """
+    Account for `delta` bytes written to a store under `upload_dir`.
+
+    The store folders are only scanned (by `enforce_total_budget`) when the
+    running total exceeds `total_bytes`, on first use, and every
+    `alignment_cache_rescan_interval` seconds so that writes of other
+    processes are picked up.
+    """
+    with _totals_lock:
+        total, measured = _totals.get(upload_dir, (None, 0.0))
+        if total is not None:
+            total += delta
+            _totals[upload_dir] = (total, measured)
+    stale = time.time() - measured > settings.alignment_cache_rescan_interval
+    if total is None or total > total_bytes or stale:
+        enforce_total_budget(upload_dir, total_bytes)
+
+
+def enforce_total_budget(upload_dir: str, total_bytes: int) -> None:
+    """Evict the least-recently-used groups across every project store."""
+    stores = [
+        AlignmentCache(path, max_bytes=total_bytes, total_bytes=total_bytes)
+        for path in glob.glob(os.path.join(upload_dir, "*", CACHE_FILENAME))
+    ]
+    total = sum(store.size() for store in stores)
+    if total > total_bytes:
+        groups = sorted(
+            (last_access, i, root, size)
+            for i, store in enumerate(stores)
+            for last_access, root, size in store.groups()
+        )
+        for _, i, root, _ in groups:
+            if total <= total_bytes:
+                break
+            total -= stores[i].remove_group(root)
+    with _totals_lock:
+        _totals[upload_dir] = (total, time.time())
+
+
+def encode_json(value) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_json(payload: bytes):
+    return json.loads(zlib.decompress(payload))
+
+
+def residue_key(key: str, chain: str) -> str:
+    return artifact_key(key, f"{chain}_residues")
+
+
+def store_alignment(cache: AlignmentCache, key: str, result: dict) -> None:
+    """
+    Store a compact alignment result under its content key.
+
+    The aligned residues of each chain are kept as a raw (rows x cols) byte
+    matrix so that windows can be read without loading the whole alignment; the
+    metadata entry keeps everything else plus the matrix shapes.
+    """
+    metadata = {
+        name: value
+        for name, value in result.items()
+        if name not in {f"{chain}_seqs" for chain in CHAINS} and name != "cache_key"
+    }
+    entries = []
+    for chain in CHAINS:
+        arr = sequence_matrix(result.get(f"{chain}_seqs", []))
+        metadata[f"{chain}_shape"] = list(arr.shape)
+        entries.append((residue_key(key, chain), arr.tobytes(), "residues"))
+    entries.insert(0, (key, encode_json(metadata), "alignment"))
+    cache.put_many(entries, root=key)
+
+
+def read_metadata(cache: AlignmentCache, key: str, count: bool = True) -> Optional[dict]:
+    """Return the cached alignment without its residues, or None if it is not cached."""
+    return cache.get_json(key, "alignment", count)
+
+
+def read_alignment(cache: AlignmentCache, key: str, count: bool = True) -> Optional[dict]:
+    """Return the cached compact alignment result, or None if it is not cached."""
+    metadata = read_metadata(cache, key, count)
+    if metadata is None:
+        return None
+
+    result = dict(metadata)
+    for chain in CHAINS:
+        rows, cols = result.pop(f"{chain}_shape")
+        raw = cache.get(residue_key(key, chain), "residues", count)
+        if raw is None:
+            return None
+        block = raw.decode("ascii")
+        result[f"{chain}_seqs"] = [block[i * cols : (i + 1) * cols] for i in range(rows)]
+    return result
+
+
+def read_window(
+    cache: AlignmentCache,
+    key: str,
+    chain: str,
+    row_start: int,
+    row_end: int,
+    col_start: int,
+    col_end: int,
+) -> Optional[dict]:
+    """
+    Return a row range x column range slice of a cached alignment.
+
+    Only the requested rows of the residue matrix are read from the store.
+    Bounds are clamped to the alignment dimensions.
+    """
+    metadata = read_metadata(cache, key)
+    if metadata is None:
+        return None
+
+    rows, cols = metadata[f"{chain}_shape"]
+    row_start, row_end = max(0, row_start), min(rows, row_end)
+    col_start, col_end = max(0, col_start), min(cols, col_end)
+
+    ids = metadata.get(f"{chain}_ids", [])[row_start:row_end]
+    label_map = metadata.get(f"{chain}_label_map", {})
+
+    seqs = []
+    if rows and cols and row_start < row_end and col_start < col_end:
+        raw = cache.read_range(
+            residue_key(key, chain), row_start * cols, (row_end - row_start) * cols
+        )
+        matrix = np.frombuffer(raw, dtype=np.uint8).reshape(-1, cols)
+        block = np.ascontiguousarray(matrix[:, col_start:col_end])
+        width = col_end - col_start
+        text = block.tobytes().decode("ascii")
+        seqs = [text[i * width : (i + 1) * width] for i in range(len(ids))]
+
+    return {
+        "chain": chain,
+        "row_start": row_start,
+        "row_end": max(row_start, row_end),
+        "col_start": col_start,
+        "col_end": max(col_start, col_end),
+        "rows": [
+            {"id": orig_id, "name": label_map.get(orig_id, orig_id), "seq": seq}
+            for orig_id, seq in zip(ids, seqs)
+        ],
+    }
+
+
+def alignment_summary(result: dict, chain: str) -> dict:
+    """
+    Return the dimensions, row ordering, consensus and region blocks of one chain.
+
+    Accepts either a full result or the metadata returned by `read_metadata`.
+    """
+    if f"{chain}_shape" in result:
+        rows, cols = result[f"{chain}_shape"]
+    else:
+        seqs = result.get(f"{chain}_seqs", [])
+        rows, cols = len(seqs), len(seqs[0]) if seqs else 0
+    ids = result.get(f"{chain}_ids", [])
+    label_map = result.get(f"{chain}_label_map", {})
+    return {
+        "chain": chain,
+        "rows": rows,
+        "cols": cols,
+        "ids": ids,
+        "labels": [label_map.get(orig_id, orig_id) for orig_id in ids],
+        "consensus": result.get(f"{chain}_consensus", ""),
+        "germline": result.get(f"{chain}_germline"),
+        "region_blocks": result.get(f"{chain}_region_blocks"),
+        "clusters": result.get(f"{chain}_clusters"),
+    }
@@ -0,0 +1,202 @@
+import base64
+import json
+import struct
+from typing import Optional
+
+import numpy as np
+
+CHAINS = ("hc", "lc")
+
+# Content type for the packed-bytes alignment payload
+PACKED_MEDIA_TYPE = "application/octet-stream"
+
+PACKED_MAGIC = b"BCRA"
+PACKED_VERSION = 1
+# magic, version, header length
+_PACKED_PREFIX = struct.Struct("<4sBI")
+
+COMPACT_FORMAT = "compact"
+COMPACT_VERSION = 1
+
+
+def sequence_matrix(seqs: list) -> np.ndarray:
+    """Return aligned sequences as an (n_rows, n_cols) uint8 array of ASCII codes."""
+    if not seqs:
+        return np.zeros((0, 0), dtype=np.uint8)
+    width = len(seqs[0])
+    return np.frombuffer("".join(seqs).encode("ascii"), dtype=np.uint8).reshape(
+        len(seqs), width
+    )
+
+
+def match_mask(seqs: list, consensus: str) -> np.ndarray:
+    """Return a boolean (n_rows, n_cols) mask, True where a residue equals the consensus."""
+    arr = sequence_matrix(seqs)
+    if arr.size == 0 or not consensus:
+        return np.zeros(arr.shape, dtype=bool)
+    cons = np.frombuffer(consensus.encode("ascii"), dtype=np.uint8)
+    return arr == cons[np.newaxis, :]
+
+
+def pack_mask(mask: np.ndarray) -> dict:
+    """Bit-pack a boolean mask (row-major) into a base64 string with its shape."""
+    bits = np.packbits(mask, axis=None) if mask.size else b""
+    return {
+        "shape": list(mask.shape),
+        "bits": base64.b64encode(bytes(bits)).decode("ascii"),
+    }
+
+
+def unpack_mask(packed: dict) -> np.ndarray:
+    """Inverse of `pack_mask`."""
+    rows, cols = packed["shape"]
+    raw = np.frombuffer(base64.b64decode(packed["bits"]), dtype=np.uint8)
+    return np.unpackbits(raw, count=rows * cols).astype(bool).reshape(rows, cols)
+
+
+def region_array_from_blocks(blocks: Optional[list], length: int) -> Optional[list]:
+    """Rebuild the per-residue region labels of a germline from its region blocks."""
+    if not blocks:
+        return None
+    arr = ["UNK"] * length
+    for region, start, end in blocks:
+        # Blocks from older cache entries may run past the alignment, as in build_region_string
+        for i in range(max(start - 1, 0), min(end, length)):
+            arr[i] = region
+    return arr
+
+
+def chain_alignment(result: dict, chain: str) -> list:
+    """Return the (id, aligned sequence) pairs of a chain from a compact or legacy result."""
+    if result.get("format") == COMPACT_FORMAT:
+        return list(zip(result.get(f"{chain}_ids", []), result.get(f"{chain}_seqs", [])))
+    return [tuple(item) for item in result.get(f"{chain}_alignment", [])]
+
+
+def compact_from_legacy(result: dict) -> dict:
+    """Convert a legacy alignment result (three copies of every chain) to the compact layout."""
+    if result.get("format") == COMPACT_FORMAT:
+        return result
+
+    compact = {"format": COMPACT_FORMAT, "version": COMPACT_VERSION}
+    for chain in CHAINS:
+        alignment = chain_alignment(result, chain)
+        germline = next(
+            (row["seq"] for row in result.get(f"{chain}_json", []) if row["name"] == "Germline"),
+            None,
+        )
+        compact[f"{chain}_table"] = result.get(f"{chain}_table", [])
+        compact[f"{chain}_ids"] = [orig_id for orig_id, _ in alignment]
+        compact[f"{chain}_seqs"] = [seq for _, seq in alignment]
+        compact[f"{chain}_consensus"] = result.get(f"{chain}_consensus", "")
+        compact[f"{chain}_label_map"] = result.get(f"{chain}_label_map", {})
+        compact[f"{chain}_germline"] = germline
+        compact[f"{chain}_region_blocks"] = result.get(f"{chain}_region_blocks")
+    # Trees cached by older versions are carried over untouched
+    for key, value in result.items():
+        if key.endswith("_newick"):
+            compact[key] = value
+    return compact
+
+
+def expand_to_legacy(compact: dict) -> dict:
+    """Rebuild the legacy response (alignment, `{name, seq}` rows and match matrix)."""
+    result = {}
+    for chain in CHAINS:
+        ids = compact.get(f"{chain}_ids", [])
+        seqs = compact.get(f"{chain}_seqs", [])
+        consensus = compact.get(f"{chain}_consensus", "")
+        label_map = compact.get(f"{chain}_label_map", {})
+        germline = compact.get(f"{chain}_germline")
+        region_blocks = compact.get(f"{chain}_region_blocks")
+
+        rows = []
+        if germline:
+            region_arr = region_array_from_blocks(region_blocks, len(germline))
+            if region_arr:
+                rows.append({"name": "Region", "seq": "".join(region_arr)})
+            rows.append({"name": "Germline", "seq": germline})
+        rows.extend(
+            {"name": label_map.get(orig_id, orig_id), "seq": seq}
+            for orig_id, seq in zip(ids, seqs)
+        )
+        if consensus:
+            rows.append({"name": "Consensus", "seq": consensus})
+
+        # Legacy match matrix is column-major: one list of row flags per consensus position
+        match_matrix = (
+            match_mask(seqs, consensus).T.tolist() if len(seqs) > 1 else []
+        )
+
+        result[f"{chain}_table"] = compact.get(f"{chain}_table", [])
+        result[f"{chain}_alignment"] = [list(pair) for pair in zip(ids, seqs)]
+        result[f"{chain}_consensus"] = consensus
+        result[f"{chain}_match_matrix"] = match_matrix
+        result[f"{chain}_json"] = rows
+        result[f"{chain}_label_map"] = label_map
+        result[f"{chain}_region_blocks"] = region_blocks
+        result[f"{chain}_clusters"] = compact.get(f"{chain}_clusters")
+    return result
+
+
+def compact_response(compact: dict) -> dict:
+    """Return the compact payload with a bit-packed match mask added for each chain."""
+    payload = {
+        key: value for key, value in compact.items() if not key.endswith("_newick")
+    }
+    for chain in CHAINS:
+        payload[f"{chain}_match_mask"] = pack_mask(
+            match_mask(compact.get(f"{chain}_seqs", []), compact.get(f"{chain}_consensus", ""))
+        )
+    return payload
+
+
+def pack_binary(compact: dict) -> bytes:
+    """
+    Serialize a compact alignment to packed bytes.
+
+    Layout: ``<4sBI`` prefix (magic, version, header length), a UTF-8 JSON header
+    holding everything except the sequences, then for each chain in `CHAINS`
+    the (rows x cols) ASCII residue block followed by the bit-packed match mask.
+    """
+    header = {
+        key: value
+        for key, value in compact.items()
+        if not key.endswith("_newick") and key not in {f"{c}_seqs" for c in CHAINS}
+    }
+    blocks = []
+    for chain in CHAINS:
+        seqs = compact.get(f"{chain}_seqs", [])
+        arr = sequence_matrix(seqs)
+        mask = match_mask(seqs, compact.get(f"{chain}_consensus", ""))
+        header[f"{chain}_shape"] = list(arr.shape)
+        blocks.append(arr.tobytes())
+        blocks.append(np.packbits(mask, axis=None).tobytes() if mask.size else b"")
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    prefix = _PACKED_PREFIX.pack(PACKED_MAGIC, PACKED_VERSION, len(header_bytes))
+    return b"".join([prefix, header_bytes, *blocks])
+
+
+def unpack_binary(data: bytes) -> dict:
+    """Inverse of `pack_binary`; match masks are returned as boolean arrays."""
+    magic, version, header_len = _PACKED_PREFIX.unpack_from(data)
+    if magic != PACKED_MAGIC or version != PACKED_VERSION:
+        raise ValueError("Not a packed alignment payload")
+    offset = _PACKED_PREFIX.size
+    header = json.loads(data[offset : offset + header_len].decode("utf-8"))
+    offset += header_len
+
+    for chain in CHAINS:
+        rows, cols = header.pop(f"{chain}_shape")
+        size = rows * cols
+        block = data[offset : offset + size].decode("ascii")
+        offset += size
+        header[f"{chain}_seqs"] = [block[i * cols : (i + 1) * cols] for i in range(rows)]
+        mask_len = (size + 7) // 8
+        raw = np.frombuffer(data[offset : offset + mask_len], dtype=np.uint8)
+        offset += mask_len
+        header[f"{chain}_match_mask"] = (
+            np.unpackbits(raw, count=size).astype(bool).reshape(rows, cols)
+        )
+    return header
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import subprocess
+from functools import lru_cache
+from typing import Optional
+
+import pandas as pd
+
+from app.core.config import get_settings
+from app.services.alignment_cache import (
+    AlignmentCache,
+    read_alignment,
+    single_flight,
+    store_alignment,
+)
+from app.services.alignment_codec import COMPACT_FORMAT, COMPACT_VERSION
+from app.services.clustering import cluster_membership, greedy_cluster, imgt_anchored
+from app.services.ddl import best_translation, compute_alignment_and_consensus
+from app.services.germline_annotation import get_germline_and_annotation
+from app.services.versioning import BoundedLRU
+
+settings = get_settings()
+
+ALIGNER = "muscle"
+
+# Content keys of gene pair alignments, by (project version, genes, species,
+# options): a lookup then skips translating and hashing the inputs
+_keys = BoundedLRU(settings.alignment_key_cache_entries)
+
+
+@lru_cache()
+def aligner_version() -> str:
+    """Return the MUSCLE version string (queried once per process)."""
+    try:
+        proc = subprocess.run(
+            [ALIGNER, "-version"], capture_output=True, text=True, timeout=10
+        )
+        return (proc.stdout or proc.stderr).strip().splitlines()[0]
+    except (OSError, subprocess.SubprocessError, IndexError):
+        return "unknown"
+
+
+def light_chain_column(lc_gene: str):
+    """Return the merged_df column holding the light-chain sequence for a gene."""
+    if lc_gene.startswith("IGK"):
+        return "IGK"
+    if lc_gene.startswith("IGL"):
+        return "IGL"
+    return None
+
+
+def alignment_inputs(merged_df: pd.DataFrame, hc_gene: str, lc_gene: str) -> dict:
+    """
+    Collect the translated sequences, table rows and labels aligned for a gene pair.
+
+    The IMGT-gapped nucleotide sequence of every aligned row is kept as well,
+    for clustering oversized groups position by position.
+
+    Args:
+        merged_df: Pre-merged project dataset
+        hc_gene: Heavy-chain V gene (v_call_VDJ)
+        lc_gene: Light-chain V gene (v_call_VJ)
+
+    Returns:
+        Dictionary with hc_/lc_ table, ids, seqs, gapped and label_map entries
+    """
+    filtered = merged_df[
+        (merged_df["v_call_VDJ"] == hc_gene) & (merged_df["v_call_VJ"] == lc_gene)
+    ].copy()
+
+    gapped = {}
+    for col in ("IGH", "IGK", "IGL"):
+        gapped[col] = dict(zip(filtered["sequence_id"], filtered[col]))
+        filtered[col] = filtered[col].apply(best_translation)
+
+    hc_table = (
+        filtered[filtered["locus_VDJ"] == "IGH"][
+            ["IGH", "sequence_id", "isotype", "clone_id", "display_name"]
+        ]
+        .drop_duplicates()
+        .to_dict(orient="records")
+    )
+
+    lc_col = light_chain_column(lc_gene)
+    lc_table = (
+        filtered[[lc_col, "sequence_id", "isotype", "clone_id", "display_name"]]
+        .drop_duplicates()
+        .to_dict(orient="records")
+        if lc_col
+        else []
+    )
+
+    def valid_rows(table_rows, col):
+        return [
+            row
+            for row in table_rows
+            if col and row.get(col) and isinstance(row[col], str) and row[col].strip()
+        ]
+
+    # Create meaningful label maps using display names with chain suffixes
+    def create_label_map(table_rows, ids, chain_suffix):
+        first_rows = {}
+        for row in table_rows:
+            first_rows.setdefault(row["sequence_id"], row)
+        label_map = {}
+        for orig_id in ids:
+            matching_row = first_rows.get(orig_id)
+            if matching_row and "display_name" in matching_row:
+                label_map[orig_id] = f"{matching_row['display_name']}-{chain_suffix}"
+            else:
+                # Fallback to sequence_id if display_name not found
+                label_map[orig_id] = f"{orig_id}-{chain_suffix}"
+        return label_map
+
+    inputs = {"hc_table": hc_table, "lc_table": lc_table}
+    for chain, table_rows, col, suffix in (
+        ("hc", hc_table, "IGH", "HC"),
+        ("lc", lc_table, lc_col, "LC"),
+    ):
+        rows = valid_rows(table_rows, col)
+        ids = [row["sequence_id"] for row in rows]
+        inputs[f"{chain}_ids"] = ids
+        inputs[f"{chain}_seqs"] = [row[col] for row in rows]
+        inputs[f"{chain}_gapped"] = [gapped[col][orig_id] for orig_id in ids]
+        inputs[f"{chain}_label_map"] = create_label_map(table_rows, ids, suffix)
+    return inputs
+
+
+def alignment_options() -> dict:
+    """Return the alignment settings that change the result."""
+    return {
+        "order_exact_limit": settings.alignment_order_exact_limit,
+        "cluster_above": settings.alignment_cluster_above,
+        "cluster_identity": settings.alignment_cluster_identity,
+        "max_representatives": settings.alignment_max_representatives,
+    }
+
+
+def alignment_cache_key(inputs: dict, hc_gene: str, lc_gene: str, species: str) -> str:
+    """
+    Return the content key of an alignment: a hash of the input sequence set,
+    the aligner and its version, and every option that changes the result.
+    """
+    material = {
+        "aligner": ALIGNER,
+        "aligner_version": aligner_version(),
+        "format": [COMPACT_FORMAT, COMPACT_VERSION],
+        "options": alignment_options(),
+        "genes": [hc_gene, lc_gene],
+        "species": species,
+        "inputs": inputs,
+    }
+    encoded = json.dumps(material, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def alignment_key(
+    merged_df: pd.DataFrame,
+    hc_gene: str,
+    lc_gene: str,
+    species: str,
+    version: Optional[str] = None,
+) -> tuple:
+    """
+    Return the content key of a gene pair's alignment.
+
+    With a `version` (see `project_version`) the key is memoized, so only the
+    first lookup per version of the merged dataset collects the inputs.
+
+    Returns:
+        Tuple of (key, inputs), inputs None when the key came from the memo
+    """
+    memo = (version, hc_gene, lc_gene, species, tuple(alignment_options().items()))
+    key = _keys.get(memo) if version else None
+    if key is not None:
+        return key, None
+    inputs = alignment_inputs(merged_df, hc_gene, lc_gene)
+    key = alignment_cache_key(inputs, hc_gene, lc_gene, species)
+    if version:
+        _keys.put(memo, key)
+    return key, inputs
+
+
+def compute_alignment_result(
+    inputs: dict, hc_gene: str, lc_gene: str, species: str
+) -> dict:
+    """Align both chains of a gene pair and attach germline rows and region blocks."""
+    result = {"format": COMPACT_FORMAT, "version": COMPACT_VERSION}
+    for chain, gene in (("hc", hc_gene), ("lc", lc_gene)):
+        seqs, ids = inputs[f"{chain}_seqs"], inputs[f"{chain}_ids"]
+
+        # Oversized groups are aligned through cluster representatives only,
+        # clustered on their translations laid out by IMGT codon
+        clusters = None
+        if len(seqs) > settings.alignment_cluster_above:
+            reps, assignment = greedy_cluster(
+                imgt_anchored(inputs[f"{chain}_gapped"]),
+                settings.alignment_cluster_identity,
+                settings.alignment_max_representatives,
+            )
+            clusters = cluster_membership(
+                ids, reps, assignment, settings.alignment_cluster_identity
+            )
+            seqs, ids = [seqs[i] for i in reps], [ids[i] for i in reps]
+
+        alignment, consensus, _ = compute_alignment_and_consensus(seqs, ids)
+
+        germline, region_blocks = None, None
+        germ_anno = get_germline_and_annotation(gene, species, chain)
+        if germ_anno:
+            germline, _, region_blocks = germ_anno
+
+        # One copy of each alignment; the `{name, seq}` rows and the match
+        # matrix are derived from it when a response is built.
+        result.update(
+            {
+                f"{chain}_table": inputs[f"{chain}_table"],
+                f"{chain}_ids": [orig_id for orig_id, _ in alignment],
+                f"{chain}_seqs": [seq for _, seq in alignment],
+                f"{chain}_consensus": consensus,
+                f"{chain}_label_map": inputs[f"{chain}_label_map"],
+                f"{chain}_germline": germline,
+                f"{chain}_region_blocks": region_blocks,
+                f"{chain}_clusters": clusters,
+            }
+        )
+    return result
+
+
+def cached_alignment(
+    cache: AlignmentCache,
+    merged_df: pd.DataFrame,
+    hc_gene: str,
+    lc_gene: str,
+    species: str,
+    version: Optional[str] = None,
+) -> tuple:
+    """Return `(cache key, compact result)` for a gene pair, computing it on a miss."""
+    key, inputs = alignment_key(merged_df, hc_gene, lc_gene, species, version)
+    result = read_alignment(cache, key)
+    if result is None:
+        with single_flight(cache, key):
+            result = read_alignment(cache, key, count=False)
+            if result is None:
+                if inputs is None:
+                    inputs = alignment_inputs(merged_df, hc_gene, lc_gene)
+                result = compute_alignment_result(inputs, hc_gene, lc_gene, species)
+                store_alignment(cache, key, result)
+    return key, result
@@ -1,3 +1,20 @@
-from .logo_generator import generate_logo
+from .frequencies import (
+    AMINO_ACIDS,
+    NUCLEOTIDES,
+    encode_alignment,
+    frequencies,
+    information_content,
+    position_frequency_matrix,
+)
+from .logo_generator import generate_logo, logo_figure
 
-__all__ = ["generate_logo"]
+__all__ = [
+    "AMINO_ACIDS",
+    "NUCLEOTIDES",
+    "encode_alignment",
+    "frequencies",
+    "generate_logo",
+    "information_content",
+    "logo_figure",
+    "position_frequency_matrix",
+]
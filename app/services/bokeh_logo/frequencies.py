@@ -0,0 +1,60 @@
+import numpy as np
+
+from app.services.sequence_arrays import encode_bytes
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+NUCLEOTIDES = "ACGT"
+
+
+def encode_alignment(seqs: list, width: int = None) -> np.ndarray:
+    """Encode (aligned) sequences as an uppercase (n, width) uint8 array for the PFM engine."""
+    return encode_bytes([s.upper() for s in seqs], width)
+
+
+def position_frequency_matrix(codes: np.ndarray, alphabet: str = AMINO_ACIDS) -> np.ndarray:
+    """
+    Count every symbol of `alphabet` at every position of an encoded alignment.
+
+    Gaps, padding and symbols outside the alphabet are not counted, so a
+    position's total is its number of residues.
+
+    Args:
+        codes: (n, length) uint8 array, e.g. from `encode_alignment`
+        alphabet: Symbols to count, in matrix column order
+
+    Returns:
+        (length, len(alphabet)) int64 count matrix
+    """
+    n_symbols = len(alphabet)
+    symbol_index = np.full(256, n_symbols, dtype=np.int64)
+    symbol_index[np.frombuffer(alphabet.encode("ascii"), dtype=np.uint8)] = np.arange(n_symbols)
+    length = codes.shape[1] if codes.ndim == 2 else 0
+
+    # One bincount over (position, symbol) pairs; the extra symbol collects the rest
+    flat = np.arange(length) * (n_symbols + 1) + symbol_index[codes]
+    counts = np.bincount(flat.ravel(), minlength=length * (n_symbols + 1))
+    return counts.reshape(length, n_symbols + 1)[:, :n_symbols]
+
+
+def frequencies(counts: np.ndarray) -> np.ndarray:
+    """Normalize a count matrix per position (all-zero positions stay zero)."""
+    totals = counts.sum(axis=1, keepdims=True)
+    return np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+
+
+def information_content(counts: np.ndarray, n_sequences: int = None) -> np.ndarray:
+    """
+    Return the information content in bits of every position of a count matrix.
+
+    IC is ``log2(alphabet size)`` minus the Shannon entropy of the residues at
+    that position. When `n_sequences` is given it is scaled by the fraction of
+    sequences that have a residue there, so gappy columns do not look conserved.
+    """
+    totals = counts.sum(axis=1)
+    freq = frequencies(counts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entropy = -np.where(freq > 0, freq * np.log2(freq), 0.0).sum(axis=1)
+    ic = np.where(totals > 0, np.log2(counts.shape[1]) - entropy, 0.0)
+    if n_sequences:
+        ic = ic * totals / n_sequences
+    return ic
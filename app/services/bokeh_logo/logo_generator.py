@@ -1,10 +1,129 @@
 from bokeh.plotting import figure
 from bokeh.models import ColumnDataSource, HoverTool
-from bokeh.palettes import Category20
 import pandas as pd
 import numpy as np
 from typing import Optional
 
+from .frequencies import (
+    AMINO_ACIDS,
+    NUCLEOTIDES,
+    encode_alignment,
+    frequencies,
+    information_content,
+    position_frequency_matrix,
+)
+
+# Residue colors of each scheme (Clustal X groups for proteins)
+COLOR_SCHEMES = {
+    "proteinClustal": {
+        **dict.fromkeys("AILMFWVC", "#80a0f0"),
+        **dict.fromkeys("KR", "#f01505"),
+        **dict.fromkeys("ED", "#c048c0"),
+        **dict.fromkeys("NQST", "#15c015"),
+        "G": "#f09048",
+        "P": "#c0c000",
+        **dict.fromkeys("HY", "#15a4a4"),
+    },
+    "nucleotide": {"A": "#15c015", "C": "#1f77b4", "G": "#f09048", "T": "#f01505"},
+}
+
+
+def logo_figure(
+    counts: np.ndarray,
+    alphabet: str = AMINO_ACIDS,
+    plot_type: str = "seqlogo",
+    color: str = "proteinClustal",
+    width: int = 16,
+    title: str = "Sequence Logo",
+    positions: Optional[list] = None,
+    n_sequences: Optional[int] = None,
+) -> figure:
+    """
+    Draw a position frequency matrix as a stacked logo.
+
+    Every residue block of every position comes from one ColumnDataSource and
+    is drawn by a single ``vbar`` renderer; at each position the most frequent
+    residue sits at the bottom.
+
+    Args:
+        counts: (length, len(alphabet)) matrix from `position_frequency_matrix`
+        alphabet: Symbols of the matrix columns
+        plot_type: 'seqlogo' (heights in bits) or 'frequency' (heights 0-1)
+        color: Color scheme ('proteinClustal' or 'nucleotide')
+        width: Width of the plot
+        title: Plot title
+        positions: Position labels shown on hover (default 1..length)
+        n_sequences: Sequence count, to scale bits by column occupancy
+
+    Returns:
+        Bokeh figure object
+    """
+    length = counts.shape[0]
+    if positions is None:
+        positions = list(range(1, length + 1))
+
+    freq = frequencies(counts)
+    if plot_type == "frequency":
+        scale, y_max, y_label = np.ones(length), 1.0, "Frequency"
+    else:
+        scale = information_content(counts, n_sequences)
+        y_max, y_label = np.log2(len(alphabet)), "Information Content (bits)"
+
+    heights = freq * scale[:, None]
+    order = np.argsort(-heights, axis=1, kind="stable")
+    stacked = np.take_along_axis(heights, order, axis=1)
+    tops = np.cumsum(stacked, axis=1)
+    rows, ranks = np.nonzero(stacked > 0)
+    symbols = order[rows, ranks]
+
+    colors = COLOR_SCHEMES.get(color, COLOR_SCHEMES["proteinClustal"])
+    source = ColumnDataSource(
+        {
+            "x": rows + 0.5,
+            "bottom": tops[rows, ranks] - stacked[rows, ranks],
+            "top": tops[rows, ranks],
+            "position": [positions[r] for r in rows],
+            "residue": [alphabet[s] for s in symbols],
+            "frequency": freq[rows, symbols],
+            "color": [colors.get(alphabet[s], "#b0b0b0") for s in symbols],
+        }
+    )
+
+    p = figure(
+        title=title,
+        x_range=(0, max(1, length)),
+        y_range=(0, y_max),
+        width=width * 50,
+        height=400,
+        tools="pan,wheel_zoom,box_zoom,reset,save",
+    )
+    blocks = p.vbar(
+        x="x",
+        bottom="bottom",
+        top="top",
+        width=0.8,
+        fill_color="color",
+        line_color=None,
+        source=source,
+    )
+
+    # Add hover tool
+    hover = HoverTool(renderers=[blocks])
+    hover.tooltips = [
+        ("Position", "@position"),
+        ("Residue", "@residue"),
+        ("Frequency", "@frequency{0.00}"),
+    ]
+    p.add_tools(hover)
+
+    # Style the plot
+    p.xaxis.axis_label = "Position"
+    p.yaxis.axis_label = y_label
+    p.grid.grid_line_color = None
+    p.outline_line_color = None
+
+    return p
+
 
 def generate_logo(
     data: pd.DataFrame,
@@ -43,75 +162,19 @@ def generate_logo(
         elif chain == "L":
             data = data[data["v_call_VJ"].str.startswith(("IGK", "IGL"))]
 
-    # Get sequence data and handle varying lengths
+    # Get sequence data; shorter sequences are padded with gaps
     sequences = data["sequence"].tolist()
     if not sequences:
         return figure(title="No sequences found")
 
-    # Find the maximum sequence length
-    max_length = max(len(seq) for seq in sequences)
-
-    # Pad shorter sequences with gaps
-    padded_sequences = [seq + "-" * (max_length - len(seq)) for seq in sequences]
-
-    # Calculate position-wise frequencies
-    positions = range(max_length)
-
-    # Create figure
-    p = figure(
+    alphabet = NUCLEOTIDES if color == "nucleotide" else AMINO_ACIDS
+    counts = position_frequency_matrix(encode_alignment(sequences), alphabet)
+    return logo_figure(
+        counts,
+        alphabet,
+        plot_type,
+        color,
+        width,
         title=f"Sequence Logo for {gene if gene != 'all' else 'All Sequences'}",
-        x_range=(0, max_length),
-        y_range=(0, 2),
-        width=width * 50,
-        height=400,
-        tools="pan,wheel_zoom,box_zoom,reset,save",
+        n_sequences=len(sequences),
     )
-
-    # Add hover tool
-    hover = HoverTool()
-    hover.tooltips = [
-        ("Position", "@x"),
-        ("Residue", "@residue"),
-        ("Frequency", "@frequency{0.00}"),
-    ]
-    p.add_tools(hover)
-
-    # Plot sequence logo
-    if plot_type == "seqlogo":
-        # Calculate information content
-        for pos in positions:
-            residues = [seq[pos] for seq in padded_sequences]
-            unique_residues = set(residues)
-
-            # Calculate frequencies
-            frequencies = {}
-            for res in unique_residues:
-                freq = residues.count(res) / len(residues)
-                frequencies[res] = freq
-
-            # Calculate information content
-            ic = 2 - sum(-freq * np.log2(freq) for freq in frequencies.values())
-
-            # Plot residues
-            y_offset = 0
-            for res, freq in sorted(
-                frequencies.items(), key=lambda x: x[1], reverse=True
-            ):
-                height = freq * ic
-                p.rect(
-                    x=pos + 0.5,
-                    y=y_offset + height / 2,
-                    width=0.8,
-                    height=height,
-                    fill_color=Category20[20][hash(res) % 20],
-                    line_color=None,
-                )
-                y_offset += height
-
-    # Style the plot
-    p.xaxis.axis_label = "Position"
-    p.yaxis.axis_label = "Information Content (bits)"
-    p.grid.grid_line_color = None
-    p.outline_line_color = None
-
-    return p
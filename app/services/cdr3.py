@@ -0,0 +1,183 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from app.services.alignment_cache import AlignmentCache
+from app.services.regions import CHAIN_SUFFIXES, longest_chunk
+from app.services.sequence_arrays import encode_sequences
+from app.services.versioning import versioned_key
+
+# Bump when the cached analysis changes meaning
+CDR3_ANALYSIS_VERSION = 1
+
+# Candidate pairs compared at once (bounds the temporary arrays)
+PAIR_BLOCK = 2_000_000
+
+
+def cdr3_sequences(merged_df: pd.DataFrame, chain: str) -> tuple:
+    """
+    Return the sequence ids and CDR3 amino-acid sequences of one chain.
+
+    The CDR3 is the junction without its conserved first and last residues
+    (Cys and Trp/Phe); cells without a junction are left out.
+
+    Returns:
+        Tuple of (sequence ids, CDR3 strings)
+    """
+    column = f"junction_aa_{CHAIN_SUFFIXES[chain]}"
+    if column not in merged_df:
+        return [], []
+    ids, cdr3s = [], []
+    for sequence_id, junction in zip(merged_df["sequence_id"], merged_df[column]):
+        junction = longest_chunk(junction)
+        if len(junction) > 2:
+            ids.append(sequence_id)
+            cdr3s.append(junction[1:-1])
+    return ids, cdr3s
+
+
+def spectratype(cdr3s: list) -> dict:
+    """Return the CDR3 length histogram: total and distinct sequences per length."""
+    lengths = pd.Series([len(s) for s in cdr3s], dtype=int)
+    distinct = pd.Series([len(s) for s in set(cdr3s)], dtype=int)
+    counts = lengths.value_counts().sort_index()
+    return {
+        "length": counts.index.tolist(),
+        "count": counts.values.tolist(),
+        "unique": distinct.value_counts().reindex(counts.index, fill_value=0).values.tolist(),
+    }
+
+
+def _run_pairs(positions: np.ndarray, run_end: np.ndarray) -> tuple:
+    # Every (p, q) with p < q < run_end[p], for the sorted positions given
+    counts = run_end[positions] - positions - 1
+    left = np.repeat(positions, counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return left, left + 1 + offsets
+
+
+def close_pairs(codes: np.ndarray, max_mismatches: int) -> tuple:
+    """
+    Return the pairs of equal-length encoded sequences within `max_mismatches`.
+
+    Sequences are split into ``max_mismatches + 1`` segments: two sequences
+    within that many mismatches share at least one segment exactly. For each
+    segment the rows are sorted by it and only rows in the same run are
+    compared, in vectorized blocks of `PAIR_BLOCK` pairs. A pair may be
+    returned more than once.
+
+    Returns:
+        Tuple of (row indexes, row indexes) of the close pairs
+    """
+    n, length = codes.shape
+    if n < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    if max_mismatches >= length:
+        return np.triu_indices(n, 1)
+
+    bounds = np.linspace(0, length, max_mismatches + 2).astype(int)
+    lefts, rights = [], []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        _, key = np.unique(codes[:, start:stop], axis=0, return_inverse=True)
+        order = np.argsort(key.reshape(-1), kind="stable")
+        sorted_key = key.reshape(-1)[order]
+        run_end = np.searchsorted(sorted_key, sorted_key, side="right")
+
+        # Split the sorted positions so that each block yields ~PAIR_BLOCK pairs
+        pair_counts = np.cumsum(run_end - np.arange(n) - 1)
+        cuts = np.searchsorted(pair_counts, np.arange(PAIR_BLOCK, pair_counts[-1], PAIR_BLOCK))
+        for positions in np.split(np.arange(n), cuts):
+            left, right = _run_pairs(positions, run_end)
+            if not len(left):
+                continue
+            left, right = order[left], order[right]
+            close = (codes[left] != codes[right]).sum(axis=1) <= max_mismatches
+            lefts.append(left[close])
+            rights.append(right[close])
+    if not lefts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(lefts), np.concatenate(rights)
+
+
+def hamming_clusters(cdr3s: list, threshold: float) -> np.ndarray:
+    """
+    Cluster CDR3s of equal length by normalized Hamming distance.
+
+    Two CDR3s of length L are linked when they differ at no more than
+    ``floor(threshold * L)`` positions; clusters are the connected components
+    (single linkage). Identical sequences are collapsed first and sequences
+    of different lengths never share a cluster.
+
+    Returns:
+        Cluster number of every CDR3, numbered by decreasing cluster size
+    """
+    if not cdr3s:
+        return np.empty(0, dtype=np.int64)
+    inverse, uniques = pd.factorize(pd.Series(cdr3s))
+    lengths = np.array([len(s) for s in uniques])
+
+    lefts, rights = [], []
+    for length in np.unique(lengths):
+        members = np.flatnonzero(lengths == length)
+        max_mismatches = int(np.floor(threshold * length + 1e-9))
+        if len(members) < 2 or max_mismatches == 0:
+            continue
+        codes = encode_sequences([uniques[i] for i in members], int(length))
+        left, right = close_pairs(codes, max_mismatches)
+        lefts.append(members[left])
+        rights.append(members[right])
+
+    n = len(uniques)
+    left = np.concatenate(lefts) if lefts else np.empty(0, dtype=np.int64)
+    right = np.concatenate(rights) if rights else np.empty(0, dtype=np.int64)
+    graph = coo_matrix((np.ones(len(left), dtype=np.int8), (left, right)), shape=(n, n))
+    _, components = connected_components(graph, directed=False)
+
+    labels = components[inverse]
+    sizes = np.bincount(labels)
+    rank = np.empty(len(sizes), dtype=np.int64)
+    rank[np.lexsort((np.arange(len(sizes)), -sizes))] = np.arange(len(sizes))
+    return rank[labels]
+
+
+def cdr3_analysis(sequences: dict, threshold: float) -> dict:
+    """
+    Return the spectratype and CDR3 clusters of each chain.
+
+    Args:
+        sequences: Chain type -> `cdr3_sequences` of that chain
+        threshold: Normalized Hamming threshold of `hamming_clusters`
+    """
+    chains = {}
+    for chain, (ids, cdr3s) in sequences.items():
+        clusters = hamming_clusters(cdr3s, threshold)
+        sizes = np.bincount(clusters) if len(clusters) else np.empty(0, dtype=np.int64)
+        chains[chain] = {
+            "spectratype": spectratype(cdr3s),
+            "clusters": {
+                "sequence_id": ids,
+                "cdr3": cdr3s,
+                "cluster": clusters.tolist(),
+            },
+            "n_clusters": int(len(sizes)),
+            "cluster_sizes": sizes.tolist(),
+        }
+    return {"threshold": threshold, "chains": chains}
+
+
+def cached_cdr3_analysis(
+    cache: AlignmentCache, merged_df: pd.DataFrame, version: Optional[str], threshold: float
+) -> dict:
+    """Return `cdr3_analysis` of both chains, cached per project version and threshold."""
+    key = versioned_key("cdr3", version, CDR3_ANALYSIS_VERSION, threshold) if version else None
+    cached = cache.get_json(key, "cdr3") if key else None
+    if cached is not None:
+        return cached
+    sequences = {chain: cdr3_sequences(merged_df, chain) for chain in CHAIN_SUFFIXES}
+    value = cdr3_analysis(sequences, threshold)
+    if key:
+        cache.put_json(key, value, "cdr3")
+    return value
@@ -0,0 +1,138 @@
+import re
+from typing import Optional
+
+import numpy as np
+from Bio.Data.CodonTable import TranslationError
+from Bio.Seq import Seq
+
+from app.services.regions import IMGT_REGION_ENDS, longest_chunk, residue_codons
+from app.services.sequence_arrays import GAP_CODE, encode_bytes, encode_sequences, matches_to
+
+
+def frame_zero_translation(nt: str) -> str:
+    """Translate the IUPAC nucleotides of a sequence in frame 0 ("X" per codon on failure)."""
+    nt = re.sub(r"[^ACGTURYKMSWBDHVN]", "", nt.upper())
+    nt = nt[: len(nt) // 3 * 3]
+    try:
+        return str(Seq(nt).translate())
+    except TranslationError:
+        return "X" * (len(nt) // 3)
+
+
+def imgt_anchored(gapped: list) -> list:
+    """
+    Lay out the translations of IMGT-gapped V(D)J nucleotide sequences by IMGT codon.
+
+    Residues up to the end of FR3 (codon 104) sit at their IMGT codon, so gaps
+    and deletions in the V region do not shift later positions; the CDR3 and
+    FR4 that follow are right-aligned, which keeps the J region in register
+    whatever the CDR3 length.
+
+    Returns:
+        Strings of equal length, "-" where a sequence has no residue
+    """
+    gapped = [longest_chunk(s) for s in gapped]
+    codons = residue_codons(gapped)
+    residues = encode_bytes([frame_zero_translation(s) for s in gapped], codons.shape[1])
+    v_end = int(IMGT_REGION_ENDS[-1])
+    in_v = (codons >= 1) & (codons <= v_end)
+    in_tail = codons > v_end
+    n_tail = in_tail.sum(axis=1)
+    tail_width = int(n_tail.max(initial=0))
+    width = v_end + tail_width
+
+    layout = np.full((len(gapped), width), ord("-"), dtype=np.uint8)
+    rows, cols = np.nonzero(in_v)
+    layout[rows, codons[rows, cols] - 1] = residues[rows, cols]
+    # Codons increase along a row, so the tail follows the V residues
+    n_v = in_v.sum(axis=1)
+    rows, cols = np.nonzero(in_tail)
+    layout[rows, width - n_tail[rows] + cols - n_v[rows]] = residues[rows, cols]
+    text = layout.tobytes().decode("latin-1")
+    return [text[i * width : (i + 1) * width] for i in range(len(gapped))]
+
+
+def identity_to(codes, lengths, refs, ref_lengths) -> np.ndarray:
+    """Fraction of identical residues relative to the shorter sequence of each pair."""
+    shorter = np.minimum(lengths[:, None], ref_lengths[None, :])
+    return matches_to(codes, refs) / np.maximum(shorter, 1)
+
+
+def greedy_cluster(
+    seqs: list, identity: float, max_clusters: Optional[int] = None
+) -> tuple:
+    """
+    Cluster sequences CD-HIT style.
+
+    Sequences are visited longest first (ties: most frequent first); each joins
+    the most similar existing representative if its identity is at least
+    `identity`, otherwise it becomes a new representative. Once `max_clusters`
+    representatives exist, every remaining sequence joins its most similar one,
+    which bounds the cost for arbitrarily large inputs. Identical sequences are
+    collapsed before clustering.
+
+    Args:
+        seqs: Position-comparable sequences, e.g. translations laid out by
+            `imgt_anchored` (identity is counted column by column)
+        identity: Minimum identity (0-1) to join a cluster
+        max_clusters: Optional cap on the number of representatives
+
+    Returns:
+        Tuple of (representative indices into `seqs`, cluster number of each sequence)
+    """
+    if not seqs:
+        return [], np.empty(0, dtype=np.int64)
+
+    codes = encode_sequences(seqs)
+    lengths = (codes != GAP_CODE).sum(axis=1)
+    unique, first, inverse, counts = np.unique(
+        codes, axis=0, return_index=True, return_inverse=True, return_counts=True
+    )
+    inverse = inverse.reshape(-1)
+    u_lengths = lengths[first]
+    order = np.lexsort((-counts, -u_lengths))
+
+    capacity = len(unique) if not max_clusters else min(len(unique), max_clusters)
+    rep_codes = np.empty((capacity, codes.shape[1]), dtype=np.uint8)
+    rep_lengths = np.empty(capacity, dtype=u_lengths.dtype)
+    reps = []
+    u_cluster = np.full(len(unique), -1, dtype=np.int64)
+
+    for pos, u in enumerate(order):
+        if reps:
+            ident = identity_to(
+                unique[u : u + 1],
+                u_lengths[u : u + 1],
+                rep_codes[: len(reps)],
+                rep_lengths[: len(reps)],
+            )[0]
+            best = int(ident.argmax())
+            if ident[best] >= identity:
+                u_cluster[u] = best
+                continue
+        if len(reps) == capacity:
+            # Representative budget reached: assign the rest to their nearest one
+            rest = order[pos:]
+            rest = rest[u_cluster[rest] < 0]
+            ident = identity_to(unique[rest], u_lengths[rest], rep_codes, rep_lengths)
+            u_cluster[rest] = ident.argmax(axis=1)
+            break
+        rep_codes[len(reps)] = unique[u]
+        rep_lengths[len(reps)] = u_lengths[u]
+        u_cluster[u] = len(reps)
+        reps.append(u)
+
+    return first[reps].tolist(), u_cluster[inverse]
+
+
+def cluster_membership(ids: list, reps: list, assignment: np.ndarray, identity: float) -> dict:
+    """Return cluster sizes and members keyed by representative id."""
+    members = {ids[rep]: [] for rep in reps}
+    rep_ids = [ids[rep] for rep in reps]
+    for orig_id, cluster in zip(ids, assignment.tolist()):
+        members[rep_ids[cluster]].append(orig_id)
+    return {
+        "identity": identity,
+        "sizes": {rep_id: len(m) for rep_id, m in members.items()},
+        "members": members,
+    }
@@ -22,6 +22,10 @@ import subprocess
 import shlex
 
 from app.core.config import get_settings
+from app.services.kmer_index import schedule_index
+from app.services.mutations import annotate_mutations
+from app.services.regions import annotate_regions
+from app.services.sequence_arrays import encode_sequences, hamming_to
 
 settings = get_settings()
 
@@ -134,10 +138,13 @@ async def preprocess(
 
             # Create merged dataset with consistent naming during preprocessing
             merged_df = create_merged_dataset(
-                vdj, os.path.basename(upload_folder.rstrip("/"))
+                vdj, os.path.basename(upload_folder.rstrip("/")), species
             )
             merged_path = os.path.join(upload_folder, "merged_data.pkl")
             merged_df.to_pickle(merged_path)
+            schedule_index(
+                upload_folder, os.path.basename(upload_folder.rstrip("/")), merged_df
+            )
 
             adata_path = os.path.join(upload_folder, "processed_adata.h5ad")
             vdj_path = os.path.join(upload_folder, "processed_vdj.h5ddl")
@@ -196,10 +203,13 @@ async def preprocess(
 
             # Create merged dataset with consistent naming during preprocessing
             merged_df = create_merged_dataset(
-                vdj, os.path.basename(upload_folder.rstrip("/"))
+                vdj, os.path.basename(upload_folder.rstrip("/")), species
             )
             merged_path = os.path.join(upload_folder, "merged_data.pkl")
             merged_df.to_pickle(merged_path)
+            schedule_index(
+                upload_folder, os.path.basename(upload_folder.rstrip("/")), merged_df
+            )
 
             vdj_path = os.path.join(upload_folder, "processed_vdj.h5ddl")
             try:
@@ -246,13 +256,27 @@ async def load_project(
         # Load merged dataset if it exists, otherwise create it
         if os.path.exists(merged_path):
             merged_df = pd.read_pickle(merged_path)
+            # Projects preprocessed before region or mutation annotation
+            species = project.get("species")
+            missing_regions = "regions_VDJ" not in merged_df.columns
+            missing_mutations = species and "mu_freq_VDJ" not in merged_df.columns
+            if missing_regions:
+                annotate_regions(merged_df, species)
+            if missing_mutations:
+                annotate_mutations(merged_df, species)
+            if missing_regions or missing_mutations:
+                merged_df.to_pickle(merged_path)
         else:
             # Fallback: create merged dataset on-the-fly
             project_name = project.get("project_name", "Unknown")
-            merged_df = create_merged_dataset(vdj, project_name)
+            merged_df = create_merged_dataset(vdj, project_name, project.get("species"))
             # Save it for future use
             merged_df.to_pickle(merged_path)
 
+        # Projects preprocessed before the cross-project search index, or
+        # whose merged dataset was rewritten since (built in the background)
+        schedule_index(project_dir, os.path.basename(project_dir), merged_df)
+
         if adata_path != "NULL":
             adata = sc.read(adata_path)
             return vdj, adata, merged_df
@@ -447,27 +471,60 @@ def compute_alignment_and_consensus(seqs, ids=None):
     consensus = str(summary_align.dumb_consensus())
 
     # Compute match matrix
-    match_matrix = []
-    for i, c in enumerate(consensus):
-        col = [seq[i] for seq in align_strs]
-        match_matrix.append([base == c for base in col])
+    arr = encode_sequences(align_strs)
+    cons = encode_sequences([consensus], width=arr.shape[1])[0]
+    match_matrix = (arr == cons).T.tolist()
 
     # Optionally, cluster by similarity (as before)
     if len(align_strs) > 1:
-        arr = np.array([list(s) for s in align_strs])
-
-        def hamming(a, b):
-            return np.sum(a != b)
-
-        max_len = arr.shape[1]
-        dist_vec = pdist(arr, lambda u, v: hamming(u, v) / max_len)
-        linkage_matrix = linkage(dist_vec, method="average")
-        order = leaves_list(linkage_matrix)
+        order = similarity_order(arr)
         align_strs = [align_strs[i] for i in order]
         align_ids = [align_ids[i] for i in order]
     return list(zip(align_ids, align_strs)), consensus, match_matrix
 
 
+def similarity_order(codes: np.ndarray, exact_limit: Optional[int] = None) -> np.ndarray:
+    """
+    Order rows of an encoded alignment so similar sequences are adjacent.
+
+    Up to `exact_limit` rows this is the leaf order of an average-linkage tree
+    over normalized Hamming distances. Larger inputs are split around randomly
+    drawn representatives: representatives are ordered exactly, every row joins
+    its nearest representative, and each group is ordered recursively.
+
+    Args:
+        codes: (n, L) integer-encoded alignment
+        exact_limit: Largest n ordered exactly (defaults to the configured limit)
+
+    Returns:
+        Array of row indices
+    """
+    if exact_limit is None:
+        exact_limit = settings.alignment_order_exact_limit
+    n = len(codes)
+    if n < 3:
+        return np.arange(n)
+    if n <= exact_limit:
+        # Built-in metric: fraction of differing positions (hamming / max_len)
+        dist_vec = pdist(codes, metric="hamming")
+        return leaves_list(linkage(dist_vec, method="average"))
+
+    n_reps = min(exact_limit, max(2, int(np.sqrt(n))))
+    rng = np.random.default_rng(0)
+    reps = np.sort(rng.choice(n, size=n_reps, replace=False))
+    nearest = hamming_to(codes, codes[reps]).argmin(axis=1)
+    if np.bincount(nearest, minlength=n_reps).max() == n:
+        # Representatives cannot split the rows (e.g. all identical)
+        return np.lexsort(codes.T[::-1])
+
+    order = []
+    for rep in similarity_order(codes[reps], exact_limit):
+        members = np.flatnonzero(nearest == rep)
+        if len(members):
+            order.append(members[similarity_order(codes[members], exact_limit)])
+    return np.concatenate(order)
+
+
 def best_translation(nt) -> str:
     """
     Translate nucleotide → amino-acid, choosing the reading frame
@@ -518,13 +575,17 @@ def best_translation(nt) -> str:
     return max(frames, key=longest_fragment)
 
 
-def create_merged_dataset(vdj: ddl.Dandelion, project_name: str) -> pd.DataFrame:
+def create_merged_dataset(
+    vdj: ddl.Dandelion, project_name: str, species: Optional[str] = None
+) -> pd.DataFrame:
     """
     Create a merged dataset from VDJ data with consistent naming during preprocessing.
 
     Args:
         vdj: Dandelion object containing VDJ data
         project_name: Name of the project for creating display names
+        species: Species of the data; when given, V calls are resolved to
+            germline alleles (see `annotate_regions`)
 
     Returns:
         Merged DataFrame with display names and all necessary metadata
@@ -548,6 +609,11 @@ def create_merged_dataset(vdj: ddl.Dandelion, project_name: str) -> pd.DataFrame
                 # Fallback: create sequence IDs from row numbers if not available
                 merged["sequence_id"] = [f"seq_{i + 1}" for i in range(len(merged))]
 
+        # Per-residue FR/CDR labels and CDR boundaries for both chains
+        annotate_regions(merged, species)
+        if species:
+            annotate_mutations(merged, species)
+
         return merged
 
     except Exception as e:
@@ -0,0 +1,162 @@
+import json
+import math
+import struct
+
+import numpy as np
+
+from app.services.alignment_cache import AlignmentCache, artifact_key, cached_artifact
+from app.services.distances import cached_mismatch_matrix
+
+MATRIX_MEDIA_TYPE = "application/octet-stream"
+
+MATRIX_MAGIC = b"BCRM"
+MATRIX_VERSION = 1
+# magic, version, header length
+_MATRIX_PREFIX = struct.Struct("<4sBI")
+
+# Binary encodings of a percent-mismatch matrix
+MATRIX_FORMATS = ("uint8", "float16")
+
+# Largest tile edge served by the tile endpoint
+MAX_TILE_SIZE = 1024
+
+
+def encode_values(values: np.ndarray, fmt: str) -> tuple:
+    """
+    Encode percent-mismatch values for a binary response.
+
+    ``uint8`` stores percent identity quantized to 0..255 (multiply by
+    ``scale`` to get percentages back); ``float16`` stores the percent
+    mismatch itself.
+
+    Returns:
+        Tuple of (bytes, header fields describing the encoding)
+    """
+    if fmt == "uint8":
+        quantized = np.rint((100.0 - values) * (255 / 100.0)).clip(0, 255)
+        return quantized.astype(np.uint8).tobytes(), {
+            "dtype": "uint8",
+            "quantity": "percent_identity",
+            "scale": 100 / 255,
+        }
+    return values.astype("<f2").tobytes(), {
+        "dtype": "float16",
+        "quantity": "percent_mismatch",
+        "scale": 1.0,
+    }
+
+
+def pack_matrix(header: dict, body: bytes) -> bytes:
+    """Prefix a matrix body with ``<4sBI`` (magic, version, header length) and a JSON header."""
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    prefix = _MATRIX_PREFIX.pack(MATRIX_MAGIC, MATRIX_VERSION, len(header_bytes))
+    return b"".join([prefix, header_bytes, body])
+
+
+def tile_levels(n: int, tile_size: int) -> int:
+    """Return the deepest zoom level; level 0 shows the whole matrix in one tile."""
+    if n <= tile_size:
+        return 0
+    return math.ceil(math.log2(n / tile_size))
+
+
+def tile_bounds(n: int, tile_size: int, level: int, row: int, col: int) -> tuple:
+    """
+    Return the matrix ranges and pooling factor of a tile.
+
+    At level L the matrix is split into a 2^L x 2^L grid; each tile covers
+    `span` rows and columns, mean-pooled by `factor` to at most `tile_size`.
+
+    Returns:
+        Tuple of (r0, r1, c0, c1, factor)
+    """
+    span = math.ceil(n / 2**level)
+    factor = max(1, math.ceil(span / tile_size))
+    r0, c0 = row * span, col * span
+    return r0, min(n, r0 + span), c0, min(n, c0 + span), factor
+
+
+def tile_in_matrix(n: int, tile_size: int, level: int, row: int, col: int) -> bool:
+    """
+    Return whether a tile address covers part of an `n` x `n` matrix.
+
+    Spans are rounded up, so the last rows and columns of the 2^L grid can
+    start past the end of the matrix; those tiles are empty.
+    """
+    if not 0 <= level <= tile_levels(n, tile_size):
+        return False
+    if not (0 <= row < 2**level and 0 <= col < 2**level):
+        return False
+    r0, _, c0, _, _ = tile_bounds(n, tile_size, level, row, col)
+    return r0 < n and c0 < n
+
+
+def matrix_rows(
+    cache: AlignmentCache, key: str, chain: str, seqs: list, r0: int, r1: int
+) -> np.ndarray:
+    """
+    Return rows r0:r1 of the cached mismatch matrix.
+
+    Once the matrix is cached only the requested rows are read from the store;
+    on a miss the whole matrix is computed (and cached) first.
+    """
+    n = len(seqs)
+    itemsize = np.dtype(np.float64).itemsize
+    payload = cache.read_range(
+        artifact_key(key, f"{chain}_mismatch_matrix"), r0 * n * itemsize, (r1 - r0) * n * itemsize
+    )
+    if len(payload) == (r1 - r0) * n * itemsize:
+        return np.frombuffer(payload, dtype=np.float64).reshape(r1 - r0, n)
+    return cached_mismatch_matrix(cache, key, chain, seqs)[r0:r1]
+
+
+def mean_pool(block: np.ndarray, factor: int) -> np.ndarray:
+    """Average `factor` x `factor` cells (partial blocks at the edges over their own size)."""
+    if factor == 1:
+        return block
+    rows = np.arange(0, block.shape[0], factor)
+    cols = np.arange(0, block.shape[1], factor)
+    sums = np.add.reduceat(np.add.reduceat(block, rows, axis=0), cols, axis=1)
+    counts = np.outer(
+        np.diff(np.append(rows, block.shape[0])), np.diff(np.append(cols, block.shape[1]))
+    )
+    return sums / counts
+
+
+def matrix_tile(
+    cache: AlignmentCache,
+    key: str,
+    chain: str,
+    seqs: list,
+    tile_size: int,
+    level: int,
+    row: int,
+    col: int,
+) -> tuple:
+    """
+    Return one tile of the mismatch matrix.
+
+    Full-resolution tiles are sliced from a ranged read of their rows; pooled
+    (overview) tiles are cached per tile, so repeated overviews never touch the
+    full matrix again.
+
+    Returns:
+        Tuple of (float64 tile values, (r0, r1, c0, c1, factor))
+    """
+    n = len(seqs)
+    bounds = tile_bounds(n, tile_size, level, row, col)
+    r0, r1, c0, c1, factor = bounds
+    if factor == 1:
+        return matrix_rows(cache, key, chain, seqs, r0, r1)[:, c0:c1], bounds
+
+    shape = (math.ceil((r1 - r0) / factor), math.ceil((c1 - c0) / factor))
+    tile = cached_artifact(
+        cache,
+        key,
+        f"{chain}_mismatch_tile_{tile_size}_{level}_{row}_{col}",
+        "distances",
+        lambda: mean_pool(matrix_rows(cache, key, chain, seqs, r0, r1)[:, c0:c1], factor),
+        encode=lambda values: values.astype(np.float64).tobytes(),
+        decode=lambda payload: np.frombuffer(payload, dtype=np.float64).reshape(shape),
+    )
+    return tile, bounds
@@ -0,0 +1,275 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+from Bio.Align import substitution_matrices
+from Bio.Phylo.TreeConstruction import DistanceMatrix
+from scipy.cluster.hierarchy import leaves_list, linkage
+from scipy.spatial.distance import squareform
+
+from app.core.config import get_settings
+from app.services.alignment_cache import AlignmentCache, cached_artifact
+from app.services.alignment_codec import chain_alignment
+from app.services.sequence_arrays import (
+    ALPHABET,
+    BLOCK_BYTES,
+    encode_bytes,
+    encode_sequences,
+)
+
+settings = get_settings()
+
+# Distance models, named as in Bio.Phylo.TreeConstruction.DistanceCalculator
+MODELS = ("identity", "blosum62")
+
+# Letters skipped by DistanceCalculator for substitution-matrix models
+SKIP_LETTERS = ("-", "*")
+
+
+@lru_cache()
+def scoring_table(name: str) -> tuple:
+    """
+    Return a substitution matrix re-indexed by `ALPHABET` codes.
+
+    Returns:
+        Tuple of (float32 score table, boolean array of codes the matrix knows)
+    """
+    matrix = substitution_matrices.load(name.upper())
+    size = len(ALPHABET)
+    table = np.zeros((size, size), dtype=np.float32)
+    known = np.array([char in matrix.alphabet for char in ALPHABET])
+    for i, a in enumerate(ALPHABET):
+        for j, b in enumerate(ALPHABET):
+            if known[i] and known[j]:
+                table[i, j] = matrix[a, b]
+    return table, known
+
+
+# float64 (rows x cols) temporaries alive at once while a tile is computed
+_TILE_TEMPORARIES = 6
+
+
+def _tile_size(n_features: int) -> int:
+    """
+    Return the side of the (row block x column block) tiles pair matrices are built in.
+
+    Both the float32 one-hot blocks (side x features) and the float64 pair
+    temporaries of a tile (side x side) stay within `BLOCK_BYTES`, whatever
+    the number of sequences.
+    """
+    by_features = BLOCK_BYTES // max(1, n_features * 4)
+    by_pairs = math.isqrt(BLOCK_BYTES // (8 * _TILE_TEMPORARIES))
+    return max(1, min(by_features, by_pairs))
+
+
+def substitution_distances(
+    codes: np.ndarray, model: str = "blosum62", dtype=np.float64
+) -> np.ndarray:
+    """
+    Return the (n, n) distance matrix of an encoded alignment.
+
+    Computes exactly what `DistanceCalculator(model).get_distance` computes:
+    for substitution-matrix models, ``1 - score / max(self_score_1, self_score_2)``
+    over positions where neither residue is a gap or stop; for "identity",
+    the fraction of differing positions. Pair scores are obtained as one matrix
+    product per tile of (row block x column block): each row is expanded to a
+    one-hot vector over (position, residue) and multiplied against the
+    substitution-matrix columns of the other rows. Tiles are written into the
+    preallocated output, so working memory is bounded by `_tile_size`.
+
+    Args:
+        codes: (n, L) array from `encode_sequences`
+        model: "identity" or a substitution matrix name such as "blosum62"
+        dtype: Output dtype
+
+    Returns:
+        Symmetric distance matrix with a zero diagonal
+    """
+    n, width = codes.shape
+    out = np.zeros((n, n), dtype=dtype)
+    if n < 2:
+        return out
+
+    size = len(ALPHABET)
+    if model == "identity":
+        # Character identity over every position, gaps included
+        table = np.eye(size, dtype=np.float32)
+        valid = np.ones(codes.shape, dtype=bool)
+    else:
+        table, known = scoring_table(model)
+        skip = np.array([char in SKIP_LETTERS for char in ALPHABET])
+        valid = ~skip[codes]
+        bad = valid & ~known[codes]
+        if bad.any():
+            row, col = np.argwhere(bad)[0]
+            raise ValueError(
+                f"Bad letter '{ALPHABET[codes[row, col]]}' at position '{col}'"
+            )
+
+    validf = valid.astype(np.float32)
+    self_scores = table[codes, codes] * validf
+
+    # One-hot features are restricted to the (column, residue) pairs present in
+    # the alignment, typically a handful per column rather than the full alphabet
+    features = np.unique((np.arange(width) * size + codes)[valid])
+    feature_cols, feature_codes = np.divmod(features, size)
+    step = _tile_size(len(features))
+
+    def one_hot(rows):
+        block = codes[rows][:, feature_cols] == feature_codes
+        return (block & valid[rows][:, feature_cols]).astype(np.float32)
+
+    def score_columns(rows):
+        block = table[feature_codes, codes[rows][:, feature_cols]]
+        return block * validf[rows][:, feature_cols]
+
+    for i0 in range(0, n, step):
+        rows_i = np.arange(i0, min(n, i0 + step))
+        hot_i = one_hot(rows_i)
+        for j0 in range(i0, n, step):
+            rows_j = np.arange(j0, min(n, j0 + step))
+            # Integer-valued sums, exact in float32; divide in float64
+            score = (hot_i @ score_columns(rows_j).T).astype(np.float64)
+            if model == "identity":
+                max_score = np.full(score.shape, float(width))
+            else:
+                max_i = self_scores[rows_i] @ validf[rows_j].T
+                max_j = validf[rows_i] @ self_scores[rows_j].T
+                max_score = np.maximum(max_i, max_j).astype(np.float64)
+            dist = np.where(
+                max_score == 0, 1.0, 1.0 - score / np.where(max_score == 0, 1, max_score)
+            )
+            out[i0 : i0 + len(rows_i), j0 : j0 + len(rows_j)] = dist
+            out[j0 : j0 + len(rows_j), i0 : i0 + len(rows_i)] = dist.T
+    np.fill_diagonal(out, 0)
+    return out
+
+
+def distance_matrix_of(seqs: list, model: str = "blosum62", dtype=np.float64) -> np.ndarray:
+    """Encode aligned sequences and return their distance matrix."""
+    return substitution_distances(encode_sequences(seqs), model, dtype)
+
+
+def to_distance_matrix(names: list, matrix: np.ndarray) -> DistanceMatrix:
+    """Wrap a square matrix as a Bio.Phylo `DistanceMatrix`."""
+    lower = [matrix[i, : i + 1].tolist() for i in range(len(names))]
+    return DistanceMatrix(list(names), lower)
+
+
+def mismatch_percentages(seqs: list) -> np.ndarray:
+    """
+    Return the (n, n) matrix of gap-aware percent mismatch between aligned sequences.
+
+    For each pair, positions where either sequence has a gap are ignored and
+    the distance is ``mismatches / compared * 100`` (0 when nothing is
+    compared); sequences of unequal length are compared over the shorter one.
+    Both counts are integer matrix products over the raw-byte encoding, so the
+    values are bit-identical to the per-pair Python computation. They are
+    computed tile by tile (see `_tile_size`) into the preallocated output.
+    """
+    codes = encode_bytes(seqs)
+    n, width = codes.shape
+    out = np.zeros((n, n), dtype=np.float64)
+    if n < 2:
+        return out
+
+    residue = codes != ord("-")
+    residuef = residue.astype(np.float32)
+    # One-hot features over the (column, byte) pairs present outside gaps
+    features = np.unique((np.arange(width) * 256 + codes.astype(np.int64))[residue])
+    feature_cols, feature_codes = np.divmod(features, 256)
+    step = _tile_size(len(features))
+
+    def one_hot(rows):
+        return (codes[rows][:, feature_cols] == feature_codes).astype(np.float32)
+
+    for i0 in range(0, n, step):
+        rows_i = np.arange(i0, min(n, i0 + step))
+        hot_i = one_hot(rows_i)
+        for j0 in range(i0, n, step):
+            rows_j = np.arange(j0, min(n, j0 + step))
+            # Integer-valued sums, exact in float32
+            compared = (residuef[rows_i] @ residuef[rows_j].T).astype(np.float64)
+            matches = (hot_i @ one_hot(rows_j).T).astype(np.float64)
+            mismatches = compared - matches
+            dist = np.where(
+                compared > 0, mismatches / np.where(compared > 0, compared, 1) * 100, 0.0
+            )
+            out[i0 : i0 + len(rows_i), j0 : j0 + len(rows_j)] = dist
+            out[j0 : j0 + len(rows_j), i0 : i0 + len(rows_i)] = dist.T
+    np.fill_diagonal(out, 0)
+    return out
+
+
+def matrix_sequences(result: dict, chain: str) -> list:
+    """Return the `(label, aligned sequence)` rows of a chain's distance matrix."""
+    label_map = result.get(f"{chain}_label_map", {})
+    return [
+        (label_map[orig_id], seq)
+        for orig_id, seq in chain_alignment(result, chain)
+        if orig_id in label_map
+    ]
+
+
+def cached_mismatch_matrix(
+    cache: AlignmentCache, key: str, chain: str, seqs: list
+) -> np.ndarray:
+    """Return the percent-mismatch matrix of a chain, computed once per alignment key."""
+    n = len(seqs)
+    return cached_artifact(
+        cache,
+        key,
+        f"{chain}_mismatch_matrix",
+        "distances",
+        lambda: mismatch_percentages(seqs),
+        encode=lambda matrix: matrix.astype(np.float64).tobytes(),
+        decode=lambda payload: np.frombuffer(payload, dtype=np.float64).reshape(n, n),
+    )
+
+
+def matrix_clustering(matrix: np.ndarray, optimal_limit: int = None) -> dict:
+    """
+    Average-linkage clustering of a square distance matrix.
+
+    Leaves are put in optimal leaf order (adjacent rows as similar as possible)
+    up to `optimal_limit` rows; larger matrices keep the plain linkage order.
+
+    Returns:
+        Dictionary with the row order, the dendrogram (scipy linkage rows
+        ``[left, right, height, size]`` plus the position of every merge along
+        the ordered axis) and whether the order is optimal
+    """
+    if optimal_limit is None:
+        optimal_limit = settings.distance_optimal_order_limit
+    n = len(matrix)
+    if n < 2:
+        return {"order": list(range(n)), "linkage": [], "positions": [], "optimal": True}
+
+    optimal = n <= optimal_limit
+    links = linkage(squareform(matrix, checks=False), "average", optimal_ordering=optimal)
+    order = leaves_list(links)
+
+    # Leaves sit at their rank in the order; a merge sits between its children
+    positions = np.empty(2 * n - 1)
+    positions[order] = np.arange(n)
+    for i, (left, right) in enumerate(links[:, :2].astype(int)):
+        positions[n + i] = (positions[left] + positions[right]) / 2
+    return {
+        "order": order.tolist(),
+        "linkage": links.tolist(),
+        "positions": positions[n:].tolist(),
+        "optimal": optimal,
+    }
+
+
+def cached_matrix_clustering(
+    cache: AlignmentCache, key: str, chain: str, matrix: np.ndarray
+) -> dict:
+    """Return the clustering of a chain's mismatch matrix, cached with the matrix."""
+    return cached_artifact(
+        cache,
+        key,
+        f"{chain}_mismatch_clustering",
+        "distances",
+        lambda: matrix_clustering(matrix),
+    )
@@ -1,5 +1,6 @@
 import os
-from typing import Tuple, Optional
+from functools import lru_cache
+from typing import Dict, Tuple, Optional
 from Bio import SeqIO
 import re
 import csv
@@ -64,23 +65,117 @@ def parse_kabat_annotation(gene: str, species: str) -> Optional[dict]:
     return None
 
 
+def allele_name(record_id: str) -> str:
+    """Return the allele of a FASTA header (plain ``IGHV1-11*01`` or IMGT ``acc|IGHV1-11*01|...``)."""
+    fields = record_id.split("|")
+    return fields[1] if len(fields) > 1 else fields[0]
+
+
+def first_call(gene: str) -> str:
+    """Return the first of possibly several comma-separated gene calls."""
+    return gene.split(",")[0].strip()
+
+
+def read_region_annotations(path: str, chain_type: str) -> Dict[str, dict]:
+    """Parse an annotation CSV into allele -> region name -> (start, stop) (1-based, inclusive)."""
+    annotations = {}
+    with open(path, newline="") as csvfile:
+        for row in csv.DictReader(csvfile):
+            region_dict = {}
+            for region in REGION_ORDER[chain_type]:
+                val = (row.get(region) or "").replace(" ", "")
+                if val and val != "-" and "-" in val:
+                    start, stop = map(int, val.split("-"))
+                    region_dict[region] = (start, stop)
+            if region_dict:
+                annotations.setdefault(row["sequence_id"], region_dict)
+    return annotations
+
+
+class GermlineIndex:
+    """
+    Alleles and region annotations of one germline reference, parsed once.
+
+    Genes are looked up by exact allele (``IGHV1-52*01``); a bare gene name
+    (``IGHV1-52``) resolves to its first allele in the reference.
+    """
+
+    def __init__(
+        self, fasta_path: str, annotation_paths: Optional[dict] = None, records=None
+    ):
+        self.fasta_path = fasta_path
+        # allele -> ungapped, uppercased sequence
+        self.sequences: Dict[str, str] = {}
+        # base gene -> alleles in file order
+        self.alleles: Dict[str, list] = {}
+        if records is None:
+            records = (
+                (allele_name(record.id), str(record.seq))
+                for record in SeqIO.parse(fasta_path, "fasta")
+            )
+        for allele, seq in records:
+            if allele in self.sequences:
+                continue
+            self.sequences[allele] = seq.replace("-", "").replace(".", "").upper()
+            self.alleles.setdefault(allele.split("*")[0], []).append(allele)
+
+        # chain type -> allele -> region dictionary
+        self.regions: Dict[str, Dict[str, dict]] = {}
+        for chain_type, path in (annotation_paths or {}).items():
+            if path and os.path.exists(path):
+                self.regions[chain_type] = read_region_annotations(path, chain_type)
+
+    def allele(self, gene: str) -> Optional[str]:
+        """Return the reference allele for a gene call, or None."""
+        gene = first_call(gene)
+        if gene in self.sequences:
+            return gene
+        alleles = self.alleles.get(gene.split("*")[0])
+        return alleles[0] if alleles else None
+
+    def sequence(self, gene: str) -> Optional[str]:
+        allele = self.allele(gene)
+        return self.sequences[allele] if allele else None
+
+    def region_dict(self, gene: str, chain_type: str) -> Optional[dict]:
+        """Return the region boundaries of a gene: its own allele first, then any allele of the gene."""
+        annotations = self.regions.get(chain_type)
+        if not annotations:
+            return None
+        gene = first_call(gene)
+        allele = self.allele(gene)
+        for candidate in (gene, allele):
+            if candidate in annotations:
+                return annotations[candidate]
+        for candidate in self.alleles.get(gene.split("*")[0], []):
+            if candidate in annotations:
+                return annotations[candidate]
+        return None
+
+
+@lru_cache()
+def load_germline_index(fasta_path: str, annotation_paths: tuple = ()) -> GermlineIndex:
+    """Build (once per process) the index of a FASTA reference and its annotation CSVs."""
+    return GermlineIndex(fasta_path, dict(annotation_paths))
+
+
+def germline_index(species: str) -> GermlineIndex:
+    """Return the germline index of a species' IMGT amino-acid V reference."""
+    # Imported here: the bundle module builds on this one
+    from app.services.germline_bundle import bundle_index, load_bundle
+
+    bundle = load_bundle()
+    reference = bundle.reference_for_source(IMGT_FASTA_PATHS[species]) if bundle else None
+    if reference:
+        return bundle_index(reference)
+    annotation_paths = tuple(sorted(ANNOTATION_CSV_PATHS.get(species, {}).items()))
+    return load_germline_index(IMGT_FASTA_PATHS[species], annotation_paths)
+
+
 def parse_custom_annotation(gene: str, species: str, chain_type: str) -> Optional[dict]:
-    path = ANNOTATION_CSV_PATHS.get(species, {}).get(chain_type)
-    if not path or not os.path.exists(path):
+    if species not in IMGT_FASTA_PATHS:
         return None
-    base_gene = gene.split("*")[0]
-    with open(path, newline="") as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            if row["sequence_id"] == gene or row["sequence_id"].startswith(base_gene):
-                region_dict = {}
-                for region in REGION_ORDER[chain_type]:
-                    val = row.get(region, "").replace(" ", "")
-                    if val and val != "-" and "-" in val:
-                        start, stop = map(int, val.split("-"))
-                        region_dict[region] = (start, stop)
-                return region_dict if region_dict else None
-    return None
+    return germline_index(species).region_dict(gene, chain_type)
 
 
 def build_region_string(region_dict: dict, seq_len: int, chain_type: str) -> list:
@@ -108,17 +203,10 @@ def build_region_blocks(region_dict: dict, seq_len: int, chain_type: str) -> lis
 
 def get_germline_sequence(gene: str, species: str) -> Optional[str]:
     """Return the germline sequence for a gene from the IMGT FASTA (as a single string, uppercased, no gaps)."""
-    path = IMGT_FASTA_PATHS[species]
-    base_gene = gene.split("*")[0]
-    for record in SeqIO.parse(path, "fasta"):
-        # Match on base gene name (e.g., IGHV1-52 matches IGHV1-52*01)
-        if base_gene in record.id or f"|{base_gene}" in record.description:
-            print(f"[DEBUG] Matched germline FASTA record: {record.id}")
-            return str(record.seq).replace("-", "").replace(".", "").upper()
-    print(
-        f"[WARN] No germline FASTA record found for {gene} (base {base_gene}) in {path}"
-    )
-    return None
+    seq = germline_index(species).sequence(gene)
+    if seq is None:
+        print(f"[WARN] No germline FASTA record found for {gene} in {IMGT_FASTA_PATHS[species]}")
+    return seq
 
 
 def get_germline_and_annotation(gene: str, species: str, chain_type: str):
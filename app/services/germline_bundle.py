@@ -0,0 +1,347 @@
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from functools import lru_cache
+from typing import Dict, Optional
+
+import numpy as np
+from Bio import SeqIO
+
+from app.core.config import get_settings
+from app.services.germline_annotation import (
+    ANNOTATION_CSV_PATHS,
+    REGION_ORDER,
+    GermlineIndex,
+    allele_name,
+)
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+BUNDLE_MAGIC = b"BCRG"
+BUNDLE_VERSION = 1
+# magic, version, header length
+_BUNDLE_PREFIX = struct.Struct("<4sBQ")
+
+SPECIES = ("human", "mouse")
+
+# IMGT unique numbering of the V region (amino-acid positions, inclusive);
+# nucleotide references use the same ranges in codons
+IMGT_V_REGIONS = ((1, 26), (27, 38), (39, 55), (56, 65), (66, 104))
+
+
+def reference_sources(roots: tuple) -> list:
+    """Return every FASTA file under `roots`, sorted, as paths relative to the working directory."""
+    paths = []
+    for root in roots:
+        for directory, _, files in os.walk(root):
+            paths.extend(os.path.join(directory, f) for f in files if f.endswith(".fasta"))
+    return sorted(paths)
+
+
+def describe_reference(path: str) -> dict:
+    """
+    Derive the selection metadata of a reference from its path.
+
+    Returns:
+        Dictionary with reference_set ("imgt", "ogrdb", optionally prefixed by
+        "igblast-"), species, strain (None unless named), molecule ("aa"/"nt")
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    tokens = stem.split("_")
+    source = tokens[0]
+    species = next((t for t in tokens if t in SPECIES), None)
+    strain = None
+    if species and "ig" in tokens:
+        # e.g. ogrdb_mouse_C57BL_6J_ig_v -> C57BL_6J
+        between = tokens[tokens.index(species) + 1 : tokens.index("ig")]
+        strain = "_".join(between) or None
+    in_igblast = os.path.normpath(settings.igdata_path) in os.path.normpath(path)
+    return {
+        "reference_set": f"igblast-{source}" if in_igblast else source,
+        "species": species,
+        "strain": strain,
+        "molecule": "aa" if "aa" in tokens else "nt",
+    }
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def gapped_regions(gapped: str, allele: str, molecule: str) -> Optional[dict]:
+    """
+    Return the FR1-FR3 regions of an IMGT-gapped IG V allele in ungapped coordinates.
+
+    Returns:
+        Region name -> (start, stop), 1-based inclusive, named as in
+        `REGION_ORDER`; None for other genes or ungapped sequences
+    """
+    if "." not in gapped or not allele.startswith(("IGHV", "IGKV", "IGLV")):
+        return None
+    chain_type = "hc" if allele.startswith("IGH") else "lc"
+    step = 3 if molecule == "nt" else 1
+    # Ungapped position reached after each gapped column
+    residue_count = np.cumsum(np.frombuffer(gapped.encode("ascii"), dtype=np.uint8) != ord("."))
+    regions = {}
+    for name, (start, stop) in zip(REGION_ORDER[chain_type], IMGT_V_REGIONS):
+        first, last = (start - 1) * step, min(len(gapped), stop * step)
+        if first >= len(gapped):
+            break
+        before = residue_count[first - 1] if first else 0
+        if residue_count[last - 1] > before:
+            regions[name] = (int(before) + 1, int(residue_count[last - 1]))
+    return regions or None
+
+
+def build_bundle(output_path: str, roots: tuple = None) -> dict:
+    """
+    Compile every reference FASTA under `roots` into one bundle file.
+
+    Run as ``python -m app.services.germline_bundle build``. The bundle holds
+    ungapped sequences, IMGT-gapped forms, FR/CDR regions of gapped IG V
+    alleles and a checksum manifest of the sources; it is memory-mapped at
+    startup so selecting a species, strain or reference set needs no parsing.
+
+    Layout: ``<4sBQ`` prefix (magic, version, header length), a UTF-8 JSON
+    header (manifest and allele names per reference), a (n_alleles, 4) uint64
+    little-endian table of ``[seq offset, seq length, gapped offset, gapped
+    length]`` and the concatenated ASCII sequence bytes.
+
+    Returns:
+        The manifest written next to the bundle (``<output>.manifest.json``)
+    """
+    if roots is None:
+        roots = (settings.germlines_path, os.path.join(settings.igdata_path, "fasta"))
+    references, rows, chunks = {}, [], []
+    offset = 0
+
+    def append(text: str) -> tuple:
+        nonlocal offset
+        data = text.encode("ascii", errors="replace")
+        chunks.append(data)
+        offset += len(data)
+        return offset - len(data), len(data)
+
+    for path in reference_sources(roots):
+        meta = describe_reference(path)
+        alleles, regions = [], {}
+        first_row = len(rows)
+        for record in SeqIO.parse(path, "fasta"):
+            allele = allele_name(record.id)
+            if allele in alleles:
+                continue
+            gapped = str(record.seq).upper()
+            ungapped = gapped.replace("-", "").replace(".", "")
+            alleles.append(allele)
+            rows.append(append(ungapped) + (append(gapped) if "." in gapped else (0, 0)))
+            allele_regions = gapped_regions(gapped, allele, meta["molecule"])
+            if allele_regions:
+                regions[allele] = allele_regions
+        name = os.path.splitext(os.path.relpath(path))[0]
+        references[name] = {
+            **meta,
+            "source": os.path.relpath(path),
+            "sha256": sha256_file(path),
+            "first_row": first_row,
+            "alleles": alleles,
+            "regions": regions,
+        }
+
+    body = b"".join(chunks)
+    table = np.asarray(rows, dtype="<u8").reshape(-1, 4)
+    manifest = {
+        "version": BUNDLE_VERSION,
+        "body_sha256": hashlib.sha256(body).hexdigest(),
+        "sources": {
+            name: {"source": ref["source"], "sha256": ref["sha256"]}
+            for name, ref in references.items()
+        },
+    }
+    header = {"manifest": manifest, "alleles": len(rows), "references": references}
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as handle:
+        handle.write(_BUNDLE_PREFIX.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(header_bytes)))
+        handle.write(header_bytes)
+        handle.write(table.tobytes())
+        handle.write(body)
+    os.replace(tmp_path, output_path)
+    with open(f"{output_path}.manifest.json", "w") as handle:
+        json.dump(manifest, handle, indent=2, sort_keys=True)
+    return manifest
+
+
+class GermlineBundle:
+    """Read-only, memory-mapped view of a compiled germline bundle."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_length = _BUNDLE_PREFIX.unpack_from(self._map, 0)
+        if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+            raise ValueError(f"{path} is not a version {BUNDLE_VERSION} germline bundle")
+        start = _BUNDLE_PREFIX.size
+        header = json.loads(self._map[start : start + header_length])
+        self.manifest = header["manifest"]
+        self.references: Dict[str, dict] = header["references"]
+        table_start = start + header_length
+        self._table = np.frombuffer(
+            self._map, dtype="<u8", count=header["alleles"] * 4, offset=table_start
+        ).reshape(-1, 4)
+        self._body_start = table_start + self._table.nbytes
+        self._rows = {
+            name: {allele: ref["first_row"] + i for i, allele in enumerate(ref["alleles"])}
+            for name, ref in self.references.items()
+        }
+
+    def select(
+        self,
+        species: Optional[str] = None,
+        strain: Optional[str] = None,
+        reference_set: Optional[str] = None,
+        molecule: Optional[str] = None,
+    ) -> list:
+        """Return the names of the references matching every given field."""
+        wanted = {
+            "species": species,
+            "strain": strain,
+            "reference_set": reference_set,
+            "molecule": molecule,
+        }
+        return [
+            name
+            for name, ref in self.references.items()
+            if all(value is None or ref[key] == value for key, value in wanted.items())
+        ]
+
+    def reference_for_source(self, source: str) -> Optional[str]:
+        source = os.path.normpath(source)
+        for name, ref in self.references.items():
+            if os.path.normpath(ref["source"]) == source:
+                return name
+        return None
+
+    def alleles(self, reference: str) -> list:
+        return self.references[reference]["alleles"]
+
+    def _slice(self, offset: int, length: int) -> str:
+        start = self._body_start + int(offset)
+        return self._map[start : start + int(length)].decode("ascii")
+
+    def sequence(self, reference: str, allele: str) -> Optional[str]:
+        row = self._rows[reference].get(allele)
+        if row is None:
+            return None
+        offset, length, _, _ = self._table[row]
+        return self._slice(offset, length)
+
+    def gapped(self, reference: str, allele: str) -> Optional[str]:
+        row = self._rows[reference].get(allele)
+        if row is None:
+            return None
+        _, _, offset, length = self._table[row]
+        return self._slice(offset, length) if length else None
+
+    def regions(self, reference: str, allele: str) -> Optional[dict]:
+        regions = self.references[reference]["regions"].get(allele)
+        return {name: tuple(bounds) for name, bounds in regions.items()} if regions else None
+
+    def records(self, reference: str):
+        """Yield `(allele, ungapped sequence)` for every allele of a reference."""
+        for allele in self.alleles(reference):
+            yield allele, self.sequence(reference, allele)
+
+    def stale_sources(self) -> list:
+        """Return the references whose source FASTA changed since the bundle was built."""
+        return [
+            name
+            for name, entry in self.manifest["sources"].items()
+            if os.path.exists(entry["source"]) and sha256_file(entry["source"]) != entry["sha256"]
+        ]
+
+    def verify(self) -> bool:
+        """Check the sequence bytes against the manifest checksum."""
+        body = self._map[self._body_start :]
+        return hashlib.sha256(body).hexdigest() == self.manifest["body_sha256"]
+
+
+@lru_cache()
+def load_bundle(path: Optional[str] = None) -> Optional[GermlineBundle]:
+    """
+    Memory-map the configured bundle once per process.
+
+    Returns None when there is no bundle or it is out of date with its source
+    FASTAs, in which case callers fall back to parsing the FASTA files.
+    """
+    path = path or settings.germline_bundle_path
+    if not os.path.exists(path):
+        return None
+    try:
+        bundle = GermlineBundle(path)
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring germline bundle %s: %s", path, e)
+        return None
+    stale = bundle.stale_sources()
+    if stale:
+        logger.warning("Ignoring germline bundle %s: %d sources changed", path, len(stale))
+        return None
+    return bundle
+
+
+@lru_cache()
+def bundle_index(reference: str) -> Optional[GermlineIndex]:
+    """
+    Return a germline index over one bundle reference (no FASTA parsing).
+
+    Region dictionaries come from the species' annotation CSVs, completed by
+    the regions derived from IMGT gaps at build time.
+    """
+    bundle = load_bundle()
+    if bundle is None or reference not in bundle.references:
+        return None
+    ref = bundle.references[reference]
+    annotation_paths = ANNOTATION_CSV_PATHS.get(ref["species"], {})
+    index = GermlineIndex(ref["source"], annotation_paths, records=bundle.records(reference))
+    for allele, regions in ref["regions"].items():
+        chain_type = "hc" if allele.startswith("IGH") else "lc"
+        index.regions.setdefault(chain_type, {}).setdefault(
+            allele, {name: tuple(bounds) for name, bounds in regions.items()}
+        )
+    return index
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Build or verify the germline bundle")
+    parser.add_argument("command", choices=("build", "verify"))
+    parser.add_argument("--output", default=settings.germline_bundle_path)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        manifest = build_bundle(args.output)
+        print(f"Wrote {args.output} ({len(manifest['sources'])} references)")
+        return 0
+
+    bundle = GermlineBundle(args.output)
+    stale = bundle.stale_sources()
+    ok = bundle.verify() and not stale
+    print(f"{args.output}: {'ok' if ok else 'invalid'}")
+    for name in stale:
+        print(f"  stale: {name}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
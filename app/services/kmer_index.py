@@ -0,0 +1,483 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from Bio.Align import PairwiseAligner, substitution_matrices
+
+from app.core.config import get_settings
+from app.services.mutations import v_region_arrays
+from app.services.regions import CHAIN_SUFFIXES, chain_alignments, longest_chunk
+from app.services.sequence_arrays import encode_bytes
+from app.services.versioning import project_version
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+INDEX_DIRNAME = "kmer_index"
+INDEX_VERSION = 1
+KMER_SIZE = 3
+
+# Indexed records: the translated chain of each cell and its CDR3
+RECORD_KINDS = ("hc", "lc", "cdr3_hc", "cdr3_lc")
+SEARCH_REGIONS = ("sequence", "cdr3")
+
+# k-mers are built over the 20 standard residues; anything else breaks them
+INDEX_ALPHABET = "ACDEFGHIKLMNPQRSTVWY"
+NO_RESIDUE = 255
+_RESIDUE_INDEX = np.full(256, NO_RESIDUE, dtype=np.uint8)
+_RESIDUE_INDEX[np.frombuffer(INDEX_ALPHABET.encode("ascii"), dtype=np.uint8)] = np.arange(
+    len(INDEX_ALPHABET)
+)
+N_KMERS = len(INDEX_ALPHABET) ** KMER_SIZE
+
+# Rows translated, and records k-merized, at once
+INDEX_CHUNK_ROWS = 50_000
+
+# Arrays of an index directory, each an .npy file loaded memory-mapped
+_ARRAYS = (
+    "kmer_offsets",
+    "postings",
+    "residues",
+    "offsets",
+    "rows",
+    "kinds",
+    "sequence_id",
+    "display_name",
+    "clone_id",
+)
+
+
+def index_path(project_dir: str) -> str:
+    """Return the k-mer index directory of a project folder."""
+    return os.path.join(project_dir, INDEX_DIRNAME)
+
+
+def translate_alignments(seqs: list) -> tuple:
+    """
+    Translate IMGT-gapped nucleotide alignments in their IMGT frame.
+
+    Codons with a gap or an ambiguous base are dropped, so each result is the
+    ungapped protein of the alignment.
+
+    Returns:
+        Tuple of (concatenated amino-acid bytes as uint8, length of each translation)
+    """
+    residues, lengths = [], []
+    for start in range(0, len(seqs), INDEX_CHUNK_ROWS):
+        chunk = [s.upper() for s in seqs[start : start + INDEX_CHUNK_ROWS]]
+        width = -(-max((len(s) for s in chunk), default=0) // 3) * 3
+        _, aa = v_region_arrays(encode_bytes(chunk, width))
+        present = aa > 0
+        residues.append(aa[present])
+        lengths.append(present.sum(axis=1))
+    if not residues:
+        return np.empty(0, dtype=np.uint8), np.empty(0, dtype=np.int64)
+    return np.concatenate(residues), np.concatenate(lengths).astype(np.int64)
+
+
+def _junction_cdr3s(merged_df: pd.DataFrame, chain: str) -> tuple:
+    column = f"junction_aa_{CHAIN_SUFFIXES[chain]}"
+    junctions = merged_df[column] if column in merged_df else [""] * len(merged_df)
+    cdr3s = [j[1:-1] if len(j) > 2 else "" for j in (longest_chunk(j).upper() for j in junctions)]
+    residues = np.frombuffer("".join(cdr3s).encode("ascii", errors="replace"), dtype=np.uint8)
+    return residues, np.array([len(s) for s in cdr3s], dtype=np.int64)
+
+
+def index_records(merged_df: pd.DataFrame) -> dict:
+    """
+    Collect the amino-acid records of a project: both translated chains and both CDR3s.
+
+    Rows whose record is shorter than `KMER_SIZE` are left out.
+
+    Returns:
+        Dictionary of residues (concatenated uint8), offsets (n + 1), rows
+        (merged_df row of each record) and kinds (index into `RECORD_KINDS`)
+    """
+    alignments = chain_alignments(merged_df)
+    residues, lengths, rows, kinds = [], [], [], []
+    for kind, name in enumerate(RECORD_KINDS):
+        if name in CHAIN_SUFFIXES:
+            flat, length = translate_alignments([longest_chunk(s) for s in alignments[name]])
+        else:
+            flat, length = _junction_cdr3s(merged_df, name.split("_")[1])
+        keep = length >= KMER_SIZE
+        residues.append(flat[np.repeat(keep, length)])
+        lengths.append(length[keep])
+        rows.append(np.flatnonzero(keep))
+        kinds.append(np.full(int(keep.sum()), kind, dtype=np.uint8))
+    lengths = np.concatenate(lengths)
+    return {
+        "residues": np.concatenate(residues),
+        "offsets": np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+        "rows": np.concatenate(rows).astype(np.uint32),
+        "kinds": np.concatenate(kinds),
+    }
+
+
+def sequence_kmers(residues: np.ndarray, offsets: np.ndarray) -> tuple:
+    """
+    Return the distinct k-mers of every record, sorted by (k-mer, record).
+
+    Args:
+        residues: Concatenated ASCII residues of the records
+        offsets: Start of every record in `residues`, plus the end
+
+    Returns:
+        Tuple of (k-mer ids, record numbers relative to the first record)
+    """
+    n_records = len(offsets) - 1
+    base = offsets[0]
+    codes = _RESIDUE_INDEX[residues[base : offsets[-1]]]
+    n_positions = max(0, len(codes) - KMER_SIZE + 1)
+    if not n_records or not n_positions:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    kmers = np.zeros(n_positions, dtype=np.int64)
+    valid = np.ones(n_positions, dtype=bool)
+    for shift in range(KMER_SIZE):
+        window = codes[shift : shift + n_positions]
+        valid &= window != NO_RESIDUE
+        kmers = kmers * len(INDEX_ALPHABET) + window
+    record = np.repeat(np.arange(n_records), np.diff(offsets))[:n_positions]
+    # A k-mer may not run into the next record
+    valid &= np.arange(n_positions) + KMER_SIZE <= offsets[record + 1] - base
+
+    keys = np.unique(kmers[valid] * n_records + record[valid])
+    return keys // n_records, keys % n_records
+
+
+def _column_bytes(merged_df: pd.DataFrame, column: str) -> np.ndarray:
+    values = merged_df[column] if column in merged_df else [""] * len(merged_df)
+    return np.array([b"" if pd.isna(v) else str(v).encode("utf-8") for v in values], dtype=bytes)
+
+
+def build_index(project_dir: str, project_name: str, merged_df: pd.DataFrame) -> dict:
+    """
+    Write the k-mer index of a project under `project_dir`.
+
+    Postings are laid out as CSR: for k-mer ``k`` the records containing it
+    are ``postings[kmer_offsets[k]:kmer_offsets[k + 1]]``, in increasing
+    order. They are filled with a counting sort over blocks of records (one
+    pass to count, one to place) directly into a memory-mapped file, so memory
+    stays bounded by the block size. The directory is written next to the old
+    one and swapped in.
+
+    The `project_version` of the merged dataset is recorded as the index
+    ``source``, so that an index older than the dataset can be detected.
+
+    Returns:
+        The index metadata (also written as meta.json)
+    """
+    source = project_version(project_dir)
+    records = index_records(merged_df)
+    offsets = records["offsets"]
+    n_records = len(offsets) - 1
+    blocks = [
+        (start, min(start + INDEX_CHUNK_ROWS, n_records))
+        for start in range(0, n_records, INDEX_CHUNK_ROWS)
+    ]
+
+    counts = np.zeros(N_KMERS, dtype=np.int64)
+    for start, stop in blocks:
+        kmers, _ = sequence_kmers(records["residues"], offsets[start : stop + 1])
+        counts += np.bincount(kmers, minlength=N_KMERS)
+    kmer_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    final_path = index_path(project_dir)
+    # Unique per process so that concurrent builders never share a directory
+    tmp_path = f"{final_path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    postings = np.lib.format.open_memmap(
+        os.path.join(tmp_path, "postings.npy"), mode="w+", dtype=np.uint32, shape=(int(counts.sum()),)
+    )
+    cursor = kmer_offsets[:-1].copy()
+    for start, stop in blocks:
+        kmers, record = sequence_kmers(records["residues"], offsets[start : stop + 1])
+        block_counts = np.bincount(kmers, minlength=N_KMERS)
+        group_start = np.cumsum(block_counts) - block_counts
+        rank = np.arange(len(kmers)) - group_start[kmers]
+        postings[cursor[kmers] + rank] = record + start
+        cursor += block_counts
+    postings.flush()
+    del postings
+
+    arrays = {
+        "kmer_offsets": kmer_offsets,
+        **records,
+        "sequence_id": _column_bytes(merged_df, "sequence_id"),
+        "display_name": _column_bytes(merged_df, "display_name"),
+        "clone_id": _column_bytes(merged_df, "clone_id"),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), array)
+    meta = {
+        "version": INDEX_VERSION,
+        "project": project_name,
+        "kmer_size": KMER_SIZE,
+        "alphabet": INDEX_ALPHABET,
+        "kinds": list(RECORD_KINDS),
+        "records": n_records,
+        "postings": int(kmer_offsets[-1]),
+        "source": source,
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w") as handle:
+        json.dump(meta, handle)
+
+    shutil.rmtree(final_path, ignore_errors=True)
+    try:
+        os.replace(tmp_path, final_path)
+    except OSError:
+        # Another process swapped its build in first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return meta
+
+
+class KmerIndex:
+    """Read-only, memory-mapped k-mer index of one project."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as handle:
+            self.meta = json.load(handle)
+        if self.meta["version"] != INDEX_VERSION or self.meta["kmer_size"] != KMER_SIZE:
+            raise ValueError(f"{path} is not a version {INDEX_VERSION} k-mer index")
+        self.project = self.meta["project"]
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+
+    def candidates(self, kmers: np.ndarray, kinds: list, limit: int) -> tuple:
+        """
+        Return the records of the given kinds sharing the most k-mers with a query.
+
+        Returns:
+            Tuple of (record numbers, shared k-mer counts), best first
+        """
+        n_records = len(self.kinds)
+        if not n_records or not len(kmers):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        lists = [self.postings[self.kmer_offsets[k] : self.kmer_offsets[k + 1]] for k in kmers]
+        hits = np.bincount(np.concatenate(lists), minlength=n_records)
+        hits[~np.isin(self.kinds, kinds)] = 0
+        found = np.flatnonzero(hits)
+        if len(found) > limit:
+            found = found[np.argpartition(-hits[found], limit - 1)[:limit]]
+        found = found[np.argsort(-hits[found], kind="stable")]
+        return found, hits[found]
+
+    def sequence(self, record: int) -> str:
+        return self.residues[self.offsets[record] : self.offsets[record + 1]].tobytes().decode("ascii")
+
+    def describe(self, record: int) -> dict:
+        """Return the project, cell labels, chain and region of a record."""
+        row = int(self.rows[record])
+        kind = RECORD_KINDS[self.kinds[record]]
+        return {
+            "project": self.project,
+            "sequence_id": self.sequence_id[row].decode("utf-8"),
+            "display_name": self.display_name[row].decode("utf-8"),
+            "clone_id": self.clone_id[row].decode("utf-8"),
+            "chain": kind.split("_")[-1],
+            "region": "cdr3" if kind.startswith("cdr3") else "sequence",
+        }
+
+
+_indexes: Dict[str, tuple] = {}
+_indexes_lock = threading.Lock()
+
+
+def load_index(project_dir: str) -> Optional[KmerIndex]:
+    """Return the memory-mapped index of a project, reopened when it was rebuilt."""
+    path = index_path(project_dir)
+    meta_path = os.path.join(path, "meta.json")
+    try:
+        mtime = os.stat(meta_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _indexes_lock:
+        cached = _indexes.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            index = KmerIndex(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring k-mer index %s: %s", path, e)
+            return None
+        _indexes[path] = (mtime, index)
+        return index
+
+
+def index_is_current(project_dir: str) -> bool:
+    """Return whether a project's index was built from its current merged dataset."""
+    index = load_index(project_dir)
+    return index is not None and index.meta.get("source") == project_version(project_dir)
+
+
+# Background index builds: one worker, at most one queued build per project
+_executor: Optional[ThreadPoolExecutor] = None
+_pending: set = set()
+_pending_lock = threading.Lock()
+_build_locks: Dict[str, threading.Lock] = {}
+
+
+def ensure_index(project_dir: str, project_name: str, merged_df: pd.DataFrame) -> Optional[dict]:
+    """
+    Build the index of a project unless it is current.
+
+    Builds of the same project are serialized, and a build that waited for
+    another one is skipped once the index is up to date.
+
+    Returns:
+        The metadata of the new index, or None when nothing was built
+    """
+    path = index_path(project_dir)
+    with _pending_lock:
+        lock = _build_locks.setdefault(path, threading.Lock())
+    with lock:
+        if index_is_current(project_dir):
+            return None
+        return build_index(project_dir, project_name, merged_df)
+
+
+def schedule_index(project_dir: str, project_name: str, merged_df: pd.DataFrame) -> None:
+    """
+    Queue an `ensure_index` of a project in the background.
+
+    Does nothing when the index is current or a build of the project is
+    already queued; until the build finishes, searches use the previous index
+    (or skip the project).
+    """
+    global _executor
+    if index_is_current(project_dir):
+        return
+    path = index_path(project_dir)
+    with _pending_lock:
+        if path in _pending:
+            return
+        _pending.add(path)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kmer-index")
+
+    def run() -> None:
+        try:
+            ensure_index(project_dir, project_name, merged_df)
+        except Exception as e:
+            logger.warning("Building the k-mer index of %s failed: %s", project_name, e)
+        finally:
+            with _pending_lock:
+                _pending.discard(path)
+
+    _executor.submit(run)
+
+
+def query_kmers(query: str) -> np.ndarray:
+    """Return the distinct k-mer ids of a query sequence."""
+    residues = np.frombuffer(query.encode("ascii", errors="replace"), dtype=np.uint8)
+    kmers, _ = sequence_kmers(residues, np.array([0, len(residues)]))
+    return kmers
+
+
+def _aligner() -> PairwiseAligner:
+    aligner = PairwiseAligner(mode="global")
+    aligner.substitution_matrix = substitution_matrices.load("BLOSUM62")
+    aligner.open_gap_score = -10
+    aligner.extend_gap_score = -1
+    return aligner
+
+
+def search(
+    query: str,
+    region: str = "sequence",
+    chain: Optional[str] = None,
+    top: int = 20,
+    upload_dir: Optional[str] = None,
+) -> dict:
+    """
+    Find the indexed sequences most similar to an amino-acid query across every project.
+
+    Candidates are the records sharing the most k-mers with the query (at
+    most `settings.sequence_search_candidates` over all projects); each is
+    aligned globally to the query (BLOSUM62) and scored by identity, the
+    identical aligned residues over the longer of the two sequences.
+
+    Args:
+        query: Amino-acid sequence (uppercase)
+        region: "sequence" (whole chains) or "cdr3"
+        chain: "hc" or "lc" to search one chain only
+        top: Number of matches returned
+
+    Returns:
+        Dictionary with query, region, chain, projects (searched), candidates
+        (aligned) and matches, best first
+    """
+    upload_dir = upload_dir or settings.upload_dir
+    chains = [chain] if chain else list(CHAIN_SUFFIXES)
+    names = [c if region == "sequence" else f"cdr3_{c}" for c in chains]
+    kinds = [RECORD_KINDS.index(name) for name in names]
+    kmers = query_kmers(query)
+    limit = settings.sequence_search_candidates
+
+    candidates = []
+    projects = []
+    for name in sorted(os.listdir(upload_dir)) if os.path.isdir(upload_dir) else []:
+        index = load_index(os.path.join(upload_dir, name))
+        if index is None:
+            continue
+        projects.append(index.project)
+        records, hits = index.candidates(kmers, kinds, limit)
+        candidates.extend(zip(hits.tolist(), [index] * len(records), records.tolist()))
+    candidates.sort(key=lambda c: -c[0])
+    candidates = candidates[:limit]
+
+    aligner = _aligner()
+    matches = []
+    for hits, index, record in candidates:
+        target = index.sequence(record)
+        identities = aligner.align(query, target)[0].counts().identities
+        matches.append(
+            {
+                **index.describe(record),
+                "identity": round(identities / max(len(query), len(target)), 4),
+                "shared_kmers": hits,
+                "sequence": target,
+            }
+        )
+    matches.sort(key=lambda m: (-m["identity"], -m["shared_kmers"]))
+    return {
+        "query": query,
+        "region": region,
+        "chain": chain,
+        "projects": projects,
+        "candidates": len(candidates),
+        "matches": matches[:top],
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Build the k-mer search index of projects")
+    parser.add_argument("command", choices=("build",))
+    parser.add_argument("--project", help="Only this project (default: every project)")
+    args = parser.parse_args(argv)
+
+    names = [args.project] if args.project else sorted(os.listdir(settings.upload_dir))
+    for name in names:
+        project_dir = os.path.join(settings.upload_dir, name)
+        merged_path = os.path.join(project_dir, "merged_data.pkl")
+        if not os.path.exists(merged_path):
+            continue
+        meta = build_index(project_dir, name, pd.read_pickle(merged_path))
+        print(f"{name}: {meta['records']} records, {meta['postings']} postings")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
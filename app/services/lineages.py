@@ -0,0 +1,301 @@
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+import pandas as pd
+
+from app.core.config import get_settings
+from app.services.alignment_cache import (
+    AlignmentCache,
+    artifact_key,
+    project_cache,
+    single_flight,
+)
+from app.services.alignments import ALIGNER, aligner_version
+from app.services.ddl import (
+    best_translation,
+    compute_alignment_and_consensus,
+    load_project,
+)
+from app.services.distances import distance_matrix_of
+from app.services.germline_annotation import get_germline_sequence
+from app.services.trees import neighbor_joining, write_newick
+from app.services.versioning import project_version
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Name of the root leaf of every lineage tree
+GERMLINE_LABEL = "Germline"
+
+LINEAGE_INDEX = "lineage_index"
+LINEAGE_TREES = "lineage_trees"
+
+_jobs: Dict[str, "LineageJob"] = {}
+# Content key of the lineage trees of each project, once known:
+# project name -> (merged-data version, species, key)
+_keys: Dict[str, tuple] = {}
+
+
+def clone_groups(merged_df: pd.DataFrame, min_size: int) -> list:
+    """
+    Return the heavy-chain rows of every clone with at least `min_size` cells.
+
+    Returns:
+        List of `(clone_id, rows)` sorted by clone id, where rows are dicts with
+        sequence_id, display_name, v_call_VDJ and the IGH sequence
+    """
+    columns = ["clone_id", "sequence_id", "display_name", "v_call_VDJ", "IGH"]
+    heavy = merged_df[merged_df["locus_VDJ"] == "IGH"][columns]
+    heavy = heavy[heavy["clone_id"].notna() & ~heavy["clone_id"].isin(["None", ""])]
+    heavy = heavy[heavy["IGH"].map(lambda nt: isinstance(nt, str) and bool(nt)).astype(bool)]
+    sizes = heavy.groupby("clone_id")["sequence_id"].transform("size")
+    heavy = heavy[sizes >= min_size]
+    return [
+        (str(clone_id), rows.to_dict(orient="records"))
+        for clone_id, rows in heavy.groupby("clone_id", sort=True)
+    ]
+
+
+def lineage_cache_key(groups: list, species: str) -> str:
+    """Content key of a project's lineage trees: clone inputs, aligner and options."""
+    material = {
+        "aligner": ALIGNER,
+        "aligner_version": aligner_version(),
+        "min_clone_size": settings.lineage_min_clone_size,
+        "species": species,
+        "groups": [
+            [clone_id, [[row["sequence_id"], row["v_call_VDJ"], row["IGH"]] for row in rows]]
+            for clone_id, rows in groups
+        ],
+    }
+    encoded = json.dumps(material, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def lineage_task(clone_id: str, rows: list, germlines: dict) -> dict:
+    """Turn the rows of one clone into the picklable input of `build_lineage`."""
+    v_gene = pd.Series([row["v_call_VDJ"] for row in rows]).mode().iloc[0]
+    return {
+        "clone_id": clone_id,
+        "v_gene": v_gene,
+        "germline": germlines.get(v_gene),
+        "labels": [str(row["display_name"] or row["sequence_id"]) for row in rows],
+        "seqs": [best_translation(row["IGH"]) for row in rows],
+    }
+
+
+def build_lineage(task: dict) -> dict:
+    """
+    Align one clone with its germline and return its germline-rooted NJ tree.
+
+    Runs in a worker process. Clones whose germline is unknown get an unrooted
+    tree; failures are reported in the record rather than raised.
+    """
+    record = {
+        "clone_id": task["clone_id"],
+        "size": len(task["labels"]),
+        "v_gene": task["v_gene"],
+        "rooted": False,
+        "newick": None,
+    }
+    try:
+        members = [(label, seq) for label, seq in zip(task["labels"], task["seqs"]) if seq]
+        if task["germline"]:
+            members.append((GERMLINE_LABEL, task["germline"]))
+        if len(members) < 2:
+            return record
+        # Aligned under positional ids so that labels never reach the FASTA headers
+        ids = [str(i) for i in range(len(members))]
+        alignment, _, _ = compute_alignment_and_consensus([seq for _, seq in members], ids)
+        labels = [members[int(i)][0] for i, _ in alignment]
+        distances = distance_matrix_of([seq for _, seq in alignment], "blosum62")
+        tree = neighbor_joining(labels, distances)
+        if task["germline"]:
+            tree.root_with_outgroup(GERMLINE_LABEL)
+            tree.rooted = record["rooted"] = True
+        record["newick"] = write_newick(tree)
+    except Exception as e:
+        record["error"] = str(e)
+    return record
+
+
+def store_lineages(cache: AlignmentCache, key: str, records: list) -> None:
+    """
+    Store every lineage tree of a project as one indexed artifact.
+
+    The trees are concatenated JSON records in one raw blob; a small index maps
+    each clone id to the `(offset, length)` of its record so that one tree can
+    be read without loading the others.
+    """
+    index, chunks, offset = {}, [], 0
+    for record in records:
+        chunk = json.dumps(record).encode("utf-8")
+        index[record["clone_id"]] = [offset, len(chunk)]
+        chunks.append(chunk)
+        offset += len(chunk)
+    cache.put_many(
+        [
+            (artifact_key(key, LINEAGE_INDEX), json.dumps(index).encode("utf-8"), "lineage"),
+            (artifact_key(key, LINEAGE_TREES), b"".join(chunks), "lineage"),
+        ],
+        root=key,
+    )
+
+
+def read_lineage_index(cache: AlignmentCache, key: str) -> Optional[dict]:
+    payload = cache.get(artifact_key(key, LINEAGE_INDEX), "lineage")
+    return None if payload is None else json.loads(payload)
+
+
+def read_lineage(cache: AlignmentCache, key: str, index: dict, clone_id: str) -> Optional[dict]:
+    """Read the record of one clone from the lineage artifact."""
+    if clone_id not in index:
+        return None
+    offset, length = index[clone_id]
+    payload = cache.read_range(artifact_key(key, LINEAGE_TREES), offset, length)
+    return json.loads(payload) if payload else None
+
+
+class LineageJob:
+    """Project-level computation of germline-rooted lineage trees for expanded clones."""
+
+    def __init__(self, project_name: str, species: str):
+        self.project_name = project_name
+        self.species = species
+        self.status = "queued"
+        self.key: Optional[str] = None
+        self.clones = 0
+        self.done = 0
+        self.failed = 0
+        self.cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        if self.status in ("queued", "running"):
+            self.status = "cancelled"
+
+    def to_dict(self) -> dict:
+        return {
+            "project": self.project_name,
+            "status": self.status,
+            "clones": self.clones,
+            "done": self.done,
+            "failed": self.failed,
+        }
+
+    def run(self, project: dict) -> None:
+        if self.cancelled.is_set():
+            return
+        self.status = "running"
+        try:
+            _, _, merged_df = asyncio.run(load_project(project))
+            version = project_version(os.path.dirname(project["vdj_path"]))
+            groups = clone_groups(merged_df, settings.lineage_min_clone_size)
+            self.clones = len(groups)
+            self.key = lineage_cache_key(groups, self.species)
+            if version:
+                _keys[self.project_name] = (version, self.species, self.key)
+            cache = project_cache(self.project_name)
+            with single_flight(cache, self.key):
+                if read_lineage_index(cache, self.key) is None:
+                    records = self.build(groups)
+                    if records is None:
+                        return
+                    store_lineages(cache, self.key, records)
+                else:
+                    self.done = self.clones
+        except Exception as e:
+            self.status = "error"
+            logger.warning("Lineage trees of %s failed: %s", self.project_name, e)
+            return
+        if not self.cancelled.is_set():
+            self.status = "done"
+
+    def build(self, groups: list) -> Optional[list]:
+        """Build the tree of every clone in a process pool; None once cancelled."""
+        # One germline lookup per V gene rather than one per clone
+        germlines = {}
+        for _, rows in groups:
+            for row in rows:
+                gene = row["v_call_VDJ"]
+                if gene not in germlines:
+                    germlines[gene] = get_germline_sequence(gene, self.species)
+
+        records = []
+        # Spawned workers: forking a threaded server process is unsafe
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=settings.lineage_workers, mp_context=context
+        ) as pool:
+            tasks = (lineage_task(clone_id, rows, germlines) for clone_id, rows in groups)
+            for record in pool.map(build_lineage, tasks, chunksize=8):
+                if self.cancelled.is_set():
+                    pool.shutdown(cancel_futures=True)
+                    return None
+                records.append(record)
+                self.done += 1
+                if record.get("error"):
+                    self.failed += 1
+        return records
+
+
+def start_lineages(project_name: str, species: str, vdj_path: str) -> LineageJob:
+    """Start the lineage-tree job of a project in a background thread."""
+    cancel_lineages(project_name)
+    job = LineageJob(project_name, species)
+    _jobs[project_name] = job
+    project = {
+        "vdj_path": vdj_path,
+        "adata_path": "NULL",
+        "project_name": project_name,
+        "species": species,
+    }
+    threading.Thread(
+        target=job.run, args=(project,), name="lineage-trees", daemon=True
+    ).start()
+    return job
+
+
+def cancel_lineages(project_name: str) -> None:
+    job = _jobs.get(project_name)
+    if job is not None:
+        job.cancel()
+
+
+def forget_lineages(project_name: str) -> None:
+    """Cancel the lineage job of a deleted project and drop everything kept about it."""
+    cancel_lineages(project_name)
+    _jobs.pop(project_name, None)
+    _keys.pop(project_name, None)
+
+
+def lineage_status(project_name: str) -> dict:
+    job = _jobs.get(project_name)
+    if job is None:
+        return {"project": project_name, "status": "not_started"}
+    return job.to_dict()
+
+
+def lineage_key(
+    project_name: str, species: str, merged_df: pd.DataFrame, version: Optional[str] = None
+) -> str:
+    """
+    Return the content key of a project's lineage trees.
+
+    The key is remembered per process for the `version` (see `project_version`)
+    of the merged dataset it was computed from.
+    """
+    known = _keys.get(project_name)
+    if version and known and known[:2] == (version, species):
+        return known[2]
+    key = lineage_cache_key(clone_groups(merged_df, settings.lineage_min_clone_size), species)
+    if version:
+        _keys[project_name] = (version, species, key)
+    return key
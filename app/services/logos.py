@@ -0,0 +1,73 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from app.services.alignment_cache import AlignmentCache
+from app.services.bokeh_logo import AMINO_ACIDS, position_frequency_matrix
+from app.services.mutations import V_REGION_CODONS, v_region_arrays
+from app.services.regions import CHAIN_SUFFIXES, chain_alignments, longest_chunk
+from app.services.sequence_arrays import encode_bytes
+from app.services.versioning import versioned_key
+
+# Bump when the cached matrix changes meaning
+LOGO_VERSION = 1
+
+
+def gene_chain(gene: str) -> str:
+    """Return the chain type ("hc" or "lc") of a V gene call."""
+    return "hc" if gene.startswith("IGH") else "lc"
+
+
+def logo_genes(merged_df: pd.DataFrame) -> list:
+    """Return the heavy and light V genes of a project, most frequent first."""
+    calls = pd.concat([merged_df["v_call_VDJ"], merged_df["v_call_VJ"]])
+    calls = calls[calls.notna() & (calls != "None")]
+    return calls.value_counts().index.tolist()
+
+
+def gene_v_regions(merged_df: pd.DataFrame, gene: str) -> list:
+    """Return the IMGT-gapped nucleotide alignments of every chain called `gene`."""
+    chain = gene_chain(gene)
+    rows = merged_df[f"v_call_{CHAIN_SUFFIXES[chain]}"] == gene
+    sequences = chain_alignments(merged_df)[chain][rows]
+    return [seq for seq in (longest_chunk(s) for s in sequences) if seq]
+
+
+def gene_pfm(seqs: list) -> np.ndarray:
+    """
+    Return the amino-acid position frequency matrix of V regions in IMGT numbering.
+
+    The IMGT-gapped sequences are already aligned, so each codon 1..104 is
+    one logo position and no MSA is needed; incomplete codons count as gaps.
+    """
+    _, aa = v_region_arrays(encode_bytes([s.upper() for s in seqs], 3 * V_REGION_CODONS))
+    return position_frequency_matrix(aa, AMINO_ACIDS)
+
+
+def cached_gene_pfm(
+    cache: AlignmentCache, merged_df: pd.DataFrame, version: Optional[str], gene: str
+) -> dict:
+    """
+    Return the V-region PFM of one gene, cached per project version and gene.
+
+    Returns:
+        Dictionary with gene, chain, sequences (count), positions (IMGT codons)
+        and counts (positions x `AMINO_ACIDS`)
+    """
+    chain = gene_chain(gene)
+    key = versioned_key("logo", version, LOGO_VERSION, gene, chain) if version else None
+    cached = cache.get_json(key, "logo") if key else None
+    if cached is not None:
+        return cached
+    seqs = gene_v_regions(merged_df, gene)
+    value = {
+        "gene": gene,
+        "chain": chain,
+        "sequences": len(seqs),
+        "positions": list(range(1, V_REGION_CODONS + 1)),
+        "counts": gene_pfm(seqs).tolist(),
+    }
+    if key:
+        cache.put_json(key, value, "logo")
+    return value
@@ -0,0 +1,209 @@
+import hashlib
+import json
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from app.services.alignment_cache import AlignmentCache, cached_artifact
+from app.services.alignments import light_chain_column
+from app.services.mutations import (
+    NO_BASE,
+    REGION_START_CODONS,
+    SHM_REGIONS,
+    V_REGION_CODONS,
+    gapped_v_germlines,
+    resolve_allele,
+    v_region_arrays,
+)
+from app.services.regions import IMGT_REGION_ENDS, longest_chunk, residue_codons
+from app.services.sequence_arrays import encode_bytes
+
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> list:
+    # Rounded ratios for JSON; None where the denominator is 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        values = np.round(numerator / denominator, 4)
+    return [float(v) if d > 0 else None for v, d in zip(values, denominator)]
+
+
+def mutation_profile(seqs: list, germline: str) -> dict:
+    """
+    Compute per-position mutation statistics of V regions against one germline.
+
+    Sequences and germline are IMGT-gapped nucleotides, so every IMGT codon
+    (1..V_REGION_CODONS) is one column and the statistics are column sums
+    over the whole set. A mutated nucleotide is a replacement when its codon
+    translates to a different amino acid than the germline codon, silent
+    when it translates to the same one; nucleotides of incomplete codons are
+    counted as mutations only.
+
+    Returns:
+        Column-oriented dictionary with one entry per IMGT codon (position,
+        region, germline residue, nt_sites, nt_freq, aa_sites, aa_freq,
+        replacement, silent, rs_ratio and substitutions: amino acid ->
+        frequency among the sequences covering that codon), plus the same
+        totals per region in ``regions``; without sequences every count is 0
+        and every ratio None
+    """
+    width = 3 * V_REGION_CODONS
+    bases, aa = v_region_arrays(encode_bytes([s.upper() for s in seqs], width))
+    germline_bases, germline_aa = v_region_arrays(encode_bytes([germline.upper()], width))
+    n = len(seqs)
+
+    nt_sites = (bases < NO_BASE) & (germline_bases < NO_BASE)
+    nt_mutations = (nt_sites & (bases != germline_bases)).reshape(n, V_REGION_CODONS, 3)
+    aa_sites = (aa > 0) & (germline_aa > 0)
+    aa_changed = aa_sites & (aa != germline_aa)
+
+    counts = {
+        "nt_sites": nt_sites.reshape(n, V_REGION_CODONS, 3).sum(axis=(0, 2)),
+        "nt_mutations": nt_mutations.sum(axis=(0, 2)),
+        "aa_sites": aa_sites.sum(axis=0),
+        "aa_changed": aa_changed.sum(axis=0),
+        "replacement": (nt_mutations & aa_changed[:, :, None]).sum(axis=(0, 2)),
+        "silent": (nt_mutations & (aa_sites & ~aa_changed)[:, :, None]).sum(axis=(0, 2)),
+    }
+
+    # (codon, residue byte) counts of every non-germline residue
+    rows, codons = np.nonzero(aa_changed)
+    substitution_counts = np.bincount(
+        codons * 256 + aa[rows, codons], minlength=V_REGION_CODONS * 256
+    ).reshape(V_REGION_CODONS, 256)
+    substitutions = []
+    for codon, sites in enumerate(counts["aa_sites"]):
+        residues = np.flatnonzero(substitution_counts[codon])
+        ordered = residues[np.argsort(-substitution_counts[codon, residues], kind="stable")]
+        substitutions.append(
+            {chr(r): round(float(substitution_counts[codon, r] / sites), 4) for r in ordered}
+        )
+
+    positions = np.arange(1, V_REGION_CODONS + 1)
+    region_index = np.searchsorted(IMGT_REGION_ENDS, positions)
+    germline_residues = np.where(germline_aa[0] > 0, germline_aa[0], ord("-"))
+
+    regions = {
+        name: np.add.reduceat(values, REGION_START_CODONS) for name, values in counts.items()
+    }
+    return {
+        "sequences": n,
+        "position": positions.tolist(),
+        "region": [SHM_REGIONS[i] for i in region_index],
+        "germline": germline_residues.astype(np.uint8).tobytes().decode("ascii"),
+        "nt_sites": counts["nt_sites"].tolist(),
+        "nt_freq": _ratio(counts["nt_mutations"], counts["nt_sites"]),
+        "aa_sites": counts["aa_sites"].tolist(),
+        "aa_freq": _ratio(counts["aa_changed"], counts["aa_sites"]),
+        "replacement": counts["replacement"].tolist(),
+        "silent": counts["silent"].tolist(),
+        "rs_ratio": _ratio(counts["replacement"], counts["silent"]),
+        "substitutions": substitutions,
+        "regions": {
+            "region": list(SHM_REGIONS),
+            "nt_mutations": regions["nt_mutations"].tolist(),
+            "nt_freq": _ratio(regions["nt_mutations"], regions["nt_sites"]),
+            "aa_freq": _ratio(regions["aa_changed"], regions["aa_sites"]),
+            "replacement": regions["replacement"].tolist(),
+            "silent": regions["silent"].tolist(),
+            "rs_ratio": _ratio(regions["replacement"], regions["silent"]),
+        },
+    }
+
+
+def alignment_columns(aligned: list, seqs: list) -> list:
+    """
+    Map the columns of an amino-acid alignment to IMGT codon numbers.
+
+    Args:
+        aligned: Aligned, "-"-gapped translations of `seqs`
+        seqs: IMGT-gapped nucleotide sequences the translations came from
+
+    Returns:
+        The most common IMGT codon of the residues in each column (None for
+        columns without residues)
+    """
+    if not aligned:
+        return []
+    codons = residue_codons(seqs)
+    chars = encode_bytes(aligned)
+    residue = chars != ord("-")
+    index = np.clip(np.cumsum(residue, axis=1) - 1, 0, codons.shape[1] - 1)
+    column_codons = np.where(residue, np.take_along_axis(codons, index, axis=1), 0)
+
+    columns = []
+    for values in column_codons.T:
+        votes = np.bincount(values)
+        votes[0] = 0
+        columns.append(int(votes.argmax()) if votes.any() else None)
+    return columns
+
+
+def profile_sequences(merged_df: pd.DataFrame, hc_gene: str, lc_gene: str, chain: str) -> dict:
+    """Return sequence_id -> IMGT-gapped nucleotide alignment of one chain of a gene pair."""
+    col = "IGH" if chain == "hc" else light_chain_column(lc_gene)
+    if col is None or col not in merged_df:
+        return {}
+    filtered = merged_df[
+        (merged_df["v_call_VDJ"] == hc_gene) & (merged_df["v_call_VJ"] == lc_gene)
+    ].drop_duplicates(subset=["sequence_id"])
+    sequences = {}
+    for sequence_id, value in zip(filtered["sequence_id"], filtered[col]):
+        seq = longest_chunk(value)
+        if seq:
+            sequences[sequence_id] = seq
+    return sequences
+
+
+def cached_mutation_profile(
+    cache: AlignmentCache,
+    key: str,
+    result: dict,
+    merged_df: pd.DataFrame,
+    hc_gene: str,
+    lc_gene: str,
+    chain: str,
+    species: str,
+) -> Optional[dict]:
+    """
+    Return the mutation profile of one chain of a gene pair, cached with its alignment.
+
+    The profile covers every sequence of the alignment table (cluster members
+    included); ``columns`` maps the cached alignment's columns to IMGT codons
+    so hotspots can be drawn over the match matrix. The artifact name carries
+    a digest of the nucleotide inputs, which the alignment key does not cover.
+
+    Returns:
+        `mutation_profile` plus gene, allele and columns; None when the gene
+        has no gapped germline
+    """
+    gene = hc_gene if chain == "hc" else lc_gene
+    allele = resolve_allele(gene, species)
+    if allele is None:
+        return None
+    germline = gapped_v_germlines(species)[allele]
+
+    by_id = profile_sequences(merged_df, hc_gene, lc_gene, chain)
+    member_ids = dict.fromkeys(row["sequence_id"] for row in result[f"{chain}_table"])
+    ids = [sequence_id for sequence_id in member_ids if sequence_id in by_id]
+    material = json.dumps([allele, germline, [by_id[i] for i in ids]]).encode("utf-8")
+    digest = hashlib.sha256(material).hexdigest()[:16]
+
+    def build():
+        profile = mutation_profile([by_id[i] for i in ids], germline)
+        aligned_ids = result[f"{chain}_ids"]
+        rows = [
+            (seq, by_id[sequence_id])
+            for sequence_id, seq in zip(aligned_ids, result[f"{chain}_seqs"])
+            if sequence_id in by_id
+        ]
+        profile.update(
+            {
+                "chain": chain,
+                "gene": gene,
+                "allele": allele,
+                "columns": alignment_columns([r[0] for r in rows], [r[1] for r in rows]),
+            }
+        )
+        return profile
+
+    return cached_artifact(cache, key, f"{chain}_mutation_profile_{digest}", "profile", build)
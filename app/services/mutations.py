@@ -0,0 +1,213 @@
+import os
+from functools import lru_cache
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from Bio import SeqIO
+from Bio.Data import CodonTable
+
+from app.core.config import get_settings
+from app.services.germline_annotation import allele_name, first_call
+from app.services.germline_bundle import load_bundle
+from app.services.regions import (
+    CHAIN_SUFFIXES,
+    IMGT_REGION_ENDS,
+    chain_alignments,
+    longest_chunk,
+)
+from app.services.sequence_arrays import encode_bytes
+
+settings = get_settings()
+
+# Regions compared against the V germline (IMGT codons 1-104); CDR3 and FR4
+# are not encoded by the V gene
+SHM_REGIONS = ("fr1", "cdr1", "fr2", "cdr2", "fr3")
+CDR_REGIONS = ("cdr1", "cdr2")
+V_REGION_CODONS = int(IMGT_REGION_ENDS[-1])
+# First codon (0-based) of each of SHM_REGIONS
+REGION_START_CODONS = np.concatenate([[0], IMGT_REGION_ENDS[:-1]])
+
+# Rows compared at once (about 2 MB of working memory per 1000 rows)
+SHM_CHUNK_ROWS = 50_000
+
+# Byte -> base index (A, C, G, T); 4 for gaps, N and other letters
+NO_BASE = 4
+_BASE_INDEX = np.full(256, NO_BASE, dtype=np.uint8)
+_BASE_INDEX[np.frombuffer(b"ACGT", dtype=np.uint8)] = np.arange(4)
+
+# Codon index (25 * first + 5 * second + third base index) -> amino acid byte;
+# 0 when the codon has fewer than three bases
+_CODON_AA = np.zeros(125, dtype=np.uint8)
+for _codon, _aa in CodonTable.unambiguous_dna_by_id[1].forward_table.items():
+    _CODON_AA[sum(5 ** (2 - i) * "ACGT".index(b) for i, b in enumerate(_codon))] = ord(_aa)
+
+
+def v_germline_paths(species: str) -> list:
+    """Return the IMGT-gapped nucleotide V references of a species."""
+    root = os.path.join(settings.germlines_path, "imgt", species, "vdj")
+    return [os.path.join(root, f"imgt_{species}_{gene}.fasta") for gene in ("IGHV", "IGKV", "IGLV")]
+
+
+@lru_cache()
+def gapped_v_germlines(species: str) -> Dict[str, str]:
+    """Return allele -> uppercased IMGT-gapped V germline, from the bundle when loaded."""
+    bundle = load_bundle()
+    germlines = {}
+    for path in v_germline_paths(species):
+        reference = bundle.reference_for_source(path) if bundle else None
+        if reference:
+            for allele in bundle.alleles(reference):
+                gapped = bundle.gapped(reference, allele)
+                if gapped:
+                    germlines.setdefault(allele, gapped)
+        elif os.path.exists(path):
+            for record in SeqIO.parse(path, "fasta"):
+                germlines.setdefault(allele_name(record.id), str(record.seq).upper())
+    return germlines
+
+
+@lru_cache()
+def _first_alleles(species: str) -> Dict[str, str]:
+    first = {}
+    for allele in gapped_v_germlines(species):
+        first.setdefault(allele.split("*")[0], allele)
+    return first
+
+
+def resolve_allele(call, species: str) -> Optional[str]:
+    """Return the gapped germline allele of a V call: the exact allele, else the gene's first."""
+    if not isinstance(call, str) or call in ("", "None"):
+        return None
+    call = first_call(call)
+    if call in gapped_v_germlines(species):
+        return call
+    return _first_alleles(species).get(call.split("*")[0])
+
+
+def v_region_arrays(codes: np.ndarray) -> tuple:
+    """
+    Encode IMGT-gapped V regions for `compare_v_regions`.
+
+    Args:
+        codes: (n, 3 * V_REGION_CODONS) uint8 sequence bytes (uppercase)
+
+    Returns:
+        Tuple of (base indexes, amino acid bytes per IMGT codon; 0 for
+        incomplete codons)
+    """
+    bases = _BASE_INDEX[codes]
+    codons = bases.reshape(len(codes), codes.shape[1] // 3, 3)
+    aa = _CODON_AA[25 * codons[:, :, 0] + 5 * codons[:, :, 1] + codons[:, :, 2]]
+    return bases, aa
+
+
+def compare_v_regions(seq: tuple, germline: tuple) -> dict:
+    """
+    Count mutations of IMGT-gapped V regions against their aligned germlines.
+
+    Both sides share IMGT columns, so no per-sequence alignment is needed: a
+    nucleotide is compared when both sides have a base, a codon when both
+    sides have three.
+
+    Args:
+        seq: `v_region_arrays` of the sequences
+        germline: `v_region_arrays` of each row's germline
+
+    Returns:
+        Dictionary of (n, len(SHM_REGIONS)) int32 arrays: nt_mutations,
+        nt_sites, aa_mutations and aa_sites
+    """
+    seq_bases, seq_aa = seq
+    germline_bases, germline_aa = germline
+    nt_sites = (seq_bases < NO_BASE) & (germline_bases < NO_BASE)
+    nt_mutations = nt_sites & (seq_bases != germline_bases)
+    aa_sites = (seq_aa > 0) & (germline_aa > 0)
+    aa_mutations = aa_sites & (seq_aa != germline_aa)
+
+    def per_region(hits: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        return np.add.reduceat(hits, starts, axis=1, dtype=np.int32)
+
+    return {
+        "nt_mutations": per_region(nt_mutations, REGION_START_CODONS * 3),
+        "nt_sites": per_region(nt_sites, REGION_START_CODONS * 3),
+        "aa_mutations": per_region(aa_mutations, REGION_START_CODONS),
+        "aa_sites": per_region(aa_sites, REGION_START_CODONS),
+    }
+
+
+def _frequency(mutations: np.ndarray, sites: np.ndarray, present: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        freq = mutations / sites
+    return np.where(present & (sites > 0), freq, np.nan).astype(np.float32)
+
+
+def annotate_mutations(merged_df: pd.DataFrame, species: str) -> pd.DataFrame:
+    """
+    Add somatic hypermutation columns for both chains of every cell.
+
+    Each V call is resolved to an IMGT-gapped germline allele (exact allele,
+    else the first allele of the gene). Every allele is encoded and translated
+    once and gathered per row; rows are compared in chunks of `SHM_CHUNK_ROWS`.
+
+    Adds, per chain suffix (VDJ for heavy, VJ for light) and per prefix
+    (``mu`` for nucleotides, ``mu_aa`` for amino acids):
+      - ``<prefix>_count_<sfx>`` / ``<prefix>_freq_<sfx>``: V-region totals
+      - ``<prefix>_count_<region>_<sfx>`` for each of `SHM_REGIONS`
+      - ``<prefix>_freq_fr_<sfx>`` / ``<prefix>_freq_cdr_<sfx>``
+
+    Counts are Int16 and frequencies float32 (fraction of compared sites);
+    rows without a sequence or a known germline are NA.
+
+    Returns:
+        The same DataFrame, modified in place
+    """
+    germlines = gapped_v_germlines(species)
+    allele_codes = {allele: i for i, allele in enumerate(germlines)}
+    width = 3 * V_REGION_CODONS
+    germline_bases, germline_aa = v_region_arrays(
+        encode_bytes(list(germlines.values()), width)
+    )
+
+    def resolve(call) -> int:
+        allele = resolve_allele(call, species)
+        return allele_codes[allele] if allele else -1
+
+    fr = np.array([region not in CDR_REGIONS for region in SHM_REGIONS])
+    for chain_type, sequences in chain_alignments(merged_df).items():
+        suffix = CHAIN_SUFFIXES[chain_type]
+        calls = merged_df.get(f"v_call_{suffix}", pd.Series(None, index=merged_df.index))
+        resolved = {call: resolve(call) for call in calls.dropna().unique()}
+        codes = calls.map(resolved).fillna(-1).to_numpy(int)
+        seqs = [longest_chunk(s) for s in sequences]
+        rows = np.flatnonzero((codes >= 0) & np.array([bool(s) for s in seqs], dtype=bool))
+
+        counts = {
+            name: np.zeros((len(merged_df), len(SHM_REGIONS)), dtype=np.int32)
+            for name in ("nt_mutations", "nt_sites", "aa_mutations", "aa_sites")
+        }
+        for start in range(0, len(rows), SHM_CHUNK_ROWS):
+            chunk = rows[start : start + SHM_CHUNK_ROWS]
+            seq = v_region_arrays(encode_bytes([seqs[i].upper() for i in chunk], width))
+            germline = (germline_bases[codes[chunk]], germline_aa[codes[chunk]])
+            for name, values in compare_v_regions(seq, germline).items():
+                counts[name][chunk] = values
+
+        present = np.zeros(len(merged_df), dtype=bool)
+        present[rows] = True
+        for prefix, kind in (("mu", "nt"), ("mu_aa", "aa")):
+            mutations, sites = counts[f"{kind}_mutations"], counts[f"{kind}_sites"]
+            total = mutations.sum(axis=1)
+            merged_df[f"{prefix}_count_{suffix}"] = pd.arrays.IntegerArray(
+                total.astype(np.int16), ~present
+            )
+            merged_df[f"{prefix}_freq_{suffix}"] = _frequency(total, sites.sum(axis=1), present)
+            for i, region in enumerate(SHM_REGIONS):
+                merged_df[f"{prefix}_count_{region}_{suffix}"] = pd.arrays.IntegerArray(
+                    mutations[:, i].astype(np.int16), ~present
+                )
+            for name, columns in (("fr", fr), ("cdr", ~fr)):
+                merged_df[f"{prefix}_freq_{name}_{suffix}"] = _frequency(
+                    mutations[:, columns].sum(axis=1), sites[:, columns].sum(axis=1), present
+                )
+    return merged_df
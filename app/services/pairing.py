@@ -0,0 +1,100 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from app.services.alignment_cache import AlignmentCache
+from app.services.versioning import versioned_key
+
+# Bump when the cached matrix changes meaning
+PAIRING_VERSION = 1
+
+# Query filter -> merged_df column it selects on
+PAIRING_FILTERS = {"isotype": "isotype", "sample": "sample_id"}
+
+
+def filter_values(merged_df: pd.DataFrame) -> dict:
+    """Return the values each pairing filter can take in a project, most frequent first."""
+    values = {}
+    for name, column in PAIRING_FILTERS.items():
+        if column in merged_df:
+            counts = merged_df[column].dropna().astype(str).value_counts()
+            values[name] = [v for v in counts.index if v not in ("", "None")]
+        else:
+            values[name] = []
+    return values
+
+
+def _select(merged_df: pd.DataFrame, filters: dict) -> pd.DataFrame:
+    for name, value in filters.items():
+        if value is None:
+            continue
+        column = PAIRING_FILTERS[name]
+        if column not in merged_df:
+            raise ValueError(f"This project has no {name} annotation")
+        merged_df = merged_df[merged_df[column].astype(str) == value]
+    return merged_df
+
+
+def pairing_matrix(merged_df: pd.DataFrame, **filters) -> dict:
+    """
+    Count cells per (HC V gene, LC V gene) pair.
+
+    Both call columns are turned into categorical codes and the full
+    crosstab is one bincount over ``hc_code * n_lc + lc_code``. Genes are
+    ordered by decreasing cell count; cells missing either call are left out.
+
+    Args:
+        merged_df: Merged dataset of a project
+        **filters: Values of `PAIRING_FILTERS` to restrict the cells to
+
+    Returns:
+        Dictionary with hc_genes, lc_genes, hc_totals, lc_totals, cells, and
+        the non-zero entries as parallel rows, cols and counts lists
+    """
+    rows = _select(merged_df, filters)[["v_call_VDJ", "v_call_VJ"]].dropna()
+    rows = rows[(rows != "None").all(axis=1)]
+    hc_genes = rows["v_call_VDJ"].value_counts().index
+    lc_genes = rows["v_call_VJ"].value_counts().index
+    hc = pd.Categorical(rows["v_call_VDJ"], categories=hc_genes).codes.astype(np.int64)
+    lc = pd.Categorical(rows["v_call_VJ"], categories=lc_genes).codes.astype(np.int64)
+
+    counts = np.bincount(hc * len(lc_genes) + lc, minlength=len(hc_genes) * len(lc_genes))
+    counts = counts.reshape(len(hc_genes), len(lc_genes))
+    nonzero_rows, nonzero_cols = np.nonzero(counts)
+    return {
+        "hc_genes": hc_genes.tolist(),
+        "lc_genes": lc_genes.tolist(),
+        "hc_totals": counts.sum(axis=1).tolist(),
+        "lc_totals": counts.sum(axis=0).tolist(),
+        "cells": int(len(rows)),
+        "rows": nonzero_rows.tolist(),
+        "cols": nonzero_cols.tolist(),
+        "counts": counts[nonzero_rows, nonzero_cols].tolist(),
+    }
+
+
+def dense_counts(matrix: dict) -> np.ndarray:
+    """Expand the non-zero entries of a `pairing_matrix` into an (HC x LC) uint32 array."""
+    dense = np.zeros((len(matrix["hc_genes"]), len(matrix["lc_genes"])), dtype=np.uint32)
+    dense[matrix["rows"], matrix["cols"]] = matrix["counts"]
+    return dense
+
+
+def cached_pairing_matrix(
+    cache: AlignmentCache,
+    merged_df: pd.DataFrame,
+    version: Optional[str],
+    isotype: Optional[str] = None,
+    sample: Optional[str] = None,
+) -> dict:
+    """Return `pairing_matrix`, cached in the project store per project version and filters."""
+    filters = {"isotype": isotype, "sample": sample}
+    key = versioned_key("pairing", version, PAIRING_VERSION, filters) if version else None
+    cached = cache.get_json(key, "pairing") if key else None
+    if cached is not None:
+        return cached
+    value = {**pairing_matrix(merged_df, **filters), "filters": filters}
+    if key:
+        cache.put_json(key, value, "pairing")
+    return value
@@ -0,0 +1,187 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from app.services.germline_annotation import REGION_ORDER, germline_index
+from app.services.sequence_arrays import encode_bytes
+
+# One character per residue in the region columns, in REGION_ORDER order
+# (FR1, CDR1, FR2, CDR2, FR3, CDR3, FR4); "?" where the region is unknown
+REGION_CODES = "1A2B3C4"
+UNKNOWN_REGION = "?"
+
+# Last IMGT amino-acid position of FR1, CDR1, FR2, CDR2 and FR3; CDR3 starts
+# at 105 and its end depends on the junction length
+IMGT_REGION_ENDS = np.array([26, 38, 55, 65, 104])
+
+# Bytes that best_translation keeps as nucleotides
+_NUCLEOTIDES = np.zeros(256, dtype=bool)
+_NUCLEOTIDES[np.frombuffer(b"ACGTURYKMSWBDHVN", dtype=np.uint8)] = True
+
+# merged_df column suffix of each chain
+CHAIN_SUFFIXES = {"hc": "VDJ", "lc": "VJ"}
+
+# Rows labelled at once (about 4 MB of working memory per 1000 rows)
+REGION_CHUNK_ROWS = 20_000
+
+
+def region_name(code: str, chain_type: str) -> Optional[str]:
+    """Return the `REGION_ORDER` name of a region code, or None for unknown."""
+    index = REGION_CODES.find(code)
+    return REGION_ORDER[chain_type][index] if index >= 0 else None
+
+
+def longest_chunk(value) -> str:
+    # Comma-joined contigs are resolved like best_translation: longest wins
+    if not isinstance(value, str) or value == "None":
+        return ""
+    return max(value.upper().split(","), key=len)
+
+
+def residue_codons(gapped: list) -> np.ndarray:
+    """
+    Return the IMGT codon number of every translated residue of gapped alignments.
+
+    Gaps are dropped and every third remaining nucleotide starts a residue of
+    the frame-0 translation `best_translation` produces; its codon number is
+    that nucleotide's IMGT-gapped position // 3 + 1.
+
+    Returns:
+        (n, max residues) int16 array; 0 pads rows past their last residue
+    """
+    codes = encode_bytes([s.upper() for s in gapped])
+    n, width = codes.shape
+    if width == 0:
+        return np.zeros((n, 1), dtype=np.int16)
+    valid = _NUCLEOTIDES[codes]
+    position = (np.arange(width) // 3 + 1).astype(np.int16)
+
+    # Rank of each nucleotide within its row; every third one starts a residue
+    residue = np.cumsum(valid, axis=1, dtype=np.int32) - 1
+    n_residues = (residue[:, -1] + 1) // 3
+    starts = valid & (residue % 3 == 0)
+    starts &= residue // 3 < n_residues[:, None]
+    rows, cols = np.nonzero(starts)
+    packed = np.zeros((n, max(1, int(n_residues.max()))), dtype=np.int16)
+    packed[rows, residue[rows, cols] // 3] = position[cols]
+    return packed
+
+
+def residue_regions(gapped: list, junctions: list) -> np.ndarray:
+    """
+    Label every translated residue of IMGT-gapped V(D)J nucleotide alignments.
+
+    Each residue gets the region of its IMGT codon (see `residue_codons`);
+    CDR3 runs from position 105 for ``junction length / 3 - 2`` codons, then
+    FR4.
+
+    Args:
+        gapped: IMGT-gapped nucleotide sequence per row ("" when absent)
+        junctions: Junction nucleotide sequence per row (None when absent)
+
+    Returns:
+        (n, max residues) array of `REGION_CODES` indexes; -1 is unknown and
+        -2 pads rows past their last residue
+    """
+    codons = residue_codons(gapped)
+    regions = np.searchsorted(IMGT_REGION_ENDS, codons).astype(np.int8)
+    cdr3_codons = np.array(
+        [len(j) // 3 - 2 if isinstance(j, str) and j else -1 for j in junctions]
+    )
+    beyond_fr3 = codons > IMGT_REGION_ENDS[-1]
+    in_cdr3 = codons <= IMGT_REGION_ENDS[-1] + cdr3_codons[:, None]
+    regions[beyond_fr3 & ~in_cdr3] = 6
+    regions[beyond_fr3 & (cdr3_codons[:, None] < 0)] = -1
+    regions[codons == 0] = -2
+    return regions
+
+
+def region_strings(labels: np.ndarray) -> list:
+    """Encode residue label rows as `REGION_CODES` strings."""
+    table = np.frombuffer((REGION_CODES + UNKNOWN_REGION).encode("ascii"), dtype=np.uint8)
+    # -1 (unknown) indexes the trailing "?"
+    chars = table[np.where(labels == -2, 0, labels)]
+    lengths = (labels != -2).sum(axis=1)
+    return [row[:length].tobytes().decode("ascii") for row, length in zip(chars, lengths)]
+
+
+def region_bounds(labels: np.ndarray, code_index: int) -> tuple:
+    """Return 1-based (start, end) residue positions of one region per row, NA where absent."""
+    hit = labels == code_index
+    present = hit.any(axis=1)
+    start = hit.argmax(axis=1) + 1
+    end = labels.shape[1] - hit[:, ::-1].argmax(axis=1)
+    return (
+        pd.arrays.IntegerArray(start.astype(np.int16), ~present),
+        pd.arrays.IntegerArray(end.astype(np.int16), ~present),
+    )
+
+
+def chain_alignments(merged_df: pd.DataFrame) -> dict:
+    """Return the IMGT-gapped alignment column of each chain type ("hc", "lc")."""
+    heavy = merged_df["IGH"] if "IGH" in merged_df else pd.Series("", index=merged_df.index)
+    light = pd.Series("", index=merged_df.index, dtype=object)
+    for col in ("IGK", "IGL"):
+        if col in merged_df:
+            use = merged_df.get("locus_VJ", pd.Series(col, index=merged_df.index)) == col
+            light = light.where(~use, merged_df[col])
+    return {"hc": heavy, "lc": light}
+
+
+def region_frame(gapped: list, junctions: list, suffix: str) -> pd.DataFrame:
+    """Return the region string and CDR bounds columns of a block of rows."""
+    labels = residue_regions(gapped, junctions)
+    columns = {f"regions_{suffix}": region_strings(labels)}
+    for number, code in ((1, "A"), (2, "B"), (3, "C")):
+        start, end = region_bounds(labels, REGION_CODES.index(code))
+        columns[f"cdr{number}_start_{suffix}"] = start
+        columns[f"cdr{number}_end_{suffix}"] = end
+    return pd.DataFrame(columns)
+
+
+def annotate_regions(merged_df: pd.DataFrame, species: Optional[str] = None) -> pd.DataFrame:
+    """
+    Add germline allele and FR/CDR region columns for both chains of every cell.
+
+    Adds, per chain suffix (VDJ for heavy, VJ for light):
+      - ``germline_allele_<sfx>``: exact allele of the V call in the species'
+        reference (only when `species` is given)
+      - ``regions_<sfx>``: one `REGION_CODES` character per translated residue
+      - ``cdr{1,2,3}_{start,end}_<sfx>``: 1-based residue boundaries (Int16)
+
+    Rows are labelled in chunks of `REGION_CHUNK_ROWS`.
+
+    Returns:
+        The same DataFrame, modified in place
+    """
+    index = germline_index(species) if species else None
+    for chain_type, sequences in chain_alignments(merged_df).items():
+        suffix = CHAIN_SUFFIXES[chain_type]
+        junctions = merged_df.get(f"junction_{suffix}", pd.Series(None, index=merged_df.index))
+        gapped = [longest_chunk(s) for s in sequences]
+        junction_seqs = [longest_chunk(j) or None for j in junctions]
+        columns = pd.concat(
+            [
+                region_frame(
+                    gapped[start : start + REGION_CHUNK_ROWS],
+                    junction_seqs[start : start + REGION_CHUNK_ROWS],
+                    suffix,
+                )
+                for start in range(0, max(len(gapped), 1), REGION_CHUNK_ROWS)
+            ],
+            ignore_index=True,
+        )
+        columns.index = merged_df.index
+        for name in columns:
+            merged_df[name] = columns[name]
+
+        if index is not None and f"v_call_{suffix}" in merged_df:
+            calls = merged_df[f"v_call_{suffix}"]
+            alleles = {
+                call: index.allele(call)
+                for call in calls.dropna().unique()
+                if isinstance(call, str) and call != "None"
+            }
+            merged_df[f"germline_allele_{suffix}"] = calls.map(alleles).astype(object)
+    return merged_df
@@ -0,0 +1,82 @@
+from typing import Optional
+
+import numpy as np
+
+# Residue codes used by the array-based sequence tools. Every byte outside the
+# alphabet maps to "X"; "." (IMGT gap) is treated as "-".
+ALPHABET = "ACDEFGHIKLMNPQRSTVWYBZXJUO*-"
+GAP_CODE = ALPHABET.index("-")
+UNKNOWN_CODE = ALPHABET.index("X")
+
+_LOOKUP = np.full(256, UNKNOWN_CODE, dtype=np.uint8)
+for _code, _char in enumerate(ALPHABET):
+    _LOOKUP[ord(_char)] = _code
+    _LOOKUP[ord(_char.lower())] = _code
+_LOOKUP[ord(".")] = GAP_CODE
+
+# Upper bound on the temporary arrays built by blockwise comparisons
+BLOCK_BYTES = 64 * 1024 * 1024
+
+
+def encode_sequences(seqs: list, width: Optional[int] = None) -> np.ndarray:
+    """
+    Encode sequences as an (n, width) uint8 array of `ALPHABET` codes.
+
+    Shorter sequences are right-padded with gaps and longer ones truncated, so
+    the same call works for aligned and unaligned input.
+    """
+    if width is None:
+        width = max((len(s) for s in seqs), default=0)
+    padded = "".join(s[:width].ljust(width, "-") for s in seqs)
+    raw = np.frombuffer(padded.encode("ascii", errors="replace"), dtype=np.uint8)
+    return _LOOKUP[raw].reshape(len(seqs), width)
+
+
+def encode_bytes(seqs: list, width: Optional[int] = None) -> np.ndarray:
+    """
+    Encode sequences as an (n, width) uint8 array of their raw bytes.
+
+    Unlike `encode_sequences`, characters are kept exactly as written (case and
+    unknown letters included); sequences are right-padded with "-".
+    """
+    if width is None:
+        width = max((len(s) for s in seqs), default=0)
+    padded = "".join(s[:width].ljust(width, "-") for s in seqs)
+    raw = np.frombuffer(padded.encode("latin-1", errors="replace"), dtype=np.uint8)
+    return raw.reshape(len(seqs), width)
+
+
+def decode_sequences(codes: np.ndarray) -> list:
+    """Inverse of `encode_sequences` (gap padding is kept)."""
+    table = np.frombuffer(ALPHABET.encode("ascii"), dtype=np.uint8)
+    width = codes.shape[1] if codes.ndim == 2 else 0
+    text = table[codes].tobytes().decode("ascii")
+    return [text[i * width : (i + 1) * width] for i in range(len(codes))]
+
+
+def block_rows(n_cols: int, n_other: int, itemsize: int = 1) -> int:
+    """Return how many rows to compare at once against `n_other` rows of `n_cols`."""
+    per_row = max(1, n_cols * n_other * itemsize)
+    return max(1, BLOCK_BYTES // per_row)
+
+
+def hamming_to(codes: np.ndarray, refs: np.ndarray) -> np.ndarray:
+    """Return the (len(codes), len(refs)) matrix of mismatch counts, computed in row blocks."""
+    out = np.empty((len(codes), len(refs)), dtype=np.int32)
+    step = block_rows(codes.shape[1], len(refs))
+    for start in range(0, len(codes), step):
+        block = codes[start : start + step]
+        out[start : start + step] = (block[:, None, :] != refs[None, :, :]).sum(axis=2)
+    return out
+
+
+def matches_to(codes: np.ndarray, refs: np.ndarray) -> np.ndarray:
+    """Return the (len(codes), len(refs)) matrix of identical non-gap positions."""
+    out = np.empty((len(codes), len(refs)), dtype=np.int32)
+    step = block_rows(codes.shape[1], len(refs))
+    ref_residue = refs != GAP_CODE
+    for start in range(0, len(codes), step):
+        block = codes[start : start + step]
+        same = (block[:, None, :] == refs[None, :, :]) & ref_residue[None, :, :]
+        out[start : start + step] = same.sum(axis=2)
+    return out
@@ -0,0 +1,177 @@
+import math
+from io import StringIO
+from typing import Optional
+
+import numpy as np
+from Bio import Phylo
+
+from app.services.alignment_cache import AlignmentCache, cached_artifact
+from app.services.trees import cached_tree
+
+# Layout styles served by the tree layout endpoint
+LAYOUT_STYLES = ("rectangular", "radial")
+
+
+def tree_layout(newick: str) -> dict:
+    """
+    Compute the pixel-independent layout of a Newick tree.
+
+    Nodes are numbered in preorder (the root is 0). Every node gets its
+    distance from the root and a position along the leaf axis: leaves are
+    0..n-1 in tree order and internal nodes sit at the mean of their children,
+    as in the phylogram layout of `phylogenetic-tree.js`. The radial layout uses
+    the same positions as angles, so both styles come from one pass.
+
+    Returns:
+        Column-oriented dictionary (one list entry per node) with parent, name,
+        length, distance, position, leaf_start and leaf_count
+    """
+    tree = Phylo.read(StringIO(newick), "newick")
+    parent, names, lengths, children = [], [], [], []
+    stack = [(tree.root, -1)]
+    while stack:
+        clade, parent_id = stack.pop()
+        node_id = len(parent)
+        parent.append(parent_id)
+        names.append(clade.name or "")
+        lengths.append(float(clade.branch_length or 0.0))
+        children.append([])
+        if parent_id >= 0:
+            children[parent_id].append(node_id)
+        # Reversed so that children are numbered in their Newick order
+        stack.extend((child, node_id) for child in reversed(clade.clades))
+
+    n = len(parent)
+    distance = np.zeros(n)
+    for node_id in range(1, n):
+        distance[node_id] = distance[parent[node_id]] + lengths[node_id]
+
+    # Leaves are numbered in preorder, so a subtree's leaves are contiguous
+    position = np.zeros(n)
+    leaf_start = np.zeros(n, dtype=int)
+    leaf_count = np.zeros(n, dtype=int)
+    n_leaves = 0
+    for node_id in range(n):
+        if not children[node_id]:
+            position[node_id] = leaf_start[node_id] = n_leaves
+            leaf_count[node_id] = 1
+            n_leaves += 1
+    for node_id in range(n - 1, -1, -1):
+        kids = children[node_id]
+        if kids:
+            position[node_id] = np.mean(position[kids])
+            leaf_start[node_id] = leaf_start[kids[0]]
+            leaf_count[node_id] = leaf_count[kids].sum()
+
+    return {
+        "nodes": n,
+        "leaves": n_leaves,
+        "max_distance": float(distance.max()) if n else 0.0,
+        "parent": parent,
+        "name": names,
+        "length": lengths,
+        "distance": distance.tolist(),
+        "position": position.tolist(),
+        "leaf_start": leaf_start.tolist(),
+        "leaf_count": leaf_count.tolist(),
+    }
+
+
+def layout_view(
+    layout: dict,
+    style: str = "rectangular",
+    width: float = 800,
+    height: float = 600,
+    min_px: float = 3,
+    expand: Optional[set] = None,
+) -> dict:
+    """
+    Scale a layout to pixels and apply level-of-detail collapsing.
+
+    An internal node whose leaves would span less than `min_px` pixels along the
+    leaf axis is returned as a single collapsed node (with its leaf count)
+    instead of its subtree, unless its id is in `expand`. Expanding a node shows
+    its children, which may in turn be collapsed.
+
+    Rectangular coordinates put the root on the left (x is the distance from
+    the root, y the leaf axis); radial coordinates put the root at the centre.
+
+    Returns:
+        Dictionary with the visible nodes (id, parent, name, x, y, leaves,
+        collapsed and, for radial layouts, angle and radius)
+    """
+    expand = expand or set()
+    n_leaves = max(1, layout["leaves"])
+    max_distance = layout["max_distance"] or 1.0
+    radius = min(width, height) / 2
+    if style == "radial":
+        # Pixels per leaf along the outer circle
+        pitch = 2 * math.pi * radius / n_leaves
+    else:
+        pitch = height / n_leaves
+
+    nodes = []
+    children = [[] for _ in range(layout["nodes"])]
+    for node_id, parent_id in enumerate(layout["parent"]):
+        if parent_id >= 0:
+            children[parent_id].append(node_id)
+
+    stack = [0] if layout["nodes"] else []
+    while stack:
+        node_id = stack.pop()
+        leaves = layout["leaf_count"][node_id]
+        collapsed = (
+            node_id != 0
+            and bool(children[node_id])
+            and leaves * pitch < min_px
+            and node_id not in expand
+        )
+        scaled = layout["distance"][node_id] / max_distance
+        node = {
+            "id": node_id,
+            "parent": layout["parent"][node_id],
+            "name": layout["name"][node_id],
+            "leaves": leaves,
+            "collapsed": collapsed,
+        }
+        if style == "radial":
+            angle = 2 * math.pi * (layout["position"][node_id] + 0.5) / n_leaves
+            r = scaled * radius
+            node.update(
+                {
+                    "angle": round(angle, 5),
+                    "radius": round(r, 2),
+                    "x": round(width / 2 + r * math.cos(angle), 2),
+                    "y": round(height / 2 + r * math.sin(angle), 2),
+                }
+            )
+        else:
+            node.update(
+                {
+                    "x": round(scaled * width, 2),
+                    "y": round((layout["position"][node_id] + 0.5) * pitch, 2),
+                }
+            )
+        nodes.append(node)
+        if not collapsed:
+            stack.extend(reversed(children[node_id]))
+
+    return {
+        "style": style,
+        "width": width,
+        "height": height,
+        "leaves": layout["leaves"],
+        "nodes": nodes,
+    }
+
+
+def cached_layout(
+    cache: AlignmentCache, key: str, result: dict, chain: str, method: str = "nj"
+) -> Optional[dict]:
+    """Return the layout of a chain's tree, cached next to the tree itself."""
+
+    def build():
+        newick = cached_tree(cache, key, result, chain, method)
+        return tree_layout(newick) if newick else None
+
+    return cached_artifact(cache, key, f"{chain}_{method}_layout", "tree", build)
@@ -0,0 +1,279 @@
+from collections import Counter
+from io import StringIO
+from typing import Optional
+
+import numpy as np
+from Bio import Phylo
+from Bio.Phylo import BaseTree
+
+from app.services.alignment_cache import AlignmentCache, cached_artifact
+from app.services.alignment_codec import chain_alignment
+from app.services.distances import distance_matrix_of
+
+# Rows of a legacy alignment payload that are not sequences
+NON_SEQUENCE_ROWS = ("Germline", "Consensus", "Region")
+
+# Tree construction methods selectable by the tree endpoints
+TREE_METHODS = ("nj", "upgma")
+
+# Leaf collapsing: none, identical sequences, or whole clones
+COLLAPSE_MODES = ("none", "identical", "clone")
+
+
+def tree_sequences(result: dict, chain: str) -> list:
+    """Return the `(label, aligned sequence)` pairs of a chain that go into its tree."""
+    label_map = result.get(f"{chain}_label_map", {})
+    return [
+        (label_map[name], sequence)
+        for name, sequence in chain_alignment(result, chain)
+        if isinstance(name, str)
+        and name not in NON_SEQUENCE_ROWS
+        and isinstance(sequence, str)
+        and sequence
+        and name in label_map
+    ]
+
+
+def _upper_triangle_inf(n: int) -> np.ndarray:
+    """(n, n) array that is 0 below the diagonal and inf on and above it."""
+    return np.where(np.tril(np.ones((n, n), dtype=bool), -1), 0.0, np.inf)
+
+
+def neighbor_joining(names: list, distances: np.ndarray) -> BaseTree.Tree:
+    """
+    Neighbor-joining tree of a square distance matrix.
+
+    Array-based equivalent of `DistanceTreeConstructor.nj`: the same joins, tie
+    breaking, branch lengths and clade names, with each iteration's Q-matrix
+    computed in one vectorized pass over the active nodes.
+    """
+    n = len(names)
+    clades = [BaseTree.Clade(None, name) for name in names]
+    if n == 1:
+        return BaseTree.Tree(clades[0], rooted=False)
+    if n == 2:
+        clade1, clade2 = clades[1], clades[0]
+        clade1.branch_length = distances[1, 0] / 2.0
+        clade2.branch_length = distances[1, 0] - clade1.branch_length
+        inner_clade = BaseTree.Clade(None, "Inner")
+        inner_clade.clades.extend([clade1, clade2])
+        return BaseTree.Tree(inner_clade, rooted=False)
+
+    # Compacted like Biopython's matrix: a join replaces row/column j and
+    # deletes row/column i, so node order is the same as in its clade list
+    dm = np.array(distances, dtype=np.float64)
+    upper = _upper_triangle_inf(n)
+    inner_count = 0
+    inner_clade = None
+    while len(dm) > 2:
+        m = len(dm)
+        node_dist = dm.sum(axis=1) / (m - 2)
+        q = dm - node_dist[:, None] - node_dist[None, :] + upper[:m, :m]
+        # First minimum in row-major order of the lower triangle
+        i, j = divmod(int(np.argmin(q)), m)
+        if (i, j) == (1, 0):
+            i, j = 0, 1
+
+        clade1, clade2 = clades[i], clades[j]
+        inner_count += 1
+        inner_clade = BaseTree.Clade(None, "Inner" + str(inner_count))
+        inner_clade.clades.extend([clade1, clade2])
+        d_ij = dm[i, j]
+        clade1.branch_length = (d_ij + node_dist[i] - node_dist[j]) / 2.0
+        clade2.branch_length = d_ij - clade1.branch_length
+
+        clades[j] = inner_clade
+        del clades[i]
+        joined = (dm[i] + dm[j] - d_ij) / 2.0
+        joined[j] = 0
+        dm[j, :] = joined
+        dm[:, j] = joined
+        dm = np.delete(np.delete(dm, i, axis=0), i, axis=1)
+
+    first, second = clades[0], clades[1]
+    last_distance = dm[1, 0]
+    if first is inner_clade:
+        first.branch_length = 0
+        second.branch_length = last_distance
+        first.clades.append(second)
+        root = first
+    else:
+        first.branch_length = last_distance
+        second.branch_length = 0
+        second.clades.append(first)
+        root = second
+    return BaseTree.Tree(root, rooted=False)
+
+
+def upgma(names: list, distances: np.ndarray) -> BaseTree.Tree:
+    """
+    Array-based equivalent of `DistanceTreeConstructor.upgma`.
+
+    Like Biopython, the merged row is the plain mean of the two joined rows
+    and ties go to the last minimum in row-major order.
+    """
+    n = len(names)
+    clades = [BaseTree.Clade(None, name) for name in names]
+    if n == 1:
+        return BaseTree.Tree(clades[0])
+
+    dm = np.array(distances, dtype=np.float64)
+    upper = _upper_triangle_inf(n)
+    heights = [0.0] * n
+    inner_count = 0
+    inner_clade = None
+    while len(dm) > 1:
+        m = len(dm)
+        flat = (dm + upper[:m, :m]).ravel()
+        i, j = divmod(len(flat) - 1 - int(np.argmin(flat[::-1])), m)
+        min_dist = flat[i * m + j]
+
+        clade1, clade2 = clades[i], clades[j]
+        inner_count += 1
+        inner_clade = BaseTree.Clade(None, "Inner" + str(inner_count))
+        inner_clade.clades.extend([clade1, clade2])
+        clade1.branch_length = min_dist * 1.0 / 2 - heights[i]
+        clade2.branch_length = min_dist * 1.0 / 2 - heights[j]
+        heights[j] = max(
+            heights[i] + clade1.branch_length, heights[j] + clade2.branch_length
+        )
+
+        clades[j] = inner_clade
+        del clades[i], heights[i]
+        joined = (dm[i] + dm[j]) / 2
+        joined[j] = 0
+        dm[j, :] = joined
+        dm[:, j] = joined
+        dm = np.delete(np.delete(dm, i, axis=0), i, axis=1)
+
+    inner_clade.branch_length = 0
+    return BaseTree.Tree(inner_clade)
+
+
+def write_newick(tree: BaseTree.Tree) -> str:
+    handle = StringIO()
+    Phylo.write(tree, handle, "newick")
+    return handle.getvalue().strip()
+
+
+def build_newick(labelled_sequences: list, method: str = "nj") -> Optional[str]:
+    """
+    Build a tree (BLOSUM62 distances) from aligned sequences and return it as Newick.
+
+    Returns None when there are fewer than two sequences or they are not of one
+    common length.
+    """
+    if len(labelled_sequences) < 2:
+        return None
+    lengths = {len(seq) for _, seq in labelled_sequences}
+    if len(lengths) != 1 or 0 in lengths:
+        return None
+
+    labels = [label for label, _ in labelled_sequences]
+    distances = distance_matrix_of([seq for _, seq in labelled_sequences], "blosum62")
+    builder = upgma if method == "upgma" else neighbor_joining
+    newick = write_newick(builder(labels, distances))
+    if not newick or newick == "();":
+        return None
+    return newick
+
+
+def cached_tree(
+    cache: AlignmentCache, key: str, result: dict, chain: str, method: str = "nj"
+) -> Optional[str]:
+    """Return the Newick tree of a chain, built once per alignment content key."""
+    # NJ trees keep the artifact name they had before methods were selectable
+    name = f"{chain}_newick" if method == "nj" else f"{chain}_{method}_newick"
+    return cached_artifact(
+        cache,
+        key,
+        name,
+        "tree",
+        lambda: build_newick(tree_sequences(result, chain), method),
+        encode=lambda newick: newick.encode("utf-8"),
+        decode=lambda payload: payload.decode("utf-8"),
+    )
+
+
+def _clone_of(row: dict):
+    clone = row.get("clone_id")
+    if isinstance(clone, str) and clone and clone != "None":
+        return clone
+    return None
+
+
+def collapsed_leaves(result: dict, chain: str, mode: str) -> list:
+    """
+    Group the aligned rows of a chain into weighted leaves.
+
+    ``identical`` merges rows with the same aligned sequence; ``clone`` merges
+    rows sharing a `clone_id` (rows without one fall back to identical
+    sequences). Rows standing for a cluster of sequences (see
+    `{chain}_clusters`) count every cluster member. Each leaf carries the
+    most common sequence of its group, the cell count, isotype mix and member
+    display names.
+    """
+    label_map = result.get(f"{chain}_label_map", {})
+    table = {row["sequence_id"]: row for row in result.get(f"{chain}_table", [])}
+    cluster_members = (result.get(f"{chain}_clusters") or {}).get("members", {})
+
+    groups = {}
+    for orig_id, seq in chain_alignment(result, chain):
+        if orig_id not in label_map or not seq:
+            continue
+        clone = _clone_of(table.get(orig_id, {})) if mode == "clone" else None
+        group_key = ("clone", clone) if clone else ("seq", seq)
+        groups.setdefault(group_key, []).append((orig_id, seq))
+
+    leaves = []
+    for (kind, value), rows in groups.items():
+        members = []
+        seq_weights = Counter()
+        for orig_id, seq in rows:
+            row_members = cluster_members.get(orig_id, [orig_id])
+            members.extend(row_members)
+            seq_weights[seq] += len(row_members)
+        isotypes = Counter(
+            str(table.get(member, {}).get("isotype") or "unknown") for member in members
+        )
+        first_id = rows[0][0]
+        leaves.append(
+            {
+                "label": f"clone_{value}" if kind == "clone" else label_map[first_id],
+                "seq": seq_weights.most_common(1)[0][0],
+                "count": len(members),
+                "clone_id": value if kind == "clone" else _clone_of(table.get(first_id, {})),
+                "isotypes": dict(isotypes),
+                "members": [
+                    str(table.get(member, {}).get("display_name") or member)
+                    for member in members
+                ],
+            }
+        )
+    return leaves
+
+
+def build_collapsed_tree(result: dict, chain: str, method: str, mode: str) -> dict:
+    """Return the tree over collapsed leaves plus the annotations of each leaf."""
+    leaves = collapsed_leaves(result, chain, mode)
+    newick = build_newick([(leaf["label"], leaf["seq"]) for leaf in leaves], method)
+    return {
+        "newick": newick,
+        "leaves": {
+            leaf.pop("label"): {key: value for key, value in leaf.items() if key != "seq"}
+            for leaf in leaves
+        },
+    }
+
+
+def cached_collapsed_tree(
+    cache: AlignmentCache, key: str, result: dict, chain: str, method: str, mode: str
+) -> dict:
+    """Return the collapsed tree of a chain, built once per alignment content key."""
+    return cached_artifact(
+        cache,
+        key,
+        f"{chain}_{method}_{mode}_tree",
+        "tree",
+        lambda: build_collapsed_tree(result, chain, method, mode),
+    )
@@ -0,0 +1,52 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class BoundedLRU:
+    """Thread-safe mapping that drops its least recently used entries beyond `max_entries`."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def project_version(project_dir: str) -> Optional[str]:
+    """
+    Return a version of a project's merged dataset: its path and modification time.
+
+    The merged pickle is rewritten whenever the dataset changes (e.g. when
+    older projects are annotated on load). None when there is no pickle.
+    """
+    merged_path = os.path.join(project_dir, "merged_data.pkl")
+    try:
+        return f"{os.path.abspath(merged_path)}:{os.stat(merged_path).st_mtime_ns}"
+    except FileNotFoundError:
+        return None
+
+
+def versioned_key(kind: str, version: str, *parts) -> str:
+    """Return the cache-store key of a `kind` result for a project version and query."""
+    material = json.dumps([version, *parts], sort_keys=True, default=str).encode("utf-8")
+    return f"{kind}:{hashlib.sha256(material).hexdigest()}"
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+import pandas as pd
+
+from app.core.config import get_settings
+from app.services.alignment_cache import project_cache
+from app.services.alignments import cached_alignment
+from app.services.ddl import load_project
+from app.services.distances import (
+    cached_matrix_clustering,
+    cached_mismatch_matrix,
+    matrix_sequences,
+)
+from app.services.trees import cached_tree
+from app.services.versioning import project_version
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Number of interactive alignment computations in progress; warm-up work waits
+# for it to drop to zero before starting the next pair.
+_interactive = 0
+_interactive_lock = threading.Lock()
+
+_executor: Optional[ThreadPoolExecutor] = None
+_jobs: Dict[str, "WarmupJob"] = {}
+
+
+@contextmanager
+def interactive_request():
+    """Mark an interactive computation so that background warm-up yields to it."""
+    global _interactive
+    with _interactive_lock:
+        _interactive += 1
+    try:
+        yield
+    finally:
+        with _interactive_lock:
+            _interactive -= 1
+
+
+def top_pairs(merged_df: pd.DataFrame, n: int) -> list:
+    """Return the `n` most populated (HC V gene, LC V gene) pairs by cell count."""
+    pairs = merged_df[["v_call_VDJ", "v_call_VJ"]].dropna()
+    # Cells without a call on either chain carry the string "None"
+    pairs = pairs[(pairs != "None").all(axis=1)]
+    counts = pairs.groupby(["v_call_VDJ", "v_call_VJ"]).size()
+    return [pair for pair, _ in counts.sort_values(ascending=False).head(n).items()]
+
+
+class WarmupJob:
+    """Background precomputation of the most populated gene pairs of a project."""
+
+    def __init__(self, project_name: str, species: str):
+        self.project_name = project_name
+        self.species = species
+        self.status = "queued"
+        self.pairs: list = []
+        self.done = 0
+        self.failed = 0
+        self.cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        if self.status in ("queued", "running"):
+            self.status = "cancelled"
+
+    def yield_to_interactive(self) -> bool:
+        """Wait while interactive requests run; return False once cancelled."""
+        while _interactive > 0 and not self.cancelled.is_set():
+            self.cancelled.wait(0.5)
+        return not self.cancelled.is_set()
+
+    def wait_for_idle(self) -> bool:
+        """Yield to interactive requests, then pause; return False once cancelled."""
+        if not self.yield_to_interactive():
+            return False
+        return not self.cancelled.wait(settings.alignment_warmup_pause)
+
+    def to_dict(self) -> dict:
+        return {
+            "project": self.project_name,
+            "status": self.status,
+            "pairs": [list(pair) for pair in self.pairs],
+            "done": self.done,
+            "failed": self.failed,
+        }
+
+    def run(self, project: dict) -> None:
+        if self.cancelled.is_set():
+            return
+        self.status = "running"
+        try:
+            _, _, merged_df = asyncio.run(load_project(project))
+            version = project_version(os.path.dirname(project["vdj_path"]))
+            self.pairs = top_pairs(merged_df, settings.alignment_warmup_pairs)
+            cache = project_cache(self.project_name)
+            for hc_gene, lc_gene in self.pairs:
+                if not self.wait_for_idle():
+                    return
+                try:
+                    completed = warm_pair(
+                        cache,
+                        merged_df,
+                        hc_gene,
+                        lc_gene,
+                        self.species,
+                        version,
+                        proceed=self.yield_to_interactive,
+                    )
+                    if not completed:
+                        return
+                    self.done += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.warning(
+                        "Warm-up of %s/%s in %s failed: %s",
+                        hc_gene,
+                        lc_gene,
+                        self.project_name,
+                        e,
+                    )
+        except Exception as e:
+            self.status = "error"
+            logger.warning("Warm-up of %s failed: %s", self.project_name, e)
+            return
+        if not self.cancelled.is_set():
+            self.status = "done"
+
+
+def warm_pair(
+    cache,
+    merged_df: pd.DataFrame,
+    hc_gene: str,
+    lc_gene: str,
+    species: str,
+    version: Optional[str] = None,
+    proceed: Callable[[], bool] = lambda: True,
+) -> bool:
+    """
+    Compute and cache everything the detail page of a gene pair needs.
+
+    Args:
+        proceed: called before each artifact; returning False stops the pair
+            so cancellation and interactive requests do not wait for all of it
+
+    Returns:
+        True when every artifact was computed
+    """
+    key, result = cached_alignment(cache, merged_df, hc_gene, lc_gene, species, version)
+    for chain in ("hc", "lc"):
+        if not proceed():
+            return False
+        cached_tree(cache, key, result, chain)
+        seqs = [seq for _, seq in matrix_sequences(result, chain)]
+        if len(seqs) >= 2:
+            if not proceed():
+                return False
+            matrix = cached_mismatch_matrix(cache, key, chain, seqs)
+            if not proceed():
+                return False
+            cached_matrix_clustering(cache, key, chain, matrix)
+    return True
+
+
+def _lower_priority() -> None:
+    # Linux niceness is per thread and inherited by the MUSCLE subprocesses
+    try:
+        os.setpriority(
+            os.PRIO_PROCESS, threading.get_native_id(), settings.alignment_warmup_nice
+        )
+    except (AttributeError, OSError):
+        pass
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.alignment_warmup_workers,
+            thread_name_prefix="alignment-warmup",
+            initializer=_lower_priority,
+        )
+    return _executor
+
+
+def start_warmup(project_name: str, species: str, vdj_path: str) -> Optional[WarmupJob]:
+    """
+    Queue the warm-up of a newly ingested project.
+
+    Any previous warm-up of the project is cancelled. Returns None when warm-up
+    is disabled (`alignment_warmup_pairs` is 0).
+    """
+    cancel_warmup(project_name)
+    if settings.alignment_warmup_pairs <= 0:
+        return None
+    job = WarmupJob(project_name, species)
+    _jobs[project_name] = job
+    # Only the merged VDJ table is needed, so the AnnData file is never read
+    project = {
+        "vdj_path": vdj_path,
+        "adata_path": "NULL",
+        "project_name": project_name,
+        "species": species,
+    }
+    _get_executor().submit(job.run, project)
+    return job
+
+
+def cancel_warmup(project_name: str) -> None:
+    """Cancel the warm-up of a project; the artifact being computed is finished first."""
+    job = _jobs.get(project_name)
+    if job is not None:
+        job.cancel()
+
+
+def warmup_status(project_name: str) -> dict:
+    job = _jobs.get(project_name)
+    if job is None:
+        return {"project": project_name, "status": "not_started"}
+    return job.to_dict()
@@ -1,8 +1,35 @@
-// /static/js/distance-matrix-canvas.js – v3.1
+// /static/js/distance-matrix-canvas.js – v3.2
 // ----------------------------------------------------------------------------
 // Enhanced amino-acid identity matrix viewer with improved performance and UX
 // ----------------------------------------------------------------------------
 
+// Decode a packed matrix response (format=uint8 or float16 of the
+// distance_matrix endpoint): "<4sBI" prefix (magic, version, header length),
+// JSON header, row-major values. Returns { labels, matrix } with one
+// Float32Array of percent mismatch per row, as update() expects.
+function parsePackedMatrix(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== "BCRM") throw new Error("Not a packed matrix response");
+    const headerLength = view.getUint32(5, true);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 9, headerLength)));
+    const [rows, cols] = header.shape;
+    const offset = 9 + headerLength;
+
+    let values;
+    if (header.dtype === "uint8") {
+        const raw = new Uint8Array(buffer, offset, rows * cols);
+        values = new Float32Array(rows * cols);
+        // uint8 carries percent identity in steps of `scale`
+        for (let i = 0; i < raw.length; ++i) values[i] = 100 - raw[i] * header.scale;
+    } else {
+        throw new Error(`Unsupported matrix dtype ${header.dtype}`);
+    }
+    const matrix = [];
+    for (let r = 0; r < rows; ++r) matrix.push(values.subarray(r * cols, (r + 1) * cols));
+    return { labels: header.labels, matrix };
+}
+
 class DistanceMatrixCanvas {
     constructor(containerId, opts = {}) {
         this.container = document.getElementById(containerId);
@@ -24,6 +24,33 @@ function parseFASTA(txt) {
   return records;
 }
 
+// --------------------------------------------------
+// Compact alignment payload → array<{name, seq}>
+// --------------------------------------------------
+function alignmentRowsFromCompact(data, chain) {
+  const ids = data[`${chain}_ids`] || [];
+  const seqs = data[`${chain}_seqs`] || [];
+  const labels = data[`${chain}_label_map`] || {};
+  const germline = data[`${chain}_germline`];
+  const consensus = data[`${chain}_consensus`];
+  const blocks = data[`${chain}_region_blocks`] || [];
+  const rows = [];
+  if (germline) {
+    // Legacy Region row: one label per germline residue, clamped like region_array_from_blocks
+    if (blocks.length) {
+      const regions = new Array(germline.length).fill('UNK');
+      blocks.forEach(([region, start, end]) => {
+        for (let i = Math.max(start - 1, 0); i < Math.min(end, germline.length); i++) regions[i] = region;
+      });
+      rows.push({ name: 'Region', seq: regions.join('') });
+    }
+    rows.push({ name: 'Germline', seq: germline });
+  }
+  ids.forEach((id, i) => rows.push({ name: labels[id] ?? id, seq: seqs[i] }));
+  if (consensus) rows.push({ name: 'Consensus', seq: consensus });
+  return rows;
+}
+
 class MSAViewer {
   constructor(containerId, sequences, regionBlocks = null) {
     this.container = document.getElementById(containerId);
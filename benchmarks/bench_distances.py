@@ -0,0 +1,88 @@
+"""
+Benchmark the vectorized distance engine against Bio.Phylo's DistanceCalculator.
+
+Usage: python -m benchmarks.bench_distances [--sizes 500 2000 10000] [--width 130]
+
+DistanceCalculator is only timed up to --reference-limit sequences (it is
+quadratic in pure Python). Larger sizes are checked against it on
+--check-rows sequences sampled across the whole alignment, which covers pairs
+from different tiles. Peak memory is traced while the vectorized matrix is
+built (the (n, n) float64 output included).
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+from Bio.Align import MultipleSeqAlignment
+from Bio.Phylo.TreeConstruction import DistanceCalculator
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from app.services.distances import distance_matrix_of
+
+RESIDUES = np.array(list("ACDEFGHIKLMNPQRSTVWY-"))
+
+
+def simulated_alignment(n_rows: int, width: int, seed: int = 0) -> list:
+    """Aligned sequences drawn from a few ancestors with point mutations and gaps."""
+    rng = np.random.default_rng(seed)
+    ancestors = rng.choice(RESIDUES, size=(8, width))
+    rows = ancestors[rng.integers(0, len(ancestors), n_rows)].copy()
+    mutate = rng.random(rows.shape) < 0.08
+    rows[mutate] = rng.choice(RESIDUES, size=mutate.sum())
+    return ["".join(row) for row in rows]
+
+
+def reference_matrix(seqs: list, model: str) -> np.ndarray:
+    """Square DistanceCalculator matrix of aligned sequences."""
+    msa = MultipleSeqAlignment([SeqRecord(Seq(seq), id=f"s{i}") for i, seq in enumerate(seqs)])
+    dm = DistanceCalculator(model).get_distance(msa)
+    ref = np.array([row + [0.0] * (len(seqs) - len(row)) for row in dm.matrix])
+    return ref + np.tril(ref, -1).T
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 10000])
+    parser.add_argument("--width", type=int, default=130)
+    parser.add_argument("--model", default="blosum62")
+    parser.add_argument("--reference-limit", type=int, default=500)
+    parser.add_argument("--check-rows", type=int, default=300)
+    args = parser.parse_args()
+
+    print(
+        f"{'n':>7} {'vectorized s':>13} {'peak MB':>8} {'Bio.Phylo s':>12} "
+        f"{'checked':>8} {'max |diff|':>11}"
+    )
+    rng = np.random.default_rng(1)
+    for n in args.sizes:
+        seqs = simulated_alignment(n, args.width)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        fast = distance_matrix_of(seqs, args.model)
+        fast_time = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+        ref_time = float("nan")
+        if n <= args.reference_limit:
+            rows = np.arange(n)
+            start = time.perf_counter()
+            ref = reference_matrix(seqs, args.model)
+            ref_time = time.perf_counter() - start
+        else:
+            rows = np.sort(rng.choice(n, size=min(n, args.check_rows), replace=False))
+            ref = reference_matrix([seqs[i] for i in rows], args.model)
+        diff = float(np.abs(ref - fast[np.ix_(rows, rows)]).max())
+
+        print(
+            f"{n:>7} {fast_time:>13.2f} {peak:>8.0f} {ref_time:>12.2f} "
+            f"{len(rows):>8} {diff:>11.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from app.services import aggregation
+from app.services.aggregation import aggregate, cached_aggregate
+from app.services.versioning import BoundedLRU
+
+
+def _merged() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "isotype": ["IgG", "IgM", "IgG", "IgG", None, "IgM"],
+            "locus_VJ": ["IGK", "IGK", "IGL", "IGK", "IGK", "IGK"],
+            "clone_id": ["c1", "c2", "c1", "c3", "c1", "c2"],
+            "mu_freq_VDJ": [0.1, 0.0, np.nan, 0.3, 0.2, 0.05],
+        }
+    )
+
+
+def test_aggregate_matches_groupby():
+    merged_df = _merged()
+    counts = aggregate(merged_df, ["isotype", "locus_VJ"])
+    assert counts["rows"] == [
+        {"isotype": "IgG", "locus_VJ": "IGK", "count": 2},
+        {"isotype": "IgM", "locus_VJ": "IGK", "count": 2},
+        {"isotype": "IgG", "locus_VJ": "IGL", "count": 1},
+    ]
+
+    unique = aggregate(merged_df, ["isotype"], "unique", "clone_id", filters={"locus_VJ": "IGK"})
+    assert unique["rows"] == [{"isotype": "IgG", "unique": 2}, {"isotype": "IgM", "unique": 1}]
+
+    means = aggregate(merged_df, ["isotype"], "mean", "mu_freq_VDJ", limit=1)
+    assert means["groups"] == 2
+    assert means["rows"] == [{"isotype": "IgG", "mean": 0.2}]
+
+
+def test_cached_aggregate_lru(monkeypatch):
+    monkeypatch.setattr(aggregation, "_results", BoundedLRU(2))
+    merged_df = _merged()
+    first = cached_aggregate(merged_df, "v1", ["isotype"])
+    # Same version and query: served from the cache even if the frame changed
+    assert cached_aggregate(merged_df.iloc[:1], "v1", ["isotype"]) is first
+    assert cached_aggregate(merged_df.iloc[:1], "v2", ["isotype"])["groups"] == 1
+
+    cached_aggregate(merged_df, "v3", ["isotype"])
+    assert len(aggregation._results) == 2
+    assert aggregation._results.get(("v1", ("isotype",), "count", None, (), None)) is None
@@ -0,0 +1,144 @@
+from app.services.alignment_cache import (
+    AlignmentCache,
+    alignment_summary,
+    artifact_key,
+    read_alignment,
+    read_metadata,
+    read_window,
+    store_alignment,
+)
+from app.services.alignment_codec import COMPACT_FORMAT
+
+
+def make_result():
+    hc_seqs = ["ACDEFGHIK", "ACDEYGHIK", "A-DEFGHIK"]
+    lc_seqs = ["MNPQ", "MNPR"]
+    return {
+        "format": COMPACT_FORMAT,
+        "version": 1,
+        "hc_table": [],
+        "hc_ids": ["s1", "s2", "s3"],
+        "hc_seqs": hc_seqs,
+        "hc_consensus": "ACDEFGHIK",
+        "hc_label_map": {"s1": "P-001-HC", "s2": "P-002-HC", "s3": "P-003-HC"},
+        "hc_germline": "ACDEFGHIK",
+        "hc_region_blocks": [["HFR1", 1, 9]],
+        "lc_table": [],
+        "lc_ids": ["s1", "s2"],
+        "lc_seqs": lc_seqs,
+        "lc_consensus": "MNPQ",
+        "lc_label_map": {"s1": "P-001-LC", "s2": "P-002-LC"},
+        "lc_germline": None,
+        "lc_region_blocks": None,
+    }
+
+
+def make_cache(tmp_path, name="P", **budgets):
+    budgets.setdefault("max_bytes", 1 << 20)
+    budgets.setdefault("total_bytes", 1 << 20)
+    (tmp_path / name).mkdir(exist_ok=True)
+    return AlignmentCache(str(tmp_path / name / "alignment_cache.sqlite"), **budgets)
+
+
+def test_round_trip(tmp_path):
+    cache = make_cache(tmp_path)
+    result = make_result()
+    assert read_alignment(cache, "k1") is None
+    store_alignment(cache, "k1", result)
+    assert read_alignment(cache, "k1") == result
+
+    stats = cache.stats()["kinds"]["alignment"]
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_window_is_clamped(tmp_path):
+    cache = make_cache(tmp_path)
+    store_alignment(cache, "k1", make_result())
+
+    window = read_window(cache, "k1", "hc", 1, 10, 3, 6)
+    assert window["row_start"] == 1 and window["row_end"] == 3
+    assert [row["seq"] for row in window["rows"]] == ["EYG", "EFG"]
+    assert [row["name"] for row in window["rows"]] == ["P-002-HC", "P-003-HC"]
+
+    empty = read_window(cache, "k1", "lc", 5, 10, 0, 4)
+    assert empty["rows"] == []
+    assert read_window(cache, "missing", "hc", 0, 1, 0, 1) is None
+
+
+def test_summary_from_metadata(tmp_path):
+    cache = make_cache(tmp_path)
+    result = make_result()
+    store_alignment(cache, "k1", result)
+    summary = alignment_summary(read_metadata(cache, "k1"), "hc")
+    assert summary == alignment_summary(result, "hc")
+    assert (summary["rows"], summary["cols"]) == (3, 9)
+
+
+def test_lru_eviction_removes_dependents(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=3000)
+    cache.put("a", b"x" * 1000)
+    cache.put(artifact_key("a", "tree"), b"y" * 500, "tree", root="a")
+    cache.put("b", b"x" * 1000)
+    assert cache.get("a") is not None  # "a" is now more recent than "b"
+
+    cache.put("c", b"x" * 1000)
+    assert cache.get("b") is None
+
+    cache.put("d", b"x" * 1000)
+    assert cache.get("a") is None
+    assert cache.get(artifact_key("a", "tree"), "tree") is None
+    assert cache.stats()["kinds"]["tree"]["evictions"] == 1
+
+
+def test_total_budget_spans_projects(tmp_path):
+    first = make_cache(tmp_path, "P1", total_bytes=1500)
+    second = make_cache(tmp_path, "P2", total_bytes=1500)
+    first.put("a", b"x" * 1000)
+    second.put("b", b"x" * 1000)
+    assert first.get("a") is None
+    assert second.get("b") is not None
+
+
+def test_total_budget_is_tracked_without_rescanning(tmp_path, monkeypatch):
+    from app.services import alignment_cache
+
+    scans = []
+    enforce = alignment_cache.enforce_total_budget
+    monkeypatch.setattr(
+        alignment_cache,
+        "enforce_total_budget",
+        lambda *args: scans.append(args) or enforce(*args),
+    )
+    first = make_cache(tmp_path, "P1", total_bytes=2500)
+    second = make_cache(tmp_path, "P2", total_bytes=2500)
+    first.put("a", b"x" * 1000)
+    first.put("a", b"x" * 1000)
+    second.put("b", b"x" * 1000)
+    assert len(scans) == 1
+    second.put("c", b"x" * 1000)
+    assert len(scans) == 2 and first.get("a") is None
+
+
+def test_store_never_creates_the_project_folder(tmp_path):
+    cache = AlignmentCache(str(tmp_path / "deleted" / "alignment_cache.sqlite"))
+    cache.put("a", b"x")
+    assert cache.get("a") is None and cache.size() == 0
+    assert not (tmp_path / "deleted").exists()
+
+
+def test_alignment_key_is_memoized_per_version(monkeypatch):
+    from app.services import alignments
+
+    calls = []
+
+    def inputs(merged_df, hc_gene, lc_gene):
+        calls.append((hc_gene, lc_gene))
+        return {"hc_seqs": ["ACD"], "lc_seqs": ["MNP"]}
+
+    monkeypatch.setattr(alignments, "alignment_inputs", inputs)
+    key, collected = alignments.alignment_key(None, "H1", "K1", "human", "v1")
+    assert collected is not None
+    assert alignments.alignment_key(None, "H1", "K1", "human", "v1") == (key, None)
+    alignments.alignment_key(None, "H1", "K1", "human", "v2")
+    alignments.alignment_key(None, "H1", "K1", "human")
+    assert len(calls) == 3
@@ -0,0 +1,93 @@
+import json
+
+import numpy as np
+
+from app.services.alignment_codec import (
+    compact_from_legacy,
+    compact_response,
+    expand_to_legacy,
+    match_mask,
+    pack_binary,
+    pack_mask,
+    region_array_from_blocks,
+    unpack_binary,
+    unpack_mask,
+)
+
+
+def make_legacy_result(n_rows=40, width=30):
+    """Build a legacy alignment result the way the old endpoint cached it."""
+    rng = np.random.default_rng(0)
+    alphabet = np.array(list("ACDEFGHIKLMNPQRSTVWY-"))
+    seqs = ["".join(rng.choice(alphabet, width)) for _ in range(n_rows)]
+    ids = [f"seq{i}" for i in range(n_rows)]
+    consensus = seqs[0]
+    germline = seqs[1].replace("-", "A")
+    blocks = [["HFR1", 1, 10], ["CDR-H1", 11, 15], ["HFR2", 16, width]]
+    region = "".join(["HFR1"] * 10 + ["CDR-H1"] * 5 + ["HFR2"] * (width - 15))
+
+    result = {}
+    for chain, suffix in (("hc", "HC"), ("lc", "LC")):
+        label_map = {orig_id: f"{orig_id}-{suffix}" for orig_id in ids}
+        rows = [{"name": "Region", "seq": region}, {"name": "Germline", "seq": germline}]
+        rows += [{"name": label_map[i], "seq": s} for i, s in zip(ids, seqs)]
+        rows.append({"name": "Consensus", "seq": consensus})
+        result.update(
+            {
+                f"{chain}_table": [{"sequence_id": i} for i in ids],
+                f"{chain}_alignment": [[i, s] for i, s in zip(ids, seqs)],
+                f"{chain}_consensus": consensus,
+                f"{chain}_match_matrix": [
+                    [s[pos] == c for s in seqs] for pos, c in enumerate(consensus)
+                ],
+                f"{chain}_json": rows,
+                f"{chain}_label_map": label_map,
+                f"{chain}_region_blocks": blocks,
+            }
+        )
+    return result
+
+
+def test_legacy_round_trip():
+    legacy = make_legacy_result()
+    compact = compact_from_legacy(legacy)
+    expanded = expand_to_legacy(compact)
+    for key, value in legacy.items():
+        assert expanded[key] == value, key
+
+
+def test_compact_payload_is_smaller():
+    legacy = make_legacy_result(n_rows=500, width=120)
+    compact = compact_from_legacy(legacy)
+    legacy_size = len(json.dumps(legacy))
+    assert len(json.dumps(compact_response(compact))) * 3 < legacy_size
+    assert len(pack_binary(compact)) * 4 < legacy_size
+
+
+def test_mask_packing():
+    seqs = ["ACD-", "ACE-", "GCD-"]
+    mask = match_mask(seqs, "ACD-")
+    assert mask.tolist() == [
+        [True, True, True, True],
+        [True, True, False, True],
+        [False, True, True, True],
+    ]
+    assert np.array_equal(unpack_mask(pack_mask(mask)), mask)
+
+
+def test_region_blocks_are_clamped_to_the_alignment():
+    blocks = [["fr1", 0, 2], ["cdr1", 3, 4], ["fr2", 5, 9]]
+    assert region_array_from_blocks(blocks, 6) == ["fr1", "fr1", "cdr1", "cdr1", "fr2", "fr2"]
+    assert region_array_from_blocks([], 6) is None
+
+
+def test_binary_round_trip():
+    compact = compact_from_legacy(make_legacy_result())
+    decoded = unpack_binary(pack_binary(compact))
+    for chain in ("hc", "lc"):
+        assert decoded[f"{chain}_seqs"] == compact[f"{chain}_seqs"]
+        assert decoded[f"{chain}_ids"] == compact[f"{chain}_ids"]
+        assert np.array_equal(
+            decoded[f"{chain}_match_mask"],
+            match_mask(compact[f"{chain}_seqs"], compact[f"{chain}_consensus"]),
+        )
@@ -0,0 +1,45 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from app.services.cdr3 import cdr3_sequences, close_pairs, hamming_clusters, spectratype
+
+
+def test_close_pairs_matches_all_pairs():
+    rng = np.random.default_rng(0)
+    codes = rng.integers(65, 69, size=(80, 9)).astype(np.uint8)
+    left, right = close_pairs(codes, 3)
+    found = {tuple(sorted(pair)) for pair in zip(left.tolist(), right.tolist())}
+
+    expected = {
+        (i, j)
+        for i, j in itertools.combinations(range(len(codes)), 2)
+        if (codes[i] != codes[j]).sum() <= 3
+    }
+    assert found == expected
+
+
+def test_hamming_clusters_by_length_and_threshold():
+    cdr3s = ["ARDYW", "ARDYF", "ARGGF", "ARDYW", "ARDYWA", "QQYNS"]
+    # One mismatch allowed at length 5; ARGGF is two away from ARDYF
+    clusters = hamming_clusters(cdr3s, 0.2)
+    assert clusters[0] == clusters[1] == clusters[3] == 0
+    assert len(set(clusters[[2, 4, 5]])) == 3 and 0 not in clusters[[2, 4, 5]]
+
+    # Identical CDR3s always share a cluster
+    exact = hamming_clusters(cdr3s, 0.0)
+    assert exact[0] == exact[3] and len(set(exact.tolist())) == 5
+
+
+def test_cdr3_sequences_and_spectratype():
+    merged_df = pd.DataFrame(
+        {
+            "sequence_id": ["a", "b", "c"],
+            "junction_aa_VDJ": ["CARDYW", "None", "CARDYW"],
+        }
+    )
+    ids, cdr3s = cdr3_sequences(merged_df, "hc")
+    assert ids == ["a", "c"] and cdr3s == ["ARDY", "ARDY"]
+    assert cdr3_sequences(merged_df, "lc") == ([], [])
+    assert spectratype(cdr3s) == {"length": [4], "count": [2], "unique": [1]}
@@ -0,0 +1,47 @@
+import numpy as np
+
+from app.services.clustering import cluster_membership, greedy_cluster, imgt_anchored
+
+
+def test_greedy_clusters_families():
+    seqs = ["ACDEFGHIKL", "ACDEFGHIKM", "ACDEFGHIKL", "WWWWWWWWWW", "WWWWWWWWWY"]
+    reps, assignment = greedy_cluster(seqs, identity=0.8)
+    assert len(reps) == 2
+    assert assignment[0] == assignment[1] == assignment[2]
+    assert assignment[3] == assignment[4] != assignment[0]
+    # Every representative is a member of its own cluster
+    assert all(assignment[rep] == i for i, rep in enumerate(reps))
+
+
+def test_identity_ignores_gaps_and_uses_shorter_length():
+    reps, assignment = greedy_cluster(["ACDEFGHIKL", "ACDEF-----"], identity=1.0)
+    assert len(reps) == 1 and reps == [0]
+
+
+def test_representative_cap_assigns_everything():
+    rng = np.random.default_rng(0)
+    alphabet = np.array(list("ACDEFGHIKLMNPQRSTVWY"))
+    seqs = ["".join(row) for row in rng.choice(alphabet, size=(300, 20))]
+    reps, assignment = greedy_cluster(seqs, identity=0.9, max_clusters=25)
+    assert len(reps) == 25
+    assert assignment.min() == 0 and assignment.max() == 24
+
+    ids = [f"s{i}" for i in range(len(seqs))]
+    clusters = cluster_membership(ids, reps, assignment, 0.9)
+    assert sum(clusters["sizes"].values()) == len(seqs)
+    assert set(clusters["members"]) == {ids[rep] for rep in reps}
+
+
+def test_imgt_anchored_keeps_frameworks_in_register():
+    v_region = "CAG" * 104
+    # Same V region, one with an IMGT gap at codon 10, CDR3 of 5 and 7 codons
+    deleted = "CAG" * 9 + "..." + "CAG" * 94 + "GCC" * 5 + "TGGGGC" * 2
+    longer = v_region + "GCC" * 7 + "TGGGGC" * 2
+    anchored = imgt_anchored([deleted, longer])
+    assert len(anchored[0]) == len(anchored[1]) == 104 + 11
+    assert anchored[0][9] == "-" and anchored[0][10] == anchored[1][10] == "Q"
+    assert anchored[0][-4:] == anchored[1][-4:] == "WGWG"
+
+    # The anchored translations differ only by the CDR3 insertion
+    reps, _ = greedy_cluster(anchored, identity=0.9)
+    assert len(reps) == 1
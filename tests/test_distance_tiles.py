@@ -0,0 +1,52 @@
+import struct
+
+import numpy as np
+
+from app.services import distance_tiles
+from app.services.alignment_cache import AlignmentCache
+
+
+def make_seqs(n, width=12, seed=0):
+    rng = np.random.default_rng(seed)
+    return ["".join(rng.choice(list("ACDE-"), width)) for _ in range(n)]
+
+
+def test_tiles_cover_the_matrix_and_pool_overviews(tmp_path):
+    (tmp_path / "p").mkdir()
+    cache = AlignmentCache(str(tmp_path / "p" / "cache.sqlite"))
+    seqs = make_seqs(10)
+    full = distance_tiles.cached_mismatch_matrix(cache, "k", "hc", seqs)
+
+    assert distance_tiles.tile_levels(10, 4) == 2
+    overview, (r0, r1, c0, c1, factor) = distance_tiles.matrix_tile(
+        cache, "k", "hc", seqs, 4, 0, 0, 0
+    )
+    assert (r0, r1, c0, c1, factor) == (0, 10, 0, 10, 3)
+    assert overview.shape == (4, 4)
+    assert np.isclose(overview[0, 0], full[:3, :3].mean())
+    assert np.isclose(overview[3, 3], full[9:, 9:].mean())
+
+    detail, bounds = distance_tiles.matrix_tile(cache, "k", "hc", seqs, 4, 2, 1, 2)
+    assert bounds == (3, 6, 6, 9, 1)
+    assert np.array_equal(detail, full[3:6, 6:9])
+
+
+def test_tiles_past_the_matrix_are_rejected():
+    # n=9 at level 4 spans one row per tile, so rows 9..15 start past the end
+    assert distance_tiles.tile_bounds(9, 1, 4, 15, 15)[0] >= 9
+    assert not distance_tiles.tile_in_matrix(9, 1, 4, 15, 15)
+    assert not distance_tiles.tile_in_matrix(9, 1, 4, 0, 9)
+    assert distance_tiles.tile_in_matrix(9, 1, 4, 8, 8)
+    assert not distance_tiles.tile_in_matrix(9, 1, 5, 0, 0)
+    assert not distance_tiles.tile_in_matrix(9, 4, 1, 2, 0)
+
+
+def test_packed_uint8_matrix_is_percent_identity():
+    values = np.array([[0.0, 50.0], [50.0, 100.0]])
+    body, encoding = distance_tiles.encode_values(values, "uint8")
+    payload = distance_tiles.pack_matrix({"shape": [2, 2], **encoding}, body)
+    magic, _, header_length = struct.unpack_from("<4sBI", payload)
+    assert magic == distance_tiles.MATRIX_MAGIC
+    decoded = np.frombuffer(payload[9 + header_length :], dtype=np.uint8)
+    assert decoded.tolist() == [255, 127, 127, 0]
+    assert np.allclose(decoded * encoding["scale"], 100 - values.ravel(), atol=0.2)
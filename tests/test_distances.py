@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from Bio.Align import MultipleSeqAlignment
+from Bio.Phylo.TreeConstruction import DistanceCalculator
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from app.services import distances
+from app.services.distances import (
+    distance_matrix_of,
+    matrix_clustering,
+    mismatch_percentages,
+)
+
+
+def reference(seqs, model):
+    msa = MultipleSeqAlignment(
+        [SeqRecord(Seq(seq), id=f"s{i}") for i, seq in enumerate(seqs)]
+    )
+    dm = DistanceCalculator(model).get_distance(msa)
+    return np.array([[dm[i, j] for j in range(len(seqs))] for i in range(len(seqs))])
+
+
+@pytest.mark.parametrize("model", ["blosum62", "identity"])
+def test_matches_distance_calculator(model):
+    rng = np.random.default_rng(0)
+    rows = rng.choice(np.array(list("ACDEFGHIKLMNPQRSTVWYBZX*-")), size=(40, 30))
+    rows[3, :] = "-"  # no comparable positions: distance 1
+    seqs = ["".join(row) for row in rows]
+    assert np.array_equal(distance_matrix_of(seqs, model), reference(seqs, model))
+
+
+def test_small_tiles_give_the_same_matrices(monkeypatch):
+    rng = np.random.default_rng(1)
+    seqs = ["".join(row) for row in rng.choice(np.array(list("ACDEF-")), size=(23, 12))]
+    full = (distance_matrix_of(seqs), mismatch_percentages(seqs))
+    # Tiles of 5 x 5 rows: uneven edges and off-diagonal tiles on both sides
+    monkeypatch.setattr(distances, "_tile_size", lambda n_features: 5)
+    assert np.array_equal(distance_matrix_of(seqs), full[0])
+    assert np.array_equal(mismatch_percentages(seqs), full[1])
+
+
+def test_unknown_letter_is_rejected():
+    with pytest.raises(ValueError):
+        distance_matrix_of(["ACJ", "ACD"], "blosum62")
+
+
+def test_mismatch_percentages_match_pairwise_loop():
+    rng = np.random.default_rng(3)
+    letters = np.array(list("ACDEF-"))
+    seqs = ["".join(rng.choice(letters, 40)) for _ in range(30)] + ["-" * 40, "ACd.X"]
+
+    def reference(seq1, seq2):
+        mismatches = sum(1 for a, b in zip(seq1, seq2) if a != b and a != "-" and b != "-")
+        total = sum(1 for a, b in zip(seq1, seq2) if a != "-" and b != "-")
+        return (mismatches / total) * 100 if total > 0 else 0
+
+    matrix = mismatch_percentages(seqs)
+    expected = np.array([[reference(a, b) for b in seqs] for a in seqs])
+    np.fill_diagonal(expected, 0)
+    assert np.array_equal(matrix, expected)
+
+
+def test_matrix_clustering_groups_similar_rows():
+    points = np.array([0.0, 10.0, 0.5, 10.5, 1.0])
+    matrix = np.abs(points[:, None] - points[None, :])
+    clustering = matrix_clustering(matrix)
+    order = clustering["order"]
+    assert sorted(order) == [0, 1, 2, 3, 4] and clustering["optimal"]
+    # The two far-away rows are adjacent in the order
+    assert abs(order.index(1) - order.index(3)) == 1
+    assert len(clustering["linkage"]) == len(clustering["positions"]) == 4
+    assert not matrix_clustering(matrix, optimal_limit=2)["optimal"]
@@ -0,0 +1,40 @@
+from app.services import germline_annotation
+from app.services.germline_annotation import GermlineIndex
+
+
+def write_reference(tmp_path):
+    fasta = tmp_path / "v.fasta"
+    fasta.write_text(
+        ">IGHV1-5*01\nQVQL\n>IGHV1-52*01\nEVK.L\n>IGHV1-52*02\nEVKV\n"
+        ">X12|IGHV2-1*01|Mus musculus\nDIQ-M\n"
+    )
+    csv = tmp_path / "hc.csv"
+    csv.write_text(
+        "sequence_id,HFR1,CDR-H1,HFR2,CDR-H2,HFR3,CDR-H3,HFR4\n"
+        "IGHV1-52*02,1 - 2,3 - 4,-,-,-,-,-\n"
+    )
+    return str(fasta), {"hc": str(csv)}
+
+
+def test_index_matches_alleles_exactly(tmp_path):
+    index = GermlineIndex(*write_reference(tmp_path))
+    assert index.sequence("IGHV1-52*02") == "EVKV"
+    # A bare gene resolves to its first allele, never to a longer gene name
+    assert index.sequence("IGHV1-52") == "EVKL"
+    assert index.sequence("IGHV1-5") == "QVQL"
+    assert index.sequence("IGHV1-52*01,IGHV1-5*01") == "EVKL"
+    assert index.sequence("IGHV2-1*01") == "DIQM"
+    assert index.sequence("IGHV9-9") is None
+
+
+def test_index_region_dicts_fall_back_to_other_alleles(tmp_path):
+    index = GermlineIndex(*write_reference(tmp_path))
+    assert index.region_dict("IGHV1-52*01", "hc") == {"HFR1": (1, 2), "CDR-H1": (3, 4)}
+    assert index.region_dict("IGHV1-5*01", "hc") is None
+    assert index.region_dict("IGHV1-52", "lc") is None
+
+
+def test_species_index_is_built_once():
+    assert germline_annotation.germline_index("mouse") is germline_annotation.germline_index(
+        "mouse"
+    )
@@ -0,0 +1,43 @@
+from app.services import germline_bundle
+from app.services.germline_bundle import GermlineBundle, build_bundle
+
+
+def write_references(root):
+    imgt = root / "imgt" / "mouse" / "vdj"
+    imgt.mkdir(parents=True)
+    # IMGT-gapped aa V allele: CDR1 is gapped columns 27-38
+    gapped = "A" * 26 + "CC..CCCCCCCC" + "F" * 17 + "D" * 10 + "G" * 39
+    (imgt / "imgt_aa_mouse_IGHV.fasta").write_text(
+        f">X1|IGHV1-1*01|Mus\n{gapped}\n>X2|IGHV1-1*02|Mus\nQVQL\n"
+    )
+    ogrdb = root / "ogrdb"
+    ogrdb.mkdir()
+    (ogrdb / "ogrdb_mouse_C57BL_6J_ig_v.fasta").write_text(">IGHV2-1*01\nCAGGTG\n")
+
+
+def test_bundle_round_trip_and_selection(tmp_path):
+    write_references(tmp_path / "refs")
+    output = str(tmp_path / "out" / "germlines.bundle")
+    manifest = build_bundle(output, roots=(str(tmp_path / "refs"),))
+    assert len(manifest["sources"]) == 2
+
+    bundle = GermlineBundle(output)
+    assert bundle.verify() and bundle.stale_sources() == []
+    (strain_ref,) = bundle.select(species="mouse", strain="C57BL_6J")
+    assert bundle.sequence(strain_ref, "IGHV2-1*01") == "CAGGTG"
+
+    (imgt_ref,) = bundle.select(reference_set="imgt", molecule="aa")
+    assert bundle.alleles(imgt_ref) == ["IGHV1-1*01", "IGHV1-1*02"]
+    assert bundle.sequence(imgt_ref, "IGHV1-1*02") == "QVQL"
+    assert bundle.gapped(imgt_ref, "IGHV1-1*01").count(".") == 2
+    regions = bundle.regions(imgt_ref, "IGHV1-1*01")
+    assert regions["HFR1"] == (1, 26) and regions["CDR-H1"] == (27, 36)
+
+
+def test_changed_sources_make_the_bundle_stale(tmp_path):
+    write_references(tmp_path / "refs")
+    output = str(tmp_path / "germlines.bundle")
+    build_bundle(output, roots=(str(tmp_path / "refs"),))
+    (tmp_path / "refs" / "ogrdb" / "ogrdb_mouse_C57BL_6J_ig_v.fasta").write_text(">IGHV2-1*01\nCAG\n")
+    assert len(GermlineBundle(output).stale_sources()) == 1
+    assert germline_bundle.load_bundle(output) is None
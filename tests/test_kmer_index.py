@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from app.services import kmer_index
+
+
+def _merged(heavy_aa: list, name: str) -> pd.DataFrame:
+    # Back-translate with one codon per residue, IMGT gaps included
+    codon = {
+        "Q": "CAG", "V": "GTG", "L": "CTG", "E": "GAG", "S": "TCT",
+        "G": "GGC", "A": "GCC", "W": "TGG", "Y": "TAC",
+    }
+    n = len(heavy_aa)
+    return pd.DataFrame(
+        {
+            "IGH": ["..." + "".join(codon[r] for r in aa) for aa in heavy_aa],
+            "IGK": [""] * n,
+            "locus_VJ": ["IGK"] * n,
+            "junction_aa_VDJ": ["CARGYW"] + ["None"] * (n - 1),
+            "sequence_id": [f"{name}-cell{i}" for i in range(n)],
+            "display_name": [f"{name}-{i + 1:03d}" for i in range(n)],
+            "clone_id": ["c1"] + [np.nan] * (n - 1),
+        }
+    )
+
+
+def test_sequence_kmers_stay_within_records():
+    residues = np.frombuffer(b"AAAACXAAC", dtype=np.uint8)
+    kmers, records = kmer_index.sequence_kmers(residues, np.array([0, 5, 9]))
+    decoded = {
+        ("".join(kmer_index.INDEX_ALPHABET[k // 20 ** (2 - i) % 20] for i in range(3)), r)
+        for k, r in zip(kmers.tolist(), records.tolist())
+    }
+    # No k-mer spans the record boundary or the X
+    assert decoded == {("AAA", 0), ("AAC", 0), ("AAC", 1)}
+
+
+def test_search_across_projects(tmp_path):
+    kmer_index.build_index(
+        str(tmp_path / "one"), "one", _merged(["QVQLVESGGA", "EVQLLESGGW"], "one")
+    )
+    kmer_index.build_index(str(tmp_path / "two"), "two", _merged(["QVQLVESGGW"], "two"))
+
+    result = kmer_index.search("QVQLVESGGA", upload_dir=str(tmp_path))
+    assert result["projects"] == ["one", "two"]
+    best, second = result["matches"][:2]
+    assert (best["project"], best["display_name"], best["identity"]) == ("one", "one-001", 1.0)
+    assert (second["project"], second["identity"]) == ("two", 0.9)
+    assert best["clone_id"] == "c1" and best["chain"] == "hc"
+
+    cdr3 = kmer_index.search("ARGY", region="cdr3", upload_dir=str(tmp_path))
+    assert [(m["display_name"], m["sequence"]) for m in cdr3["matches"]] == [
+        ("one-001", "ARGY"),
+        ("two-001", "ARGY"),
+    ]
+
+
+def test_index_is_rebuilt_when_the_merged_data_changes(tmp_path):
+    project_dir = str(tmp_path / "one")
+    merged = _merged(["QVQLVESGGA"], "one")
+    (tmp_path / "one").mkdir()
+    merged.to_pickle(tmp_path / "one" / "merged_data.pkl")
+
+    assert kmer_index.ensure_index(project_dir, "one", merged)["records"] > 0
+    assert kmer_index.ensure_index(project_dir, "one", merged) is None
+
+    merged = _merged(["QVQLVESGGA", "EVQLLESGGW"], "one")
+    merged.to_pickle(tmp_path / "one" / "merged_data.pkl")
+    os.utime(tmp_path / "one" / "merged_data.pkl", ns=(0, 1))
+    assert not kmer_index.index_is_current(project_dir)
+    kmer_index.ensure_index(project_dir, "one", merged)
+    assert kmer_index.index_is_current(project_dir)
+    assert len(kmer_index.load_index(project_dir).rows) > 1
@@ -0,0 +1,71 @@
+import pandas as pd
+
+from app.services import lineages
+from app.services.alignment_cache import AlignmentCache
+
+
+def test_clone_groups_keep_expanded_heavy_chain_clones():
+    df = pd.DataFrame(
+        {
+            "clone_id": ["c1", "c1", "c1", "c2", "c2", None, "c1"],
+            "sequence_id": list("abcdefg"),
+            "display_name": list("ABCDEFG"),
+            "v_call_VDJ": ["H1"] * 7,
+            "locus_VDJ": ["IGH"] * 6 + ["TRB"],
+            "IGH": ["ATG"] * 7,
+        }
+    )
+    groups = lineages.clone_groups(df, 3)
+    assert [clone for clone, _ in groups] == ["c1"]
+    assert [row["sequence_id"] for row in groups[0][1]] == ["a", "b", "c"]
+
+
+def test_lineage_key_follows_the_merged_data_version():
+    df = pd.DataFrame(
+        {
+            "clone_id": ["c1"] * 3,
+            "sequence_id": list("abc"),
+            "display_name": list("ABC"),
+            "v_call_VDJ": ["H1"] * 3,
+            "locus_VDJ": ["IGH"] * 3,
+            "IGH": ["ATG"] * 3,
+        }
+    )
+    key = lineages.lineage_key("P", "human", df, "v1")
+    assert lineages.lineage_key("P", "human", df.iloc[:0], "v1") == key
+    assert lineages.lineage_key("P", "human", df.iloc[:0], "v2") != key
+
+    lineages.forget_lineages("P")
+    assert "P" not in lineages._keys
+
+
+def test_build_lineage_is_rooted_at_the_germline(monkeypatch):
+    # Equal-length sequences stand in for the MUSCLE alignment
+    monkeypatch.setattr(
+        lineages,
+        "compute_alignment_and_consensus",
+        lambda seqs, ids: (list(zip(ids, seqs)), "", []),
+    )
+    task = {
+        "clone_id": "c1",
+        "v_gene": "H1",
+        "germline": "ACDEFGHIK",
+        "labels": ["A", "B", "C"],
+        "seqs": ["ACDEFGHIK", "ACDEFGHIR", "ACDWFGHIR"],
+    }
+    record = lineages.build_lineage(task)
+    assert record["rooted"] and record["size"] == 3
+    assert "Germline" in record["newick"] and "error" not in record
+
+
+def test_lineage_artifact_reads_single_clone(tmp_path):
+    (tmp_path / "p").mkdir()
+    cache = AlignmentCache(str(tmp_path / "p" / "cache.sqlite"))
+    records = [
+        {"clone_id": "c1", "newick": "(A,B);"},
+        {"clone_id": "c2", "newick": "(C,(D,E));"},
+    ]
+    lineages.store_lineages(cache, "k", records)
+    index = lineages.read_lineage_index(cache, "k")
+    assert lineages.read_lineage(cache, "k", index, "c2") == records[1]
+    assert lineages.read_lineage(cache, "k", index, "c3") is None
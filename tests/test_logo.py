@@ -0,0 +1,39 @@
+import numpy as np
+
+from app.services.bokeh_logo import (
+    NUCLEOTIDES,
+    encode_alignment,
+    information_content,
+    logo_figure,
+    position_frequency_matrix,
+)
+
+
+def test_position_frequency_matrix_skips_gaps():
+    codes = encode_alignment(["AC-T", "aCGT", "AGG"])
+    counts = position_frequency_matrix(codes, NUCLEOTIDES)
+    assert counts.tolist() == [
+        [3, 0, 0, 0],
+        [0, 2, 1, 0],
+        [0, 0, 2, 0],
+        [0, 0, 0, 2],
+    ]
+
+    ic = information_content(counts)
+    assert ic[0] == 2.0
+    assert np.isclose(ic[1], 2 - (-(2 / 3) * np.log2(2 / 3) - (1 / 3) * np.log2(1 / 3)))
+    # Scaled by occupancy: position 3 is covered by 2 of 3 sequences
+    assert np.isclose(information_content(counts, 3)[3], 2 * 2 / 3)
+
+
+def test_logo_figure_uses_one_renderer():
+    counts = position_frequency_matrix(encode_alignment(["ACGT", "ACGA", "TCGA"]), NUCLEOTIDES)
+    plot = logo_figure(counts, NUCLEOTIDES, color="nucleotide")
+
+    assert len(plot.renderers) == 1
+    data = plot.renderers[0].data_source.data
+    # Six non-zero residue blocks; the most frequent residue is at the bottom
+    assert len(data["x"]) == 6
+    first = [i for i, x in enumerate(data["x"]) if x == 0.5]
+    assert [data["residue"][i] for i in first] == ["A", "T"]
+    assert data["bottom"][first[0]] == 0
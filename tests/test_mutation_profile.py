@@ -0,0 +1,60 @@
+import pandas as pd
+
+from app.services import mutation_profile as profiles
+from app.services.alignment_cache import AlignmentCache
+from app.services.mutation_profile import alignment_columns, mutation_profile
+
+
+def _mutate(seq: str, position: int, base: str) -> str:
+    return seq[:position] + base + seq[position + 1 :]
+
+
+GERMLINE = "CAG" * 9 + "..." + "CAG" * 94
+
+
+def test_mutation_profile_positions_and_regions():
+    silent = _mutate(GERMLINE, 2, "A")  # codon 1: CAG -> CAA (Q)
+    replacement = _mutate(GERMLINE, 4, "T")  # codon 2: CAG -> CTG (Q -> L)
+    profile = mutation_profile([silent, replacement, GERMLINE, GERMLINE], GERMLINE)
+
+    assert profile["sequences"] == 4
+    assert profile["germline"][:12] == "QQQQQQQQQ-QQ"
+    assert profile["nt_sites"][9] == 0 and profile["nt_freq"][9] is None
+    assert profile["nt_freq"][0] == round(1 / 12, 4)
+    assert profile["silent"][:2] == [1, 0]
+    assert profile["replacement"][:2] == [0, 1]
+    assert profile["aa_freq"][:2] == [0.0, 0.25]
+    assert profile["substitutions"][1] == {"L": 0.25}
+
+    regions = profile["regions"]
+    assert regions["region"][0] == "fr1"
+    assert regions["replacement"][0] == 1 and regions["silent"][0] == 1
+    assert regions["rs_ratio"][0] == 1.0
+    assert regions["nt_mutations"][1:] == [0, 0, 0, 0]
+
+
+def test_profile_without_sequences_is_empty(tmp_path, monkeypatch):
+    profile = mutation_profile([], GERMLINE)
+    assert profile["sequences"] == 0 and profile["germline"][:3] == "QQQ"
+    assert set(profile["nt_freq"]) == {None} and profile["regions"]["nt_mutations"][0] == 0
+
+    # Light-chain column missing from the merged table: no member has a sequence
+    monkeypatch.setattr(profiles, "resolve_allele", lambda gene, species: "IGKV1*01")
+    monkeypatch.setattr(profiles, "gapped_v_germlines", lambda species: {"IGKV1*01": GERMLINE})
+    (tmp_path / "P").mkdir()
+    cache = AlignmentCache(str(tmp_path / "P" / "alignment_cache.sqlite"))
+    merged_df = pd.DataFrame(
+        {"sequence_id": ["s1"], "v_call_VDJ": ["IGHV1"], "v_call_VJ": ["IGKV1"], "IGH": [GERMLINE]}
+    )
+    result = {"lc_table": [{"sequence_id": "s1"}], "lc_ids": ["s1"], "lc_seqs": ["QQQ"]}
+    profile = profiles.cached_mutation_profile(
+        cache, "k", result, merged_df, "IGHV1", "IGKV1", "lc", "human"
+    )
+    assert profile["sequences"] == 0 and profile["columns"] == []
+
+
+def test_alignment_columns_follow_imgt_codons():
+    # Residues of codons 1-9 and 11-12; the alignment inserts a gap column
+    seq = "CAG" * 9 + "..." + "CAG" * 2
+    aligned = ["QQQQQQQQQ-QQ", "QQQQQQQQQ-QQ"]
+    assert alignment_columns(aligned, [seq, seq]) == list(range(1, 10)) + [None, 11, 12]
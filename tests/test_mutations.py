@@ -0,0 +1,42 @@
+import pandas as pd
+
+from app.services import mutations
+
+
+def _mutate(seq: str, position: int, base: str) -> str:
+    return seq[:position] + base + seq[position + 1 :]
+
+
+def test_annotate_mutations_counts_by_region(monkeypatch):
+    germline = "CAG" * 9 + "..." + "CAG" * 94
+    # FR1: CAG->CAA (silent) and CAG->CTG (Q->L); CDR1 (codon 27): CAG->AAG
+    seq = _mutate(germline, 2, "A")
+    seq = _mutate(seq, 4, "T")
+    seq = _mutate(seq, 78, "A")
+    monkeypatch.setattr(mutations, "gapped_v_germlines", lambda species: {"IGHV1-1*01": germline})
+
+    merged_df = pd.DataFrame(
+        {
+            "IGH": [seq + "GCCTGG", germline, seq],
+            "v_call_VDJ": ["IGHV1-1*02", "IGHV1-1*01", "IGHV9-9*01"],
+            "IGK": ["", "", ""],
+            "locus_VJ": ["IGK", "IGK", "IGK"],
+            "v_call_VJ": ["None", "None", "None"],
+        }
+    )
+    mutations.annotate_mutations(merged_df, "mouse")
+
+    first = merged_df.loc[0]
+    assert first["mu_count_VDJ"] == 3
+    assert first["mu_count_fr1_VDJ"] == 2
+    assert first["mu_count_cdr1_VDJ"] == 1
+    assert first["mu_aa_count_VDJ"] == 2
+    assert abs(first["mu_freq_VDJ"] - 3 / (3 * 103)) < 1e-6
+    assert abs(first["mu_aa_freq_cdr_VDJ"] - 1 / 22) < 1e-6
+
+    assert merged_df.loc[1, "mu_count_VDJ"] == 0
+    assert merged_df.loc[1, "mu_freq_VDJ"] == 0
+    # Unknown gene and missing light chains
+    assert pd.isna(merged_df.loc[2, "mu_count_VDJ"])
+    assert pd.isna(merged_df.loc[2, "mu_freq_VDJ"])
+    assert merged_df["mu_count_VJ"].isna().all()
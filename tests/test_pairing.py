@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+
+from app.services.alignment_cache import AlignmentCache
+from app.services.pairing import cached_pairing_matrix, dense_counts, filter_values, pairing_matrix
+
+
+def _merged() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "v_call_VDJ": ["IGHV1", "IGHV1", "IGHV2", "IGHV1", "None", "IGHV2"],
+            "v_call_VJ": ["IGKV1", "IGKV2", "IGKV1", "IGKV1", "IGKV1", None],
+            "isotype": ["IgM", "IgG", "IgG", "IgM", "IgM", "IgM"],
+        }
+    )
+
+
+def test_pairing_matrix_counts_pairs():
+    matrix = pairing_matrix(_merged())
+    assert matrix["hc_genes"] == ["IGHV1", "IGHV2"]
+    assert matrix["lc_genes"] == ["IGKV1", "IGKV2"]
+    assert matrix["cells"] == 4
+    assert dense_counts(matrix).tolist() == [[2, 1], [1, 0]]
+    assert matrix["hc_totals"] == [3, 1] and matrix["lc_totals"] == [3, 1]
+
+
+def test_pairing_matrix_filters():
+    merged_df = _merged()
+    matrix = pairing_matrix(merged_df, isotype="IgM")
+    assert (matrix["hc_genes"], matrix["lc_genes"]) == (["IGHV1"], ["IGKV1"])
+    assert dense_counts(matrix).tolist() == [[2]]
+    assert filter_values(merged_df) == {"isotype": ["IgM", "IgG"], "sample": []}
+    with pytest.raises(ValueError):
+        pairing_matrix(merged_df, sample="s1")
+
+
+def test_cached_pairing_matrix_is_keyed_on_the_project_version(tmp_path):
+    (tmp_path / "P").mkdir()
+    cache = AlignmentCache(str(tmp_path / "P" / "alignment_cache.sqlite"))
+    first = cached_pairing_matrix(cache, _merged(), "v1", isotype="IgM")
+    # Same version: served from the store without looking at the data
+    assert cached_pairing_matrix(cache, _merged().iloc[:0], "v1", isotype="IgM") == first
+    assert cached_pairing_matrix(cache, _merged().iloc[:1], "v2", isotype="IgM")["cells"] == 1
+    assert cache.stats()["kinds"]["pairing"]["entries"] == 2
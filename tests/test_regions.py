@@ -0,0 +1,44 @@
+import pandas as pd
+
+from app.services.regions import annotate_regions, region_name
+
+
+def _heavy_row():
+    # 104 V codons with IMGT codon 10 gapped, a 5-codon CDR3 and 4 FR4 codons
+    v_region = "CAG" * 9 + "..." + "CAG" * 94
+    gapped = v_region + "GCC" * 5 + "TGG" * 4
+    junction = "TGT" + "GCC" * 5 + "TGG"
+    return gapped, junction
+
+
+def test_annotate_regions_labels_and_bounds():
+    gapped, junction = _heavy_row()
+    merged_df = pd.DataFrame(
+        {
+            "IGH": [gapped, ""],
+            "junction_VDJ": [junction, "None"],
+            "IGK": ["", ""],
+            "locus_VJ": ["IGK", "None"],
+            "junction_VJ": ["None", "None"],
+        }
+    )
+    annotate_regions(merged_df)
+
+    expected = "1" * 25 + "A" * 12 + "2" * 17 + "B" * 10 + "3" * 39 + "C" * 5 + "4" * 4
+    assert merged_df.loc[0, "regions_VDJ"] == expected
+    assert (merged_df.loc[0, "cdr1_start_VDJ"], merged_df.loc[0, "cdr1_end_VDJ"]) == (26, 37)
+    assert (merged_df.loc[0, "cdr3_start_VDJ"], merged_df.loc[0, "cdr3_end_VDJ"]) == (104, 108)
+    assert merged_df.loc[1, "regions_VDJ"] == ""
+    assert pd.isna(merged_df.loc[1, "cdr3_start_VDJ"])
+    assert merged_df["regions_VJ"].tolist() == ["", ""]
+    assert region_name("C", "hc") == "CDR-H3"
+
+
+def test_missing_junction_leaves_cdr3_unknown():
+    gapped, _ = _heavy_row()
+    merged_df = pd.DataFrame({"IGH": [gapped], "junction_VDJ": ["None"]})
+    annotate_regions(merged_df)
+
+    regions = merged_df.loc[0, "regions_VDJ"]
+    assert regions.endswith("3" + "?" * 9)
+    assert pd.isna(merged_df.loc[0, "cdr3_start_VDJ"])
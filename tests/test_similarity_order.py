@@ -0,0 +1,51 @@
+import numpy as np
+from scipy.cluster.hierarchy import leaves_list, linkage
+from scipy.spatial.distance import pdist
+
+from app.services.ddl import similarity_order
+from app.services.sequence_arrays import decode_sequences, encode_sequences
+
+
+def random_family(rng, n_rows, width, n_families=4, mutation_rate=0.1):
+    """Sequences drawn from a few ancestors with point mutations."""
+    alphabet = np.array(list("ACDEFGHIKLMNPQRSTVWY-"))
+    ancestors = rng.choice(alphabet, size=(n_families, width))
+    rows = ancestors[rng.integers(0, n_families, n_rows)].copy()
+    mutate = rng.random(rows.shape) < mutation_rate
+    rows[mutate] = rng.choice(alphabet, size=mutate.sum())
+    return ["".join(row) for row in rows]
+
+
+def test_encoding_round_trip():
+    seqs = ["ACD-.", "WY*X"]
+    assert decode_sequences(encode_sequences(seqs)) == ["ACD--", "WY*X-"]
+
+
+def test_exact_order_matches_callback_metric():
+    rng = np.random.default_rng(1)
+    seqs = random_family(rng, 60, 40)
+
+    arr = np.array([list(s) for s in seqs])
+    max_len = arr.shape[1]
+    dist_vec = pdist(arr, lambda u, v: np.sum(u != v) / max_len)
+    expected = leaves_list(linkage(dist_vec, method="average"))
+
+    assert np.array_equal(similarity_order(encode_sequences(seqs)), expected)
+
+
+def test_approximate_order_is_a_grouped_permutation():
+    rng = np.random.default_rng(2)
+    seqs = random_family(rng, 400, 50, n_families=3, mutation_rate=0.02)
+    codes = encode_sequences(seqs)
+
+    order = similarity_order(codes, exact_limit=50)
+    assert sorted(order.tolist()) == list(range(len(seqs)))
+
+    # Neighbouring rows should mostly come from the same family
+    neighbour_dist = (codes[order][1:] != codes[order][:-1]).mean(axis=1)
+    assert np.median(neighbour_dist) < 0.1
+
+
+def test_identical_rows_terminate():
+    codes = encode_sequences(["ACDEF"] * 30)
+    assert sorted(similarity_order(codes, exact_limit=5).tolist()) == list(range(30))
@@ -0,0 +1,29 @@
+from app.services.tree_layout import layout_view, tree_layout
+
+NEWICK = "((A:1,B:1):1,(C:1,(D:1,E:1):0.5):1);"
+
+
+def test_tree_layout_positions_leaves_in_order():
+    layout = tree_layout(NEWICK)
+    leaves = [i for i, count in enumerate(layout["leaf_count"]) if count == 1]
+    assert [layout["name"][i] for i in leaves] == ["A", "B", "C", "D", "E"]
+    assert [layout["position"][i] for i in leaves] == [0, 1, 2, 3, 4]
+    assert layout["leaf_count"][0] == 5 and layout["max_distance"] == 2.5
+    # Internal nodes sit at the mean of their children
+    assert layout["position"][1] == 0.5
+
+
+def test_layout_view_collapses_narrow_subtrees_unless_expanded():
+    layout = tree_layout(NEWICK)
+    full = layout_view(layout, "rectangular", 100, 500, min_px=3)
+    assert len(full["nodes"]) == layout["nodes"]
+
+    # 10px per leaf: two-leaf subtrees (20px) collapse below 25px
+    lod = layout_view(layout, "rectangular", 100, 50, min_px=25)
+    collapsed = [node for node in lod["nodes"] if node["collapsed"]]
+    assert {node["leaves"] for node in collapsed} == {2}
+    assert len(lod["nodes"]) < layout["nodes"]
+
+    opened = layout_view(layout, "radial", 100, 50, min_px=1000, expand={1})
+    visible = {node["id"] for node in opened["nodes"]}
+    assert {2, 3} <= visible and all("angle" in node for node in opened["nodes"])
@@ -0,0 +1,115 @@
+import threading
+import time
+
+import numpy as np
+from Bio.Phylo.TreeConstruction import DistanceTreeConstructor
+
+from app.services import trees
+from app.services.distances import distance_matrix_of, to_distance_matrix
+from app.services.alignment_cache import AlignmentCache, cached_artifact
+from app.services.alignment_codec import COMPACT_FORMAT
+
+
+def make_cache(tmp_path):
+    (tmp_path / "P").mkdir(exist_ok=True)
+    return AlignmentCache(
+        str(tmp_path / "P" / "alignment_cache.sqlite"), max_bytes=1 << 20, total_bytes=1 << 20
+    )
+
+
+def test_tree_from_compact_result(tmp_path):
+    result = {
+        "format": COMPACT_FORMAT,
+        "hc_ids": ["a", "b", "c"],
+        "hc_seqs": ["ACDEFG", "ACDEFH", "WCDEFH"],
+        "hc_label_map": {"a": "A-HC", "b": "B-HC", "c": "C-HC"},
+    }
+    newick = trees.cached_tree(make_cache(tmp_path), "k", result, "hc")
+    assert all(label in newick for label in ("A-HC", "B-HC", "C-HC"))
+    assert newick.endswith(";")
+
+
+def test_too_few_sequences_is_not_cached(tmp_path):
+    cache = make_cache(tmp_path)
+    result = {
+        "format": COMPACT_FORMAT,
+        "hc_ids": ["a"],
+        "hc_seqs": ["ACD"],
+        "hc_label_map": {"a": "A-HC"},
+    }
+    assert trees.cached_tree(cache, "k", result, "hc") is None
+    assert cache.stats()["kinds"]["tree"]["entries"] == 0
+
+
+def test_concurrent_requests_share_one_build(tmp_path):
+    cache = make_cache(tmp_path)
+    calls = []
+
+    def build():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"value": 1}
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(cached_artifact(cache, "k", "x", "test", build))
+        )
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{"value": 1}] * 4
+
+
+def test_array_builders_match_biopython():
+    rng = np.random.default_rng(3)
+    residues = np.array(list("ACDEFGHIKLMNPQRSTVWY-"))
+    ancestors = rng.choice(residues, size=(4, 50))
+    for n in (2, 3, 7, 30):
+        rows = ancestors[rng.integers(0, 4, n)].copy()
+        mutate = rng.random(rows.shape) < 0.1
+        rows[mutate] = rng.choice(residues, size=mutate.sum())
+        names = [f"s{i}" for i in range(n)]
+        distances = distance_matrix_of(["".join(row) for row in rows])
+        reference = DistanceTreeConstructor()
+        dm = to_distance_matrix(names, distances)
+        assert trees.write_newick(trees.neighbor_joining(names, distances)) == (
+            trees.write_newick(reference.nj(dm))
+        )
+        assert trees.write_newick(trees.upgma(names, distances)) == (
+            trees.write_newick(reference.upgma(dm))
+        )
+
+
+def test_collapsed_leaves_weight_identical_and_clone_members():
+    result = {
+        "format": COMPACT_FORMAT,
+        "hc_ids": ["a", "b", "c", "d"],
+        "hc_seqs": ["ACDEFG", "ACDEFG", "ACDEFH", "WWWWWW"],
+        "hc_label_map": {k: f"{k.upper()}-HC" for k in "abcde"},
+        "hc_table": [
+            {"sequence_id": "a", "isotype": "IgG", "clone_id": "1", "display_name": "A"},
+            {"sequence_id": "b", "isotype": "IgM", "clone_id": "1", "display_name": "B"},
+            {"sequence_id": "c", "isotype": "IgG", "clone_id": "1", "display_name": "C"},
+            {"sequence_id": "d", "isotype": "IgA", "clone_id": None, "display_name": "D"},
+            {"sequence_id": "e", "isotype": "IgA", "clone_id": None, "display_name": "E"},
+        ],
+        # "d" was aligned as the representative of a cluster {d, e}
+        "hc_clusters": {"members": {"d": ["d", "e"]}},
+    }
+
+    identical = {leaf["label"]: leaf for leaf in trees.collapsed_leaves(result, "hc", "identical")}
+    assert identical["A-HC"]["count"] == 2
+    assert identical["A-HC"]["isotypes"] == {"IgG": 1, "IgM": 1}
+    assert identical["D-HC"]["members"] == ["D", "E"]
+
+    clone = {leaf["label"]: leaf for leaf in trees.collapsed_leaves(result, "hc", "clone")}
+    assert clone["clone_1"]["count"] == 3 and clone["clone_1"]["seq"] == "ACDEFG"
+    assert set(clone) == {"clone_1", "D-HC"}
+
+    tree = trees.build_collapsed_tree(result, "hc", "nj", "clone")
+    assert tree["newick"] is not None and set(tree["leaves"]) == {"clone_1", "D-HC"}
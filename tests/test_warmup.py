@@ -0,0 +1,67 @@
+import pandas as pd
+
+from app.services import warmup
+
+
+def test_top_pairs_by_cell_count():
+    df = pd.DataFrame(
+        {
+            "v_call_VDJ": ["H1", "H1", "H2", "H2", "H2", "H3", "None", "None", "None"],
+            "v_call_VJ": ["K1", "K1", "K1", "K2", "K2", "K1", "K1", "K1", "K1"],
+        }
+    )
+    assert warmup.top_pairs(df, 2) == [("H1", "K1"), ("H2", "K2")]
+
+
+def test_cancelled_job_does_not_run(monkeypatch):
+    calls = []
+    monkeypatch.setattr(warmup, "load_project", lambda project: calls.append(project))
+    job = warmup.WarmupJob("P", "human")
+    job.cancel()
+    job.run({"vdj_path": "x.h5ddl", "adata_path": "NULL", "project_name": "P"})
+    assert calls == [] and job.status == "cancelled"
+
+
+def test_interactive_request_counter():
+    with warmup.interactive_request():
+        assert warmup._interactive == 1
+    assert warmup._interactive == 0
+
+
+def test_warm_pair_caches_matrices_of_both_chains(tmp_path, monkeypatch):
+    from app.services.alignment_cache import AlignmentCache, artifact_key
+
+    result = {
+        "format": "compact",
+        "hc_ids": ["a", "b", "c"],
+        "hc_seqs": ["ACDE", "ACDF", "GCDF"],
+        "hc_label_map": {"a": "A-HC", "b": "B-HC", "c": "C-HC"},
+        "lc_ids": ["a"],
+        "lc_seqs": ["MNPQ"],
+        "lc_label_map": {"a": "A-LC"},
+    }
+    monkeypatch.setattr(warmup, "cached_alignment", lambda *args: ("k", result))
+    monkeypatch.setattr(warmup, "cached_tree", lambda *args: None)
+    (tmp_path / "P").mkdir()
+    cache = AlignmentCache(str(tmp_path / "P" / "alignment_cache.sqlite"))
+
+    assert warmup.warm_pair(cache, None, "H1", "K1", "human")
+    kinds = cache.stats()["kinds"]["distances"]
+    assert kinds["entries"] == 2
+    assert cache.get(artifact_key("k", "hc_mismatch_clustering"), "distances") is not None
+
+
+def test_warm_pair_stops_between_artifacts(tmp_path, monkeypatch):
+    result = {"hc_ids": ["a", "b"], "hc_seqs": ["ACDE", "ACDF"], "lc_ids": [], "lc_seqs": []}
+    trees = []
+    monkeypatch.setattr(warmup, "cached_alignment", lambda *args: ("k", result))
+    monkeypatch.setattr(warmup, "cached_tree", lambda *args: trees.append(args[3]))
+    monkeypatch.setattr(warmup, "matrix_sequences", lambda result, chain: [])
+
+    job = warmup.WarmupJob("P", "human")
+    proceed = iter([True, False])
+    assert not warmup.warm_pair(None, None, "H1", "K1", "human", proceed=lambda: next(proceed))
+    assert trees == ["hc"]
+
+    job.cancel()
+    assert not job.yield_to_interactive()